@@ -11,6 +11,7 @@ from panda3d.core import CullBinManager
 
 from direct.showbase.ShowBase import ShowBase
 
+from p3d_ssbo.gltypes import GlFloat
 from p3d_ssbo.gltypes import GlVec3
 from p3d_ssbo.gltypes import GlUInt
 from p3d_ssbo.gltypes import Struct
@@ -19,9 +20,10 @@ from p3d_ssbo.algos.raw_glsl import RawGLSL
 from p3d_ssbo.algos.copy import Copy
 from p3d_ssbo.algos.random_number_generator import MurmurHash
 from p3d_ssbo.algos.spatial_hash import SpatialHash
-from p3d_ssbo.algos.spatial_hash import PivotTable
+from p3d_ssbo.algos.spatial_hash import GridBuild
+from p3d_ssbo.algos.spatial_hash import num_cells
 from p3d_ssbo.algos.spatial_hash import PairwiseAction
-from p3d_ssbo.algos.bitonic_sort import BitonicSort
+from p3d_ssbo.algos.reduce import Reduce
 from p3d_ssbo.algos import boids as boids_module
 from p3d_ssbo.tools.ssbo_particles import SSBOParticles
 
@@ -61,9 +63,7 @@ base.cam.set_y(-2.0)
 # boids will be within it.
 
 
-# So, how many boids do we want? So far, most shaders assume that we
-# will use a multiple of 32, but the bitonic sort implementation
-# requires a power of 2 that is at least 2**6 = 64.
+# So, how many boids do we want? Any number will do.
 num_elements = 2**14
 
 
@@ -71,12 +71,20 @@ num_elements = 2**14
 # that so far that means that it will stretch from the oriin to the
 # provided coordinate, while being axis-aligned.
 grid_vol = (1.0, 1.0, 1.0)
-# And into how many cells do we split our grid? The product of the cells
-# per axis also has to be a multiple of 32, and for some as of yet
+# And into how many cells do we split our grid? For some as of yet
 # undetermined reason, 64**3 = 262144 seems to be the maximum. However,
 # more cells doesn't automatically mean better performance; This is a
 # parameter that has to be tuned.
 grid_res = (16, 16, 16)
+# Cells can be numbered row by row ('linear'), or along a Z-order curve
+# ('morton'), which keeps the boids of neighbouring cells closer together
+# in memory once they are sorted by cell. The pivot table then has to
+# have an entry for each number that the curve passes through. With
+# 'hashed', the grid would not end at the volume anymore; Cells of the
+# same size would continue in all directions, sharing the entries of a
+# pivot table of any size, which is passed to `SpatialHash` and
+# `PairwiseAction` as `table_size`.
+cell_indexing = 'morton'
 # How far will our boids be able to sense? The smaller, the better,
 # though currently there are no further gains once the radius becomes
 # smaller than the shortest edge of a cell
@@ -124,12 +132,24 @@ pivot = Struct(
 # pivot_table_data = [(start_0, len_0), (start_1, len_1), ...]
 # buffer_data = (boids_data, pivot_table_data)
 # ```
+#
+# If the initial state is generated with NumPy anyway, it is much faster
+# to pass it as columns, keyed by the path to the field:
+#
+# ```python
+# buffer_data = {
+#     'boids.pos': np.random.random((num_elements, 3)),
+#     'boids.dir': np.random.random((num_elements, 3)) - 0.5,
+# }
+# ```
 data_buffer = Buffer(
     'dataBuffer',
     boids('boids', num_elements),
-    pivot('pivot', grid_res[0] * grid_res[1] * grid_res[2]),
+    pivot('pivot', num_cells(grid_res, cell_indexing)),
     # This would feed in the initial data:
     #initial_data=buffer_data,
+    # Passing `layout='soa'` would store each field of the boids in an
+    # array of its own, which the shaders can read more efficiently.
     # The following line is left here for hunting bugs.
     #boids('boids', num_elements, unbounded=True),
 )
@@ -153,19 +173,18 @@ spatial_hash = SpatialHash(
     ('boids', 'pos', 'hashIdx'),  # array, position field, hash field
     grid_vol,  # Hash grid volume
     grid_res,  # Hash grid resolution
+    indexing=cell_indexing,
 )
-# Then we sort the array of boids by their spatial hashes.
-sorter = BitonicSort(
-    data_buffer,
-    ('boids', 'hashIdx'),
-)
-# Now we create the pivot table data. The nth element of the pivot table
-# stores where in the boid array the first boid with hash n is, and how
-# many there are.
-pivot = PivotTable(
+# Then we sort the array of boids by their spatial hashes, and create the
+# pivot table data. The nth element of the pivot table stores where in
+# the boid array the first boid with hash n is, and how many there are.
+# Both are done in one go by a counting sort: Count the boids in each
+# cell, sum up the counts to get where each cell's boids start, and move
+# each boid into the next free place of its cell.
+grid = GridBuild(
     data_buffer,
-    ('boids', 'hashIdx'),  # What array to build the pivot table for,
-    # and which element to use as the key.
+    ('boids', 'hashIdx'),  # What array to sort and build the pivot
+    # table for, and which element to use as the key.
     ('pivot', 'start', 'len'),  # The pivot table, and where it stores
     # start and length.
 )
@@ -208,6 +227,7 @@ mover = PairwiseAction(
     boids_module.declarations,
     boids_module.processing,
     boids_module.combining,
+    indexing=cell_indexing,
     src_args=dict(
         gridRes=grid_res,
         gridVol=grid_vol,
@@ -223,6 +243,29 @@ movement_actualizer = Copy(
     (('boids', 'nextPos'), ('boids', 'pos')),
     (('boids', 'nextDir'), ('boids', 'dir')),
 )
+# To know where the flock is and how lively it is, we do not need to
+# look at every single boid on the CPU. Instead, reductions boil the
+# boids down to a few numbers on the GPU, and only those are read back:
+# The flock's bounding box, the sum of the directions (which are the
+# boids' velocities), and that of their kinetic energies.
+flock_bounds = Reduce(data_buffer, ('boids', 'pos'), 'aabb')
+flock_velocity = Reduce(data_buffer, ('boids', 'dir'), 'sum')
+flock_energy = Reduce(
+    data_buffer,
+    ('boids', 'dir'),
+    'sum',
+    value=(GlFloat, '0.5 * dot(value, value)'),
+)
+
+
+def print_flock_stats():
+    lower, upper = flock_bounds.read()
+    velocity = [c / num_elements for c in flock_velocity.read()]
+    print(f"Flock bounds: {lower} to {upper}")
+    print(f"Mean velocity: {velocity}, kinetic energy: {flock_energy.read()}")
+
+
+base.accept('f', print_flock_stats)
 
 
 # User interfaces are also not made of the stuff that is relevant here,
@@ -246,10 +289,12 @@ rng.dispatch()
 bin_mgr = CullBinManager.get_global_ptr()
 stages = [
     ("cmp_spatial_hash", spatial_hash),
-    ("cmp_sort_spatial_hashes", sorter),
-    ("cmp_pivot_table", pivot),
+    ("cmp_grid_build", grid),
     ("cmp_mover", mover),
     ("cmp_mover_2", movement_actualizer),
+    ("cmp_flock_bounds", flock_bounds),
+    ("cmp_flock_velocity", flock_velocity),
+    ("cmp_flock_energy", flock_energy),
 ]
 for idx, (bin_name, shader) in enumerate(stages):
     bin_mgr.add_bin(bin_name, CullBinManager.BT_fixed, -20+idx)
@@ -274,7 +319,10 @@ for idx, (bin_name, shader) in enumerate(stages):
 # ```
 #
 # The structure of the data is the same as would have been fed into
-# `Buffer(initial_data=..)`, but would consist solely of tuples.
+# `Buffer(initial_data=..)`, but would consist solely of tuples. If you
+# only want to look at a few boids, `data_buffer.view(data)` is a lot
+# cheaper, as it decodes only what you index, e.g.
+# `data_buffer.view(data).boids[42].pos`.
 
 
 # And with that, let's enjoy some murmurations.
@@ -42,7 +42,6 @@ base.set_frame_rate_meter(True)
 # I've managed to use 2**20 (a million) numbers and beyond, but there is
 # a weird pause after caling `base.run()` when using those higher
 # numbers. Debugging is needed.
-# The minima are 2**5 for the rng, and 2**6 for the sorter.
 num_elements = 2**10
 print(f"Configured for {num_elements} elements.")
 
@@ -1,107 +1,394 @@
 from math import log2
 
-from jinja2 import Template
-
 from panda3d.core import BoundingVolume
 from panda3d.core import NodePath
 from panda3d.core import ComputeNode
-from panda3d.core import Shader
 from panda3d.core import ShaderAttrib
 
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlInt
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.gltypes import _make_shader_buffer
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
 
+# The sorting network is the variant of the bitonic sort in which every
+# comparison puts the smaller key at the lower index: In each stage, a
+# flip step compares the two halves of each block mirrored, and then
+# disperse steps compare elements `span` apart, halving it each step.
+# The network is built for the next power of 2, and positions past the
+# end of the array count as larger than all elements. As such, they
+# never have to be moved, and comparisons with them are skipped.
 sorter_template = """#version 430
 layout (local_size_x = 32, local_size_y = 1) in;
 
 {{ssbo}}
 
-uniform int span;
-uniform int reverseSpan;
+uniform uint span;
+uniform bool flip;
 
-void compare(int low, int high) {
-  {{type_name}} dataLow = {{array_name}}[low];
-  {{type_name}} dataHigh = {{array_name}}[high];
-  if (dataLow.{{key}} > dataHigh.{{key}}) {
-    {{array_name}}[low] = dataHigh;
-    {{array_name}}[high] = dataLow;
+void compare(uint low, uint high) {
+  if ({{array_name}}_get_{{key}}(low) > {{array_name}}_get_{{key}}(high)) {
+    {{type_name}} dataLow = {{array_name}}_get(low);
+    {{array_name}}_set(low, {{array_name}}_get(high));
+    {{array_name}}_set(high, dataLow);
   }
 }
 
 void main() {
-  // From where to shere is this span?
-  int idx = int(gl_GlobalInvocationID.x);
-  int idxOfSpan = int(floor(idx / span));
-  int spanBoundLow = idxOfSpan * span * 2;
-  int spanBoundHigh = (idxOfSpan + 1) * span * 2 - 1;
-
-  // In what direction does this span go, and where is its start *really*?
-  int reversed = int(round(mod(idxOfSpan / reverseSpan, 2))) * (-2) + 1;  // +1 = straight, -1 = reversed
-  int spanStart = abs(min(spanBoundLow * reversed, spanBoundHigh * reversed));
-
   // Which pair of elements do we compare?
-  int idxInSpan = int(round(mod(idx, span)));
-  int idxLow = spanStart + idxInSpan * reversed;
-  int idxHigh = idxLow + span * reversed;
+  uint idx = gl_GlobalInvocationID.x;
+  uint blockStart = (idx / span) * span * 2u;
+  uint idxInSpan = idx % span;
+  uint idxLow = blockStart + idxInSpan;
+  uint idxHigh = flip ? blockStart + span * 2u - 1u - idxInSpan : idxLow + span;
 
   // Compare, and switch if necessary.
-  compare(idxLow, idxHigh);
+  if (idxHigh < {{array_name}}_length()) {
+    compare(idxLow, idxHigh);
+  }
+}
+"""
+
+
+# Steps whose pairs are less than half a tile apart never compare
+# elements of different tiles, so they all run in one dispatch, on keys
+# and indices in shared memory. Afterwards, each tile's elements are
+# permuted in place, reading all of them before writing any.
+local_sorter_template = """#version 430
+layout (local_size_x = {{tile_size // 2}}, local_size_y = 1) in;
+
+{{ssbo}}
+
+uniform int firstStage;
+uniform int lastStage;
+
+shared {{key_type}} tileKeys[{{tile_size}}];
+shared uint tileIndices[{{tile_size}}];
+
+void main() {
+  uint tid = gl_LocalInvocationID.x;
+  uint tileStart = gl_WorkGroupID.x * {{tile_size}}u;
+  uint numElements = {{array_name}}_length();
+  for (uint copy = 0u; copy < 2u; copy++) {
+    uint localIdx = tid * 2u + copy;
+    if (tileStart + localIdx < numElements) {
+      tileKeys[localIdx] = {{array_name}}_get_{{key}}(tileStart + localIdx);
+    }
+    tileIndices[localIdx] = localIdx;
+  }
+  barrier();
+
+  for (int stage = firstStage; stage <= lastStage; stage++) {
+    for (int step = min(stage, {{local_levels - 1}}); step >= 0; step--) {
+      uint span = 1u << step;
+      uint blockStart = (tid / span) * span * 2u;
+      uint idxInSpan = tid % span;
+      uint idxLow = blockStart + idxInSpan;
+      uint idxHigh = (step == stage) ? blockStart + span * 2u - 1u - idxInSpan : idxLow + span;
+      if ((tileStart + idxHigh < numElements) && (tileKeys[idxLow] > tileKeys[idxHigh])) {
+        {{key_type}} key = tileKeys[idxLow];
+        tileKeys[idxLow] = tileKeys[idxHigh];
+        tileKeys[idxHigh] = key;
+        uint index = tileIndices[idxLow];
+        tileIndices[idxLow] = tileIndices[idxHigh];
+        tileIndices[idxHigh] = index;
+      }
+      barrier();
+    }
+  }
+
+  {{type_name}} elements[2];
+  for (uint copy = 0u; copy < 2u; copy++) {
+    uint localIdx = tid * 2u + copy;
+    if (tileStart + localIdx < numElements) {
+      elements[copy] = {{array_name}}_get(tileStart + tileIndices[localIdx]);
+    }
+  }
+  memoryBarrierBuffer();
+  barrier();
+  for (uint copy = 0u; copy < 2u; copy++) {
+    uint localIdx = tid * 2u + copy;
+    if ((tileStart + localIdx < numElements) && (tileIndices[localIdx] != localIdx)) {
+      {{array_name}}_set(tileStart + localIdx, elements[copy]);
+    }
+  }
+}
+"""
+
+
+# In the key/index modes, the sorters above work on an array of pairs of
+# the key (as an order-preserving `uint`) and the element's index, which
+# is filled from the sorted array first. In the `gather` mode, the
+# elements are then permuted into a scratch array in the sorted order,
+# and copied back.
+init_pairs_template = """#version 430
+layout (local_size_x = 32, local_size_y = 1) in;
+
+{{ssbo}}
+
+{{pairs}}
+
+void main() {
+  uint idx = gl_GlobalInvocationID.x;
+  if (idx >= {{array_name}}_length()) {
+    return;
+  }
+{% if key_type == 'float' %}
+  uint key = floatBitsToUint({{array_name}}_get_{{key}}(idx));
+  // Negative floats sort in reverse, and before the positive ones.
+  key ^= ((key >> 31) == 1u) ? 0xFFFFFFFFu : 0x80000000u;
+{% elif key_type == 'int' %}
+  uint key = uint({{array_name}}_get_{{key}}(idx)) ^ 0x80000000u;
+{% else %}
+  uint key = {{array_name}}_get_{{key}}(idx);
+{% endif %}
+  {{pairs_array}}_set(idx, {{pair_type}}(key, idx));
+}
+"""
+
+
+gather_template = """#version 430
+layout (local_size_x = 32, local_size_y = 1) in;
+
+{{ssbo}}
+
+{{pairs}}
+
+layout(std430) buffer {{scratch_name}} {
+  {{type_name}} {{scratch_name}}Elements[];
+};
+
+uniform bool toScratch;
+
+void main() {
+  uint idx = gl_GlobalInvocationID.x;
+  if (idx >= {{array_name}}_length()) {
+    return;
+  }
+  if (toScratch) {
+    {{scratch_name}}Elements[idx] = {{array_name}}_get({{pairs_array}}_get_index(idx));
+  } else {
+    {{array_name}}_set(idx, {{scratch_name}}Elements[idx]);
+  }
 }
 """
 
 
 class BitonicSort:
-    def __init__(self, ssbo, array_and_key, debug=False):
+    """
+    Sorts an array of any length by a key field. Steps that compare
+    elements less than `tile_size / 2` apart are done in shared memory,
+    in one dispatch per run of them; Only larger spans go through the
+    SSBO with one dispatch per step. `tile_size` has to be a power of 2
+    of up to 2048, or `None` to do all steps in global memory.
+
+    `mode` says what is moved around while sorting:
+
+    * `'elements'`: The array's elements themselves.
+    * `'gather'`: Pairs of key and index in the buffer `pairs`, after
+      which one pass moves each element to its sorted place.
+    * `'indices'`: Only those pairs; The array stays as it is, and
+      shaders that include `pairs.full_glsl()` and bind `pairs` read its
+      elements in sorted order through
+      `<array>_get(<array>Sorted_get_index(idx))`.
+
+    With large structs, the latter two move much less data.
+
+    The sorting network is built for the array's capacity, so resizable
+    arrays are sorted over their live elements, and the network is only
+    rebuilt when the capacity changes.
+    """
+    def __init__(self, ssbo, array_and_key, tile_size=512, mode='elements',
+                 debug=False):
         array_name, key = array_and_key
-        dims = ssbo.get_field(array_name).get_num_elements()
-        assert len(dims) == 1, "Only 1D arrays for now."
-        num_elements = dims[0]
+        assert mode in ('elements', 'gather', 'indices'), f"Unknown mode {mode}."
+        array = ssbo.get_field(array_name)
+        assert len(array.dims) == 1, "Only 1D arrays for now."
+        if tile_size is not None:
+            assert tile_size & (tile_size - 1) == 0, "Tiles must be a power of 2 long."
+            assert 2 <= tile_size <= 2048, "Tiles have 2 to 2048 elements."
+        if mode != 'elements':
+            key_field = array.get_field(key)
+            assert isinstance(key_field, (GlFloat, GlInt, GlUInt)) and key_field.dims == (), \
+                "Keys have to be float, int or uint scalars."
+        self.ssbo = ssbo
+        self.array_name = array_name
+        self.key = key
+        self.tile_size = tile_size
+        self.mode = mode
+        self.debug = debug
+        self.pairs = None
+        if mode != 'elements':
+            pair = Struct(
+                f'{array_name}SortPair',
+                GlUInt('key'),
+                GlUInt('index'),
+            )
+            # The pairs are as resizable as the array, so that their
+            # length is the array's.
+            resizable = array is ssbo.resizable_array
+            self.pairs = Buffer(
+                ssbo.glsl_type_name + 'SortPairs',
+                pair(f'{array_name}Sorted', array.dims[0], unbounded=resizable),
+                num_elements=ssbo.get_length(array_name) if resizable else None,
+            )
+        self.capacity = None
+        self.nodes = []
+        self.bin_name = None
+        self._build()
+
+    def _compute_shader(self, template, stage, **render_args):
+        source = render_template(template, **render_args)
+        if self.debug:
+            for line_nr, line_txt in enumerate(source.split('\n')):
+                print(f"{line_nr:4d}  {line_txt}")
+        name = self.__class__.__name__
+        if stage is not None:
+            name += "::" + stage
+        return compute_shader(source, name)
+
+    def _build(self):
+        # Sets up the shaders and the list of dispatches for the array's
+        # capacity, if that has changed.
+        array = self.ssbo.get_field(self.array_name)
+        capacity = array.dims[0]
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        num_levels = (capacity - 1).bit_length() if capacity > 1 else 0
+        num_elements = 2 ** num_levels  # as the network sees it
+        array_name = self.array_name
+        key = self.key
         render_args = dict(
-            ssbo=ssbo.full_glsl(),
-            type_name=ssbo.get_field(array_name).glsl_type_name,
+            ssbo=self.ssbo.full_glsl(),
+            type_name=array.glsl_type_name,
             array_name=array_name,
             key=key,
         )
-        template = Template(sorter_template)
-        source = template.render(**render_args)
-        if debug:
-            for line_nr, line_txt in enumerate(source.split('\n')):
-                print(f"{line_nr:4d}  {line_txt}")
-        shader = Shader.make_compute(Shader.SL_GLSL, source)
-        workgroups = (num_elements // 64, 1, 1)
-        self.ssbo = ssbo
-        self.shader = shader
-        self.workgroups = workgroups
-        sorter_arrays = []
-        for e in range(int(log2(num_elements))):
-            for s in range(e, -1, -1):
-                sorter_arrays.append((2**s, 2**(e-s)))
-        self.sorter_arrays = sorter_arrays
+        key_type = array.get_field(key).glsl_type_name
+        # (shader, workgroups, inputs) of each dispatch
+        steps = []
+
+        if self.mode != 'elements':
+            pair_field = self.pairs.fields[0]
+            pairs_array = pair_field.field_name
+            pair_args = dict(
+                render_args,
+                pairs=self.pairs.full_glsl(),
+                pairs_array=pairs_array,
+                pair_type=pair_field.glsl_type_name,
+                key_type=key_type,
+            )
+            shader = self._compute_shader(init_pairs_template, 'init', **pair_args)
+            steps.append((shader, ((capacity + 31) // 32, 1, 1), {}))
+            # From here on, the pairs are what is sorted.
+            render_args = dict(
+                ssbo=self.pairs.full_glsl(),
+                type_name=pair_field.glsl_type_name,
+                array_name=pairs_array,
+                key='key',
+            )
+            key_type = 'uint'
+
+        shader = self._compute_shader(sorter_template, None, **render_args)
+        workgroups = ((num_elements // 2 + 31) // 32, 1, 1)
+        local_levels = 0
+        if self.tile_size is not None:
+            tile_size = min(self.tile_size, num_elements)
+            local_levels = num_levels if tile_size < 2 else int(log2(tile_size))
+        if local_levels > 0:
+            local_shader = self._compute_shader(
+                local_sorter_template,
+                'local',
+                key_type=key_type,
+                tile_size=tile_size,
+                local_levels=local_levels,
+                **render_args,
+            )
+            local_workgroups = ((capacity + tile_size - 1) // tile_size, 1, 1)
+            inputs = dict(firstStage=0, lastStage=local_levels - 1)
+            steps.append((local_shader, local_workgroups, inputs))
+        for e in range(local_levels, num_levels):
+            for s in range(e, local_levels - 1, -1):
+                inputs = dict(span=2**s, flip=int(s == e))
+                steps.append((shader, workgroups, inputs))
+            if local_levels > 0:
+                inputs = dict(firstStage=e, lastStage=e)
+                steps.append((local_shader, local_workgroups, inputs))
+
+        if self.mode == 'gather':
+            scratch_name = self.ssbo.glsl_type_name + 'SortScratch'
+            shader = self._compute_shader(
+                gather_template,
+                'gather',
+                scratch_name=scratch_name,
+                **pair_args,
+            )
+            self.scratch = _make_shader_buffer(scratch_name, array._stride() * 4 * capacity)
+            for to_scratch in (1, 0):
+                inputs = {'toScratch': to_scratch, scratch_name: self.scratch}
+                steps.append((shader, ((capacity + 31) // 32, 1, 1), inputs))
+        self.steps = steps
+
+    @property
+    def _buffers(self):
+        if self.pairs is None:
+            return [self.ssbo]
+        return [self.ssbo, self.pairs]
 
     def dispatch(self):
-        np = NodePath("dummy")
-        np.set_shader(self.shader)
-        np.set_shader_input(
-            self.ssbo.glsl_type_name,
-            self.ssbo.ssbo,
-        )
-        for span, reverse_span in self.sorter_arrays:
-            np.set_shader_input('span', span)
-            np.set_shader_input('reverseSpan', reverse_span)
+        self.resize(self.ssbo)
+        for shader, workgroups, inputs in self.steps:
+            np = NodePath("dummy")
+            np.set_shader(shader)
+            for buffer in self._buffers:
+                np.set_shader_inputs(**buffer.shader_inputs())
+            np.set_shader_inputs(**inputs)
             sattr = np.get_attrib(ShaderAttrib)
             base.graphicsEngine.dispatch_compute(
-                self.workgroups,
+                workgroups,
                 sattr,
                 base.win.get_gsg(),
             )
 
     def attach(self, np, bin_name):
-        for idx, (span, reverse_span) in enumerate(self.sorter_arrays):
+        self.np = np
+        self.bin_name = bin_name
+        self._attach_nodes()
+        self.ssbo.add_resize_callback(self.resize)
+
+    def _attach_nodes(self):
+        for idx, (shader, workgroups, inputs) in enumerate(self.steps):
             cn = ComputeNode(f"BitonicSort-{idx}")
-            cn.add_dispatch(self.workgroups)
-            cnnp = np.attach_new_node(cn)
-            cnnp.set_shader(self.shader)
-            cnnp.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
-            cnnp.set_shader_input('span', span)
-            cnnp.set_shader_input('reverseSpan', reverse_span)
-            cnnp.set_bin(bin_name, idx)
+            cn.add_dispatch(workgroups)
+            cnnp = self.np.attach_new_node(cn)
+            cnnp.set_shader(shader)
+            for buffer in self._buffers:
+                buffer.bind(cnnp)
+            cnnp.set_shader_inputs(**inputs)
+            cnnp.set_bin(self.bin_name, idx)
             cn.set_bounds_type(BoundingVolume.BT_box)
-            cn.set_bounds(np.get_bounds())
+            cn.set_bounds(self.np.get_bounds())
+            self.nodes.append(cnnp)
+
+    def resize(self, ssbo):
+        if self.pairs is not None and self.pairs.resizable_array is not None:
+            # The pairs' contents are made anew by each sort, so nothing
+            # needs to be copied when they grow.
+            self.pairs.resize(self.ssbo.get_length(self.array_name))
+            self.pairs.pop_pending_copies()
+        old_capacity = self.capacity
+        self._build()
+        if self.capacity != old_capacity:
+            # The network has changed, so the nodes are made anew.
+            for cnnp in self.nodes:
+                for buffer in self._buffers:
+                    buffer.unbind(cnnp)
+                cnnp.remove_node()
+            self.nodes = []
+            if self.bin_name is not None:
+                self._attach_nodes()
@@ -30,8 +30,8 @@ combining = """
   // This happens after looping over all nearby boids.
   // Relevant variables first...
   float dt = 1.0/60.0;
-  vec3 pos = boids[boidIdx].pos;
-  vec3 dir = boids[boidIdx].dir;
+  vec3 pos = boids_get_pos(boidIdx);
+  vec3 dir = boids_get_dir(boidIdx);
 
   // Boid rules
   if (otherVecs > 0) {
@@ -89,8 +89,8 @@ combining = """
   //nextDir = clampVec(nextDir);
 
   // Write values into the boid
-  boids[boidIdx].nextPos = nextPos;
-  boids[boidIdx].nextDir = nextDir;
+  boids_set_nextPos(boidIdx, nextPos);
+  boids_set_nextDir(boidIdx, nextDir);
   // End of `boids.combining`
 """[1:-1]
 
@@ -1,11 +1,11 @@
-from jinja2 import Template
-
 from panda3d.core import BoundingVolume
 from panda3d.core import NodePath
 from panda3d.core import ComputeNode
-from panda3d.core import Shader
 from panda3d.core import ShaderAttrib
 
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
 
 copy_template = """#version 430
 layout (local_size_x = 32, local_size_y = 1) in;
@@ -14,7 +14,10 @@ layout (local_size_x = 32, local_size_y = 1) in;
 
 void main() {
   uint idx = gl_GlobalInvocationID.x;
-{% for ((source_array, source_field), (target_array, target_field)) in copies %}  {{target_array}}[idx].{{target_field}} = {{source_array}}[idx].{{source_field}};
+  if (idx >= {{length_array}}_length()) {
+    return;
+  }
+{% for ((source_array, source_field), (target_array, target_field)) in copies %}  {{target_array}}_set_{{target_field}}(idx, {{source_array}}_get_{{source_field}}(idx));
 {% endfor %}
 }
 """
@@ -23,33 +26,39 @@ void main() {
 class Copy:
     def __init__(self, ssbo, *copies, debug=False):
         dims = None
+        length_array = None
         for copy in copies:
             ((source_array, _), _) = copy
             struct = ssbo.get_field(source_array)
             struct_dims = struct.get_num_elements()
             if dims is None:
                 dims = struct_dims
+                length_array = source_array
             else:
                 assert dims == struct_dims, "Copy attempted on arrays of different sizes."
         render_args = dict(
             ssbo=ssbo.full_glsl(),
             copies=copies,
+            length_array=length_array,
         )
-        template = Template(copy_template)
-        source = template.render(**render_args)
+        source = render_template(copy_template, **render_args)
         if debug:
             for line_nr, line_txt in enumerate(source.split('\n')):
                 print(f"{line_nr+1:4d}  {line_txt}")
-        shader = Shader.make_compute(Shader.SL_GLSL, source)
-        workgroups = (dims[0] // 32, 1, 1)
+        shader = compute_shader(source, self.__class__.__name__)
         self.ssbo = ssbo
         self.shader = shader
-        self.workgroups = workgroups
+        self.length_array = length_array
+
+    @property
+    def workgroups(self):
+        num_elements = self.ssbo.get_length(self.length_array)
+        return ((num_elements + 31) // 32, 1, 1)
 
     def dispatch(self):
         np = NodePath("dummy")
         np.set_shader(self.shader)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         sattr = np.get_attrib(ShaderAttrib)
         base.graphicsEngine.dispatch_compute(
             self.workgroups,
@@ -63,9 +72,14 @@ class Copy:
         cnnp = np.attach_new_node(cn)
 
         cnnp.set_shader(self.shader)
-        cnnp.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp)
 
         cnnp.set_bin(bin_name, 0)
         cn.set_bounds_type(BoundingVolume.BT_box)
         cn.set_bounds(np.get_bounds())
+        self.cn = cn
         self.cnnp = cnnp
+        self.ssbo.add_resize_callback(self.resize)
+
+    def resize(self, ssbo):
+        self.cn.set_dispatch(0, self.workgroups)
@@ -0,0 +1,134 @@
+import numpy as np
+
+
+from panda3d.core import BoundingVolume
+from panda3d.core import NodePath
+from panda3d.core import ComputeNode
+from panda3d.core import ShaderAttrib
+from panda3d.core import GeomEnums
+
+from p3d_ssbo.gltypes import _make_shader_buffer
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+from p3d_ssbo.algos.resize_copy import ResizeCopy
+
+
+# The target SSBO is bound under its usual name, but declared as a flat
+# array of words, so that any word of it can be written to regardless of
+# its struct layout.
+scatter_template = """#version 430
+layout (local_size_x = 32, local_size_y = 1) in;
+
+layout(std430) buffer {{buffer_name}} {
+  uint words[];
+};
+
+layout(std430) buffer {{writes_name}} {
+  uvec2 writes[];  // (word index, word)
+};
+
+uniform uint numWrites;
+
+void main() {
+  uint idx = gl_GlobalInvocationID.x;
+  if (idx < numWrites) {
+    uvec2 write = writes[idx];
+    words[write.x] = write.y;
+  }
+}
+"""
+
+
+class PartialUpdate:
+    """
+    Uploads the data queued with `Buffer.write` into the buffer's
+    `ShaderBuffer`, touching only the words that were written. Every
+    written word is sent as an (index, word) pair in a small staging
+    buffer, and a compute shader scatters them into the SSBO.
+
+    Writes address the buffer as it is after any reallocation, so if the
+    buffer can be replaced, the copy of its old contents is done first,
+    with a `ResizeCopy` of its own; The buffer needs no other one.
+    """
+    def __init__(self, ssbo, debug=False):
+        writes_name = ssbo.glsl_type_name + 'Writes'
+        render_args = dict(
+            buffer_name=ssbo.glsl_type_name,
+            writes_name=writes_name,
+        )
+        source = render_template(scatter_template, **render_args)
+        if debug:
+            for line_nr, line_txt in enumerate(source.split('\n')):
+                print(f"{line_nr+1:4d}  {line_txt}")
+        shader = compute_shader(source, self.__class__.__name__)
+        self.ssbo = ssbo
+        self.shader = shader
+        self.writes_name = writes_name
+        self.copier = None
+        if ssbo._replaceable:
+            self.copier = ResizeCopy(ssbo, debug=debug)
+
+    def _staging_buffer(self):
+        indices, words = self.ssbo.pop_pending_writes()
+        if len(indices) == 0:
+            return None, None, 0
+        writes = np.empty((len(indices), 2), dtype=np.uint32)
+        writes[:, 0] = indices
+        writes[:, 1] = words
+        staging = _make_shader_buffer(self.writes_name, writes.tobytes(), GeomEnums.UH_stream)
+        workgroups = ((len(indices) + 31) // 32, 1, 1)
+        return staging, workgroups, len(indices)
+
+    def dispatch(self):
+        if self.copier is not None:
+            self.copier.dispatch()
+        staging, workgroups, num_writes = self._staging_buffer()
+        if staging is None:
+            return
+        nodepath = NodePath("dummy")
+        nodepath.set_shader(self.shader)
+        nodepath.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        nodepath.set_shader_input(self.writes_name, staging)
+        nodepath.set_shader_input('numWrites', num_writes)
+        sattr = nodepath.get_attrib(ShaderAttrib)
+        base.graphicsEngine.dispatch_compute(
+            workgroups,
+            sattr,
+            base.win.get_gsg(),
+        )
+
+    def attach(self, nodepath, bin_name):
+        # The number of writes changes from frame to frame, so the
+        # dispatch is set up anew by `update` every frame, and the node
+        # is hidden in frames without writes.
+        cn = ComputeNode(self.__class__.__name__)
+        cn.add_dispatch((1, 1, 1))
+        cnnp = nodepath.attach_new_node(cn)
+
+        cnnp.set_shader(self.shader)
+        self.ssbo.bind(cnnp)
+
+        cnnp.set_bin(bin_name, 0)
+        cn.set_bounds_type(BoundingVolume.BT_box)
+        cn.set_bounds(nodepath.get_bounds())
+        cnnp.hide()
+        self.cn = cn
+        self.cnnp = cnnp
+        if self.copier is not None:
+            # The copies go in front of the writes in the bin, and are set
+            # up by `update`, right before the writes are.
+            self.copier.attach(nodepath, bin_name, update_task=False)
+        base.task_mgr.add(self.update, self.__class__.__name__)
+
+    def update(self, task):
+        if self.copier is not None:
+            self.copier.update(task)
+        staging, workgroups, num_writes = self._staging_buffer()
+        if staging is None:
+            self.cnnp.hide()
+        else:
+            self.cn.set_dispatch(0, workgroups)
+            self.cnnp.set_shader_input(self.writes_name, staging)
+            self.cnnp.set_shader_input('numWrites', num_writes)
+            self.cnnp.show()
+        return task.cont
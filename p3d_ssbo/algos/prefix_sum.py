@@ -0,0 +1,314 @@
+from panda3d.core import BoundingVolume
+from panda3d.core import NodePath
+from panda3d.core import ComputeNode
+from panda3d.core import ShaderAttrib
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlInt
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import _make_shader_buffer
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
+
+# Each workgroup scans a tile of 512 values in shared memory with the
+# work-efficient up-sweep / down-sweep scan, writes the scanned tile, and
+# stores the tile's total in the block sums. These are scanned the same
+# way, level by level, until one tile holds them all. On the way back
+# down, each tile but the first gets the (inclusive) scanned sum of the
+# tiles before it added.
+#
+# All levels of block sums are stored one after another in one buffer,
+# the totals of each level right after the level's values, so the total
+# of all values ends up in its last entry.
+scan_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+{% if top_level %}
+{{ssbo}}
+{% endif %}
+
+layout(std430) buffer {{sums_name}} {
+  {{value_type}} blockSums[];
+};
+
+uniform uint count;
+uniform uint valuesOffset;
+uniform uint totalsOffset;
+
+shared {{value_type}} tile[512];
+
+{{value_type}} load(uint idx) {
+  if (idx >= count) {
+    return {{value_type}}(0);
+  }
+{% if top_level %}
+  return {{value_type}}({{array_name}}_get_{{key}}(idx));
+{% else %}
+  return blockSums[valuesOffset + idx];
+{% endif %}
+}
+
+void store(uint idx, {{value_type}} value) {
+  if (idx < count) {
+{% if top_level %}
+    {{out_array}}_set_{{out_field}}(idx, {{out_type}}(value));
+{% else %}
+    blockSums[valuesOffset + idx] = value;
+{% endif %}
+  }
+}
+
+void main() {
+  uint tid = gl_LocalInvocationID.x;
+  uint tileStart = gl_WorkGroupID.x * 512u;
+  {{value_type}} values[2];
+  values[0] = load(tileStart + tid * 2u);
+  values[1] = load(tileStart + tid * 2u + 1u);
+  tile[tid * 2u] = values[0];
+  tile[tid * 2u + 1u] = values[1];
+
+  // Up-sweep: Build a tree of partial sums in place.
+  uint offset = 1u;
+  for (uint numActive = 256u; numActive > 0u; numActive >>= 1) {
+    barrier();
+    if (tid < numActive) {
+      uint low = offset * (tid * 2u + 1u) - 1u;
+      uint high = offset * (tid * 2u + 2u) - 1u;
+      tile[high] += tile[low];
+    }
+    offset <<= 1;
+  }
+  barrier();
+  if (tid == 0u) {
+    blockSums[totalsOffset + gl_WorkGroupID.x] = tile[511];
+    tile[511] = {{value_type}}(0);
+  }
+
+  // Down-sweep: Turn the tree into an exclusive scan.
+  for (uint numActive = 1u; numActive < 512u; numActive <<= 1) {
+    offset >>= 1;
+    barrier();
+    if (tid < numActive) {
+      uint low = offset * (tid * 2u + 1u) - 1u;
+      uint high = offset * (tid * 2u + 2u) - 1u;
+      {{value_type}} partial = tile[low];
+      tile[low] = tile[high];
+      tile[high] += partial;
+    }
+  }
+  barrier();
+
+  for (uint copy = 0u; copy < 2u; copy++) {
+    uint localIdx = tid * 2u + copy;
+{% if top_level and exclusive %}
+    store(tileStart + localIdx, tile[localIdx]);
+{% else %}
+    store(tileStart + localIdx, tile[localIdx] + values[copy]);
+{% endif %}
+  }
+}
+"""
+
+
+add_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+{% if top_level %}
+{{ssbo}}
+{% endif %}
+
+layout(std430) buffer {{sums_name}} {
+  {{value_type}} blockSums[];
+};
+
+uniform uint count;
+uniform uint valuesOffset;
+uniform uint prefixOffset;
+
+void main() {
+  uint tileIdx = gl_WorkGroupID.x + 1u;  // The first tile is done.
+  {{value_type}} prefix = blockSums[prefixOffset + tileIdx - 1u];
+  for (uint copy = 0u; copy < 2u; copy++) {
+    uint idx = tileIdx * 512u + gl_LocalInvocationID.x * 2u + copy;
+    if (idx < count) {
+{% if top_level %}
+      {{out_type}} value = {{out_array}}_get_{{out_field}}(idx);
+      {{out_array}}_set_{{out_field}}(idx, value + {{out_type}}(prefix));
+{% else %}
+      blockSums[valuesOffset + idx] += prefix;
+{% endif %}
+    }
+  }
+}
+"""
+
+
+class PrefixSum:
+    """
+    Writes the running sums of a `uint`, `int` or `float` key field into
+    `out_field` of `out_array`, which may be the key itself. With
+    `exclusive=True`, each element's own value is left out of its sum.
+    Sums are accumulated in the key's type.
+
+    Any number of elements is scanned in tiles of 512, with
+    `2 * levels - 1` dispatches, where `levels` is the number of times
+    the length has to be divided by 512 to reach 1, so two million
+    elements need three levels. The total of all values ends up in
+    `sums` at `total_index`.
+    """
+    tile_size = 512
+
+    def __init__(self, ssbo, array_and_key, out_array_and_field,
+                 exclusive=False, debug=False):
+        array_name, key = array_and_key
+        out_array, out_field = out_array_and_field
+        array = ssbo.get_field(array_name)
+        assert len(array.dims) == 1, "Only 1D arrays for now."
+        assert ssbo.get_field(out_array).dims == array.dims, \
+            "Prefix sums have to go into an array of the same size."
+        key_field = array.get_field(key)
+        assert isinstance(key_field, (GlFloat, GlInt, GlUInt)) and key_field.dims == (), \
+            "Keys have to be float, int or uint scalars."
+        out_type = ssbo.get_field(out_array).get_field(out_field).glsl_type_name
+        sums_name = ssbo.glsl_type_name + 'BlockSums'
+        render_args = dict(
+            ssbo=ssbo.full_glsl(),
+            array_name=array_name,
+            key=key,
+            out_array=out_array,
+            out_field=out_field,
+            out_type=out_type,
+            value_type=key_field.glsl_type_name,
+            sums_name=sums_name,
+            exclusive=exclusive,
+        )
+        shaders = {}
+        for stage, template in [('scan', scan_template), ('add', add_template)]:
+            for top_level in (True, False):
+                source = render_template(template, top_level=top_level, **render_args)
+                name = f"{self.__class__.__name__}::{stage}"
+                if debug:
+                    print(name)
+                    for line_nr, line_txt in enumerate(source.split('\n')):
+                        print(f"{line_nr+1:4d}  {line_txt}")
+                shaders[stage, top_level] = compute_shader(source, name)
+        self.shaders = shaders
+        self.ssbo = ssbo
+        self.array_name = array_name
+        self.sums_name = sums_name
+        self.capacity = None
+        self.nodes = []
+        self.bin_name = None
+        self._allocate()
+
+    def _level_sizes(self, num_elements):
+        "Number of values on each level, starting with the elements."
+        sizes = [num_elements]
+        while sizes[-1] > self.tile_size:
+            sizes.append(-(-sizes[-1] // self.tile_size))
+        return sizes
+
+    def _allocate(self):
+        # The number of levels, and the size of the block sums, follow
+        # from the array's capacity; How much of that is used, from its
+        # length.
+        capacity = self.ssbo.get_field(self.array_name).dims[0]
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        sizes = self._level_sizes(capacity)
+        self.num_levels = len(sizes)
+        # Each level above the elements, and the total of the last one.
+        self.sums = _make_shader_buffer(self.sums_name, 4 * (sum(sizes[1:]) + 1))
+
+    @property
+    def total_index(self):
+        "Index in `sums` of the total of all elements."
+        sizes = self._level_sizes(self.ssbo.get_length(self.array_name))
+        sizes += [1] * (self.num_levels - len(sizes))
+        return sum(sizes[1:])
+
+    def _steps(self):
+        "(shader, workgroups, inputs) of each dispatch."
+        sizes = self._level_sizes(self.ssbo.get_length(self.array_name))
+        # Levels the capacity has, but the live elements do not need,
+        # scan a single value.
+        sizes += [1] * (self.num_levels - len(sizes))
+        offsets = [0]
+        for size in sizes[1:]:
+            offsets.append(offsets[-1] + size)
+        steps = []
+        for level, size in enumerate(sizes):
+            workgroups = (max(-(-size // self.tile_size), 1), 1, 1)
+            inputs = {
+                self.sums_name: self.sums,
+                'count': size,
+                # Level 0 values are the elements, level n ones are in
+                # the block sums after levels 1 to n-1.
+                'valuesOffset': offsets[level - 1] if level > 0 else 0,
+                'totalsOffset': offsets[level],
+            }
+            steps.append((self.shaders['scan', level == 0], workgroups, inputs))
+        for level in range(len(sizes) - 2, -1, -1):
+            size = sizes[level]
+            num_tiles = -(-size // self.tile_size)
+            inputs = {
+                self.sums_name: self.sums,
+                'count': size,
+                'valuesOffset': offsets[level - 1] if level > 0 else 0,
+                'prefixOffset': offsets[level],
+            }
+            # The first tile needs nothing added, so the dispatch starts
+            # with the second.
+            workgroups = (max(num_tiles - 1, 1), 1, 1)
+            steps.append((self.shaders['add', level == 0], workgroups, inputs))
+        return steps
+
+    def dispatch(self):
+        self._allocate()
+        for shader, workgroups, inputs in self._steps():
+            np = NodePath("dummy")
+            np.set_shader(shader)
+            np.set_shader_inputs(**self.ssbo.shader_inputs())
+            np.set_shader_inputs(**inputs)
+            sattr = np.get_attrib(ShaderAttrib)
+            base.graphicsEngine.dispatch_compute(
+                workgroups,
+                sattr,
+                base.win.get_gsg(),
+            )
+
+    def attach(self, np, bin_name):
+        self.np = np
+        self.bin_name = bin_name
+        self._attach_nodes()
+        self.ssbo.add_resize_callback(self.resize)
+
+    def _attach_nodes(self):
+        for idx, (shader, workgroups, inputs) in enumerate(self._steps()):
+            cn = ComputeNode(f"{self.__class__.__name__}-{idx}")
+            cn.add_dispatch(workgroups)
+            cnnp = self.np.attach_new_node(cn)
+            cnnp.set_shader(shader)
+            self.ssbo.bind(cnnp)
+            cnnp.set_shader_inputs(**inputs)
+            cnnp.set_bin(self.bin_name, idx)
+            cn.set_bounds_type(BoundingVolume.BT_box)
+            cn.set_bounds(self.np.get_bounds())
+            self.nodes.append((cn, cnnp))
+
+    def resize(self, ssbo):
+        old_levels = self.num_levels
+        self._allocate()
+        if self.num_levels != old_levels:
+            # There are more or fewer dispatches now.
+            for cn, cnnp in self.nodes:
+                self.ssbo.unbind(cnnp)
+                cnnp.remove_node()
+            self.nodes = []
+            self._attach_nodes()
+            return
+        for (cn, cnnp), (shader, workgroups, inputs) in zip(self.nodes, self._steps()):
+            cn.set_dispatch(0, workgroups)
+            cnnp.set_shader_inputs(**inputs)
@@ -0,0 +1,323 @@
+from panda3d.core import BoundingVolume
+from panda3d.core import NodePath
+from panda3d.core import ComputeNode
+from panda3d.core import ShaderAttrib
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlInt
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import _make_shader_buffer
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
+
+# A least significant digit radix sort with 8-bit digits, so 256 bins.
+# Each pass moves all elements between the sorted array and a scratch
+# array of the same struct, in three dispatches:
+# * `histogram`: Each workgroup counts the digits in its tile of 256
+#   elements, and stores them digit-major, as `counts[digit][group]`.
+# * `scan`: One workgroup turns those counts into exclusive prefix sums
+#   in place, so each entry is where the digit's elements from that
+#   tile start in the output.
+# * `scatter`: Each workgroup sorts its tile by digit in shared memory
+#   with eight stable 1-bit splits, so an element's rank among the
+#   tile's elements with the same digit is its distance to the first of
+#   them. That is added to the tile's offset for the digit.
+# Elements past the end of the array get the largest digit; As they come
+# last in the last tile, they do not change any other element's rank,
+# and are neither counted nor written.
+sort_key_template = """
+uint sortKey(uint idx, bool fromScratch) {
+{% if key_type == 'float' %}
+  float key = fromScratch ? {{scratch_name}}Elements[idx].{{key}} : {{array_name}}_get_{{key}}(idx);
+  uint bits = floatBitsToUint(key);
+  // Negative floats sort in reverse, and before the positive ones.
+  return bits ^ (((bits >> 31) == 1u) ? 0xFFFFFFFFu : 0x80000000u);
+{% elif key_type == 'int' %}
+  int key = fromScratch ? {{scratch_name}}Elements[idx].{{key}} : {{array_name}}_get_{{key}}(idx);
+  return uint(key) ^ 0x80000000u;
+{% else %}
+  return fromScratch ? {{scratch_name}}Elements[idx].{{key}} : {{array_name}}_get_{{key}}(idx);
+{% endif %}
+}
+
+uint digitOf(uint idx, bool fromScratch) {
+  return (sortKey(idx, fromScratch) >> shift) & 255u;
+}
+"""
+
+
+histogram_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+{{ssbo}}
+
+layout(std430) buffer {{scratch_name}} {
+  {{type_name}} {{scratch_name}}Elements[];
+};
+
+layout(std430) buffer {{histogram_name}} {
+  uint counts[];
+};
+
+uniform uint shift;
+uniform bool fromScratch;
+uniform uint numGroups;
+
+shared uint localCounts[256];
+""" + sort_key_template + """
+void main() {
+  uint tid = gl_LocalInvocationID.x;
+  uint idx = gl_GlobalInvocationID.x;
+  localCounts[tid] = 0u;
+  barrier();
+  if (idx < {{array_name}}_length()) {
+    atomicAdd(localCounts[digitOf(idx, fromScratch)], 1u);
+  }
+  barrier();
+  counts[tid * numGroups + gl_WorkGroupID.x] = localCounts[tid];
+}
+"""
+
+
+scan_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+layout(std430) buffer {{histogram_name}} {
+  uint counts[];
+};
+
+uniform uint numGroups;
+
+shared uint partialSums[256];
+
+void main() {
+  uint tid = gl_LocalInvocationID.x;
+  uint numCounts = 256u * numGroups;
+  uint carry = 0u;
+  for (uint blockStart = 0u; blockStart < numCounts; blockStart += 256u) {
+    uint idx = blockStart + tid;
+    uint count = (idx < numCounts) ? counts[idx] : 0u;
+    partialSums[tid] = count;
+    barrier();
+    for (uint offset = 1u; offset < 256u; offset *= 2u) {
+      uint summand = (tid >= offset) ? partialSums[tid - offset] : 0u;
+      barrier();
+      partialSums[tid] += summand;
+      barrier();
+    }
+    if (idx < numCounts) {
+      counts[idx] = carry + partialSums[tid] - count;
+    }
+    carry += partialSums[255];
+    barrier();
+  }
+}
+"""
+
+
+scatter_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+{{ssbo}}
+
+layout(std430) buffer {{scratch_name}} {
+  {{type_name}} {{scratch_name}}Elements[];
+};
+
+layout(std430) buffer {{histogram_name}} {
+  uint counts[];
+};
+
+uniform uint shift;
+uniform bool fromScratch;
+uniform uint numGroups;
+
+shared uint tileDigits[256];
+shared uint tileIndices[256];
+shared uint onesBefore[256];
+shared uint digitStarts[256];
+""" + sort_key_template + """
+void main() {
+  uint tid = gl_LocalInvocationID.x;
+  uint tileStart = gl_WorkGroupID.x * 256u;
+  uint numElements = {{array_name}}_length();
+  uint digit = 255u;
+  if (tileStart + tid < numElements) {
+    digit = digitOf(tileStart + tid, fromScratch);
+  }
+  uint localIdx = tid;
+
+  // Stable split by each bit of the digit, from the lowest up.
+  for (uint bit = 0u; bit < 8u; bit++) {
+    uint flag = (digit >> bit) & 1u;
+    onesBefore[tid] = flag;
+    barrier();
+    for (uint offset = 1u; offset < 256u; offset *= 2u) {
+      uint summand = (tid >= offset) ? onesBefore[tid - offset] : 0u;
+      barrier();
+      onesBefore[tid] += summand;
+      barrier();
+    }
+    uint ones = onesBefore[tid] - flag;
+    uint numZeros = 256u - onesBefore[255];
+    uint target = (flag == 1u) ? numZeros + ones : tid - ones;
+    barrier();
+    tileDigits[target] = digit;
+    tileIndices[target] = localIdx;
+    barrier();
+    digit = tileDigits[tid];
+    localIdx = tileIndices[tid];
+  }
+
+  if ((tid == 0u) || (tileDigits[tid - 1u] != digit)) {
+    digitStarts[digit] = tid;
+  }
+  barrier();
+
+  uint source = tileStart + localIdx;
+  if (source < numElements) {
+    uint target = counts[digit * numGroups + gl_WorkGroupID.x] + tid - digitStarts[digit];
+    if (fromScratch) {
+      {{array_name}}_set(target, {{scratch_name}}Elements[source]);
+    } else {
+      {{scratch_name}}Elements[target] = {{array_name}}_get(source);
+    }
+  }
+}
+"""
+
+
+class RadixSort:
+    """
+    Sorts the elements of an array by a `uint`, `int` or `float` key
+    field, in `ceil(key_bits / 8)` passes (rounded up to an even number)
+    of three dispatches each. The sort is stable. If the keys are known
+    to be smaller than `2 ** key_bits`, e.g. indices into a grid, passing
+    `key_bits` skips the passes over the always-zero digits; For `int`
+    and `float` keys, it has to be 32.
+    """
+    tile_size = 256
+
+    def __init__(self, ssbo, array_and_key, key_bits=32, debug=False):
+        array_name, key = array_and_key
+        array = ssbo.get_field(array_name)
+        assert len(array.dims) == 1, "Only 1D arrays for now."
+        key_field = array.get_field(key)
+        assert key_field.dims == (), "Keys have to be scalars."
+        if isinstance(key_field, GlFloat):
+            key_type = 'float'
+        elif isinstance(key_field, GlInt):
+            key_type = 'int'
+        elif isinstance(key_field, GlUInt):
+            key_type = 'uint'
+        else:
+            raise NotImplementedError(
+                f"RadixSort can't sort by {key_field.glsl_type_name} keys."
+            )
+        assert 0 < key_bits <= 32
+        assert key_type == 'uint' or key_bits == 32, \
+            "Only uint keys can be sorted by their lower bits."
+        scratch_name = ssbo.glsl_type_name + 'RadixScratch'
+        histogram_name = ssbo.glsl_type_name + 'RadixCounts'
+        render_args = dict(
+            ssbo=ssbo.full_glsl(),
+            type_name=array.glsl_type_name,
+            array_name=array_name,
+            key=key,
+            key_type=key_type,
+            scratch_name=scratch_name,
+            histogram_name=histogram_name,
+        )
+        shaders = []
+        for stage, template in [
+            ('histogram', histogram_template),
+            ('scan', scan_template),
+            ('scatter', scatter_template),
+        ]:
+            source = render_template(template, **render_args)
+            if debug:
+                print(f"{self.__class__.__name__}::{stage}")
+                for line_nr, line_txt in enumerate(source.split('\n')):
+                    print(f"{line_nr+1:4d}  {line_txt}")
+            shaders.append(
+                compute_shader(source, f"{self.__class__.__name__}::{stage}")
+            )
+        self.shader_histogram, self.shader_scan, self.shader_scatter = shaders
+        self.ssbo = ssbo
+        self.array_name = array_name
+        self.scratch_name = scratch_name
+        self.histogram_name = histogram_name
+        num_passes = -(-key_bits // 8)
+        num_passes += num_passes % 2  # so the data ends up in the array
+        self.shifts = [8 * p for p in range(num_passes)]
+        self.nodes = []
+        self.capacity = None
+        self._allocate()
+
+    @property
+    def num_groups(self):
+        num_elements = self.ssbo.get_length(self.array_name)
+        return max((num_elements + self.tile_size - 1) // self.tile_size, 1)
+
+    def _allocate(self):
+        # The scratch array holds as many elements as the array can, and
+        # the histograms as many tiles.
+        array = self.ssbo.get_field(self.array_name)
+        capacity = array.dims[0]
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        num_tiles = max((capacity + self.tile_size - 1) // self.tile_size, 1)
+        self.scratch = _make_shader_buffer(self.scratch_name, array._stride() * 4 * capacity)
+        self.histograms = _make_shader_buffer(self.histogram_name, 256 * 4 * num_tiles)
+
+    def _steps(self):
+        "(shader, workgroups, inputs) of each dispatch."
+        num_groups = self.num_groups
+        common_inputs = {
+            self.scratch_name: self.scratch,
+            self.histogram_name: self.histograms,
+            'numGroups': num_groups,
+        }
+        steps = []
+        for pass_idx, shift in enumerate(self.shifts):
+            inputs = dict(common_inputs, shift=shift, fromScratch=pass_idx % 2)
+            steps.append((self.shader_histogram, (num_groups, 1, 1), inputs))
+            steps.append((self.shader_scan, (1, 1, 1), common_inputs))
+            steps.append((self.shader_scatter, (num_groups, 1, 1), inputs))
+        return steps
+
+    def dispatch(self):
+        self._allocate()
+        for shader, workgroups, inputs in self._steps():
+            np = NodePath("dummy")
+            np.set_shader(shader)
+            np.set_shader_inputs(**self.ssbo.shader_inputs())
+            np.set_shader_inputs(**inputs)
+            sattr = np.get_attrib(ShaderAttrib)
+            base.graphicsEngine.dispatch_compute(
+                workgroups,
+                sattr,
+                base.win.get_gsg(),
+            )
+
+    def attach(self, np, bin_name):
+        for idx, (shader, workgroups, inputs) in enumerate(self._steps()):
+            cn = ComputeNode(f"{self.__class__.__name__}-{idx}")
+            cn.add_dispatch(workgroups)
+            cnnp = np.attach_new_node(cn)
+            cnnp.set_shader(shader)
+            self.ssbo.bind(cnnp)
+            cnnp.set_shader_inputs(**inputs)
+            cnnp.set_bin(bin_name, idx)
+            cn.set_bounds_type(BoundingVolume.BT_box)
+            cn.set_bounds(np.get_bounds())
+            self.nodes.append((cn, cnnp))
+        self.ssbo.add_resize_callback(self.resize)
+
+    def resize(self, ssbo):
+        self._allocate()
+        for (cn, cnnp), (shader, workgroups, inputs) in zip(self.nodes, self._steps()):
+            cn.set_dispatch(0, workgroups)
+            cnnp.set_shader_inputs(**inputs)
@@ -1,14 +1,15 @@
 import random
 
-from jinja2 import Template
 
 from panda3d.core import Vec3
 from panda3d.core import BoundingVolume
 from panda3d.core import NodePath
 from panda3d.core import ComputeNode
-from panda3d.core import Shader
 from panda3d.core import ShaderAttrib
 
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
 rng_base_template = """
 #version 430
 #extension GL_ARB_gpu_shader_int64 : require
@@ -21,18 +22,31 @@ uniform int rngSeed;
 
 {{rng_implementation}}
 
+vec2 rngVec2() {
+  return vec2(rngFloat(), rngFloat());
+}
+
 vec3 rngVec3() {
   return vec3(rngFloat(), rngFloat(), rngFloat());
 }
 
+vec4 rngVec4() {
+  return vec4(rngFloat(), rngFloat(), rngFloat(), rngFloat());
+}
+
 
 void main() {
   initRng();
   uint idx = uint(gl_GlobalInvocationID.x);
+  if (idx >= {{targets[0][0]}}_length()) {
+    return;
+  }
 
   {% for array, key, field_type, low, high in targets %}// {{array}}[idx].{{key}} = {{field_type}}[{{low}}-{{high}}]
-  {% if field_type=='float' %}{{array}}[idx].{{key}} = rngFloat() * ({{high}} - {{low}}) + {{low}};
-  {% elif field_type=='vec3' %}{{array}}[idx].{{key}} = rngVec3() * ({{high}} - {{low}}) + {{low}};
+  {% if field_type=='float' %}{{array}}_set_{{key}}(idx, rngFloat() * ({{high}} - {{low}}) + {{low}});
+  {% elif field_type=='vec2' %}{{array}}_set_{{key}}(idx, rngVec2() * ({{high}} - {{low}}) + {{low}});
+  {% elif field_type=='vec3' %}{{array}}_set_{{key}}(idx, rngVec3() * ({{high}} - {{low}}) + {{low}});
+  {% elif field_type=='vec4' %}{{array}}_set_{{key}}(idx, rngVec4() * ({{high}} - {{low}}) + {{low}});
   {% endif %}{% endfor %}
 }
 """[1:]
@@ -147,21 +161,24 @@ class RandomNumberGenerator:
             targets=rng_specs,
             rng_implementation=self.rng_template,
         )
-        template = Template(rng_base_template)
-        source = template.render(**render_args)
+        source = render_template(rng_base_template, **render_args)
         if debug:
             for line_nr, line_txt in enumerate(source.split('\n')):
                 print(f"{line_nr:4d}  {line_txt}")
-        shader = Shader.make_compute(Shader.SL_GLSL, source)
-        workgroups = (dims[0] // 32, 1, 1)
+        shader = compute_shader(source, self.__class__.__name__)
         self.ssbo = ssbo
         self.shader = shader
-        self.workgroups = workgroups
+        self.array_name = rng_specs[0][0]
+
+    @property
+    def workgroups(self):
+        num_elements = self.ssbo.get_length(self.array_name)
+        return ((num_elements + 31) // 32, 1, 1)
 
     def dispatch(self, seed=0):
         np = NodePath("dummy")
         np.set_shader(self.shader)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         np.set_shader_input('rngSeed', seed)
         sattr = np.get_attrib(ShaderAttrib)
         base.graphicsEngine.dispatch_compute(
@@ -176,7 +193,7 @@ class RandomNumberGenerator:
         cnnp = np.attach_new_node(cn)
 
         cnnp.set_shader(self.shader)
-        cnnp.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp)
         if seed is None:
             seed = random.randint(0,2**31-1)
         cnnp.set_shader_input('rngSeed', seed)
@@ -184,11 +201,16 @@ class RandomNumberGenerator:
         cnnp.set_bin(bin_name, 0)
         cn.set_bounds_type(BoundingVolume.BT_box)
         cn.set_bounds(np.get_bounds())
+        self.cn = cn
         self.cnnp = cnnp
+        self.ssbo.add_resize_callback(self.resize)
         if task is not None:
             args, kwargs = task
             base.task_mgr.add(self.update, *args, **kwargs)
 
+    def resize(self, ssbo):
+        self.cn.set_dispatch(0, self.workgroups)
+
     def update(self, task):
         seed = random.randint(0, 2**31-1)
         self.cnnp.set_shader_input('rngSeed', seed)
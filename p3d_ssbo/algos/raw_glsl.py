@@ -1,11 +1,11 @@
-from jinja2 import Template
-
 from panda3d.core import BoundingVolume
 from panda3d.core import NodePath
 from panda3d.core import ComputeNode
-from panda3d.core import Shader
 from panda3d.core import ShaderAttrib
 
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
 
 raw_code_template = """#version 430
 layout (local_size_x = 32, local_size_y = 1) in;
@@ -15,6 +15,9 @@ layout (local_size_x = 32, local_size_y = 1) in;
 {{funcs}}
 
 void main() {
+  if (gl_GlobalInvocationID.x >= {{array}}_length()) {
+    return;
+  }
 {{main}}
 }
 """
@@ -24,34 +27,36 @@ class RawGLSL:
     def __init__(self, ssbo, target_array,
                  funcs_source, main_source,
                  debug=False, src_args=None, shader_args=None):
-        struct = ssbo.get_field(target_array)
-        dims = struct.get_num_elements()
         if src_args == None:
             src_args = dict()
         render_args = dict(
             ssbo=ssbo.full_glsl(),
             funcs=funcs_source,
             main=main_source,
+            array=target_array,
         )
-        template = Template(raw_code_template)
-        assembled_source = template.render(**render_args)
-        source = Template(assembled_source).render(**src_args)
+        assembled_source = render_template(raw_code_template, **render_args)
+        source = render_template(assembled_source, **src_args)
         if debug:
             for line_nr, line_txt in enumerate(source.split('\n')):
                 print(f"{line_nr+1:4d}  {line_txt}")
-        shader = Shader.make_compute(Shader.SL_GLSL, source)
-        workgroups = (dims[0] // 32, 1, 1)
+        shader = compute_shader(source, self.__class__.__name__)
         self.ssbo = ssbo
         self.shader = shader
-        self.workgroups = workgroups
+        self.target_array = target_array
         if shader_args is None:
             shader_args = dict()
         self.shader_args = shader_args
 
+    @property
+    def workgroups(self):
+        num_elements = self.ssbo.get_length(self.target_array)
+        return ((num_elements + 31) // 32, 1, 1)
+
     def dispatch(self):
         np = NodePath("dummy")
         np.set_shader(self.shader)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         for glsl_name, value in self.shader_args.items():
             np.set_shader_input(glsl_name, value)            
         sattr = np.get_attrib(ShaderAttrib)
@@ -67,14 +72,19 @@ class RawGLSL:
         cnnp = np.attach_new_node(cn)
 
         cnnp.set_shader(self.shader)
-        cnnp.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp)
         for glsl_name, value in self.shader_args.items():
             cnnp.set_shader_input(glsl_name, value)            
 
         cnnp.set_bin(bin_name, 0)
         cn.set_bounds_type(BoundingVolume.BT_box)
         cn.set_bounds(np.get_bounds())
+        self.cn = cn
         self.cnnp = cnnp
+        self.ssbo.add_resize_callback(self.resize)
+
+    def resize(self, ssbo):
+        self.cn.set_dispatch(0, self.workgroups)
 
     def set_shader_arg(self, name, value):
         self.cnnp.set_shader_input(name, value)
@@ -0,0 +1,324 @@
+from panda3d.core import BoundingVolume
+from panda3d.core import NodePath
+from panda3d.core import ComputeNode
+from panda3d.core import ShaderAttrib
+from panda3d.core import GeomEnums
+from panda3d.core import Texture
+
+from p3d_ssbo.gltypes import GlVectorType
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlInt
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.gltypes import _make_shader_buffer
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
+
+# Each workgroup reduces a tile of 512 values to one in shared memory, and
+# stores it in the partials. These are reduced the same way, level by
+# level, until a single workgroup is left, which writes the result. All
+# levels of partials are stored one after another in one buffer.
+#
+# Each operation reduces one or more slots of values; `aabb` reduces the
+# minimum and the maximum at once, and partials store a tile's slots next
+# to each other. The result goes into the `result` buffer for use in
+# other shaders, and word by word into a buffer texture, which is what
+# `read` gets back from the GPU.
+reduce_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+{% if first_level %}
+{{ssbo}}
+{% endif %}
+
+layout(std430) buffer {{partials_name}} {
+  {{value_type}} partials[];
+};
+
+{% if last_level %}
+{{result}}
+
+layout(r32ui) uniform writeonly uimageBuffer {{words_name}};
+{% endif %}
+
+uniform uint count;
+uniform uint readOffset;
+uniform uint writeOffset;
+
+{% for op in ops %}
+shared {{value_type}} reduced{{loop.index0}}[256];
+{% endfor %}
+
+{% macro combine(op, a, b) -%}
+{% if op == 'sum' %}{{a}} + {{b}}{% else %}{{op}}({{a}}, {{b}}){% endif %}
+{%- endmacro %}
+
+{% if first_level %}
+{{value_type}} load(uint idx) {
+  {{field_type}} value = {{array_name}}_get_{{field}}(idx);
+  return {{expression}};
+}
+{% endif %}
+
+void main() {
+  uint tid = gl_LocalInvocationID.x;
+{% for op in ops %}
+  {{value_type}} acc{{loop.index0}} = {{value_type}}({{identities[op]}});
+{% endfor %}
+  for (uint part = 0u; part < 2u; part++) {
+    uint idx = gl_WorkGroupID.x * 512u + part * 256u + tid;
+    if (idx < count) {
+{% if first_level %}
+      {{value_type}} value = load(idx);
+{% for op in ops %}
+      acc{{loop.index0}} = {{combine(op, 'acc' ~ loop.index0, 'value')}};
+{% endfor %}
+{% else %}
+{% for op in ops %}
+      acc{{loop.index0}} = {{combine(op, 'acc' ~ loop.index0, 'partials[readOffset + idx * ' ~ ops|length ~ 'u + ' ~ loop.index0 ~ 'u]')}};
+{% endfor %}
+{% endif %}
+    }
+  }
+{% for op in ops %}
+  reduced{{loop.index0}}[tid] = acc{{loop.index0}};
+{% endfor %}
+
+  for (uint stride = 128u; stride > 0u; stride >>= 1) {
+    barrier();
+    if (tid < stride) {
+{% for op in ops %}
+      reduced{{loop.index0}}[tid] = {{combine(op, 'reduced' ~ loop.index0 ~ '[tid]', 'reduced' ~ loop.index0 ~ '[tid + stride]')}};
+{% endfor %}
+    }
+  }
+
+  if (tid == 0u) {
+{% for op in ops %}
+{% set slot = loop.index0 %}
+{% if last_level %}
+    {{result_field}}[{{slot}}] = reduced{{slot}}[0];
+{% for component in components %}
+    imageStore({{words_name}}, {{slot * result_stride + loop.index0}}, uvec4({{to_word.format('reduced' ~ slot ~ '[0]' ~ component)}}));
+{% endfor %}
+{% else %}
+    partials[writeOffset + gl_WorkGroupID.x * {{ops|length}}u + {{slot}}u] = reduced{{slot}}[0];
+{% endif %}
+{% endfor %}
+  }
+}
+"""
+
+
+identities = {
+    'float': dict(sum='0.0', min='uintBitsToFloat(0x7F800000u)', max='uintBitsToFloat(0xFF800000u)'),
+    'int': dict(sum='0', min='0x7FFFFFFF', max='int(0x80000000u)'),
+    'uint': dict(sum='0u', min='0xFFFFFFFFu', max='0u'),
+}
+
+
+class Reduce:
+    """
+    Reduces a field of the elements of an array to a single value, e.g.
+    the total mass of particles, or the bounding box of their positions.
+    `op` is `'sum'`, `'min'` or `'max'` (componentwise for vectors), or
+    `'aabb'` for the componentwise minimum and maximum of a vector. The
+    field can be a `float`, `int` or `uint` scalar or vector.
+
+    Instead of the field itself, `value=(gl_type, expression)` reduces a
+    GLSL expression of it, named `value` there, e.g. kinetic energies as
+    `(GlFloat, '0.5 * dot(value, value)')` of velocities.
+
+    The result is left in the `result` buffer, and `read()` returns it
+    without reading back more than its few bytes. Empty arrays reduce to
+    0, or the identities of `min` and `max`, e.g. infinity.
+    """
+    tile_size = 512
+    ops = ('sum', 'min', 'max', 'aabb')
+
+    def __init__(self, ssbo, array_and_field, op='sum', value=None, debug=False):
+        array_name, field = array_and_field
+        array = ssbo.get_field(array_name)
+        assert len(array.dims) == 1, "Only 1D arrays for now."
+        assert op in self.ops, f"Unknown reduction {op!r}."
+        field_type = array.get_field(field)
+        assert field_type.dims == (), "Only scalar and vector fields can be reduced."
+        if value is None:
+            value_type, expression = type(field_type), 'value'
+        else:
+            value_type, expression = value
+        component_type = getattr(value_type, 'component_type', value_type)
+        assert component_type in (GlFloat, GlInt, GlUInt), \
+            f"Reduce can't reduce {value_type.glsl_type_name} values."
+        if op == 'aabb':
+            assert issubclass(value_type, GlVectorType), "Bounding boxes are made of vectors."
+            ops = ['min', 'max']
+        else:
+            ops = [op]
+        self.op = op
+        self.result = Buffer(
+            ssbo.glsl_type_name + 'Reduced',
+            value_type('reducedValues', len(ops)),
+        )
+        if issubclass(value_type, GlVectorType):
+            components = [f'[{c}]' for c in range(value_type.num_components)]
+        else:
+            components = ['']
+        partials_name = ssbo.glsl_type_name + 'ReducePartials'
+        words_name = ssbo.glsl_type_name + 'ReducedWords'
+        render_args = dict(
+            ssbo=ssbo.full_glsl(),
+            array_name=array_name,
+            field=field,
+            field_type=field_type.glsl_type_name,
+            value_type=value_type.glsl_type_name,
+            expression=expression,
+            ops=ops,
+            identities=identities[component_type.glsl_type_name],
+            partials_name=partials_name,
+            result=self.result.glsl(),
+            result_field='reducedValues',
+            result_stride=self.result.get_field('reducedValues')._stride(),
+            words_name=words_name,
+            components=components,
+            to_word=component_type.glsl_to_word,
+        )
+        shaders = {}
+        for first_level in (True, False):
+            for last_level in (True, False):
+                source = render_template(
+                    reduce_template,
+                    first_level=first_level,
+                    last_level=last_level,
+                    **render_args,
+                )
+                if debug:
+                    print(self.__class__.__name__)
+                    for line_nr, line_txt in enumerate(source.split('\n')):
+                        print(f"{line_nr+1:4d}  {line_txt}")
+                shaders[first_level, last_level] = compute_shader(
+                    source,
+                    self.__class__.__name__,
+                )
+        self.shaders = shaders
+        self.ssbo = ssbo
+        self.array_name = array_name
+        self.num_slots = len(ops)
+        self.partials_name = partials_name
+        self.words_name = words_name
+        self.words = Texture(words_name)
+        self.words.setup_buffer_texture(
+            self.result.size() // 4,
+            Texture.T_unsigned_int,
+            Texture.F_r32i,
+            GeomEnums.UH_dynamic,
+        )
+        self.capacity = None
+        self.nodes = []
+        self._allocate()
+
+    def _level_sizes(self, num_elements):
+        "Number of values on each level, starting with the elements."
+        sizes = [num_elements]
+        while sizes[-1] > self.tile_size:
+            sizes.append(-(-sizes[-1] // self.tile_size))
+        return sizes
+
+    def _allocate(self):
+        # The number of levels, and the size of the partials, follow from
+        # the array's capacity; How much of that is used, from its length.
+        capacity = self.ssbo.get_field(self.array_name).dims[0]
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        sizes = self._level_sizes(capacity)
+        self.num_levels = len(sizes)
+        stride = self.result.get_field('reducedValues')._stride()
+        self.partials = _make_shader_buffer(
+            self.partials_name,
+            4 * sum(sizes[1:]) * self.num_slots * stride,
+        )
+
+    def _steps(self):
+        "(shader, workgroups, inputs) of each dispatch."
+        sizes = self._level_sizes(self.ssbo.get_length(self.array_name))
+        # Levels the capacity has, but the live elements do not need,
+        # reduce a single value.
+        sizes += [1] * (self.num_levels - len(sizes))
+        offsets = [0]
+        for size in sizes[1:]:
+            offsets.append(offsets[-1] + size * self.num_slots)
+        steps = []
+        for level, size in enumerate(sizes):
+            workgroups = (max(-(-size // self.tile_size), 1), 1, 1)
+            inputs = {
+                self.partials_name: self.partials,
+                self.result.glsl_type_name: self.result.ssbo,
+                self.words_name: self.words,
+                'count': size,
+                'readOffset': offsets[level - 1] if level > 0 else 0,
+                'writeOffset': offsets[level],
+            }
+            shader = self.shaders[level == 0, level == len(sizes) - 1]
+            steps.append((shader, workgroups, inputs))
+        return steps
+
+    def read(self):
+        """
+        Read the result back from the GPU, as a number or tuple; For
+        `aabb`, as a `(lower, upper)` tuple of them.
+        """
+        base.graphicsEngine.extract_texture_data(self.words, base.win.get_gsg())
+        values = self.result.unpack(bytes(self.words.get_ram_image()))[0]
+        if self.op == 'aabb':
+            return tuple(values)
+        return values[0]
+
+    def dispatch(self):
+        self._allocate()
+        for shader, workgroups, inputs in self._steps():
+            np = NodePath("dummy")
+            np.set_shader(shader)
+            np.set_shader_inputs(**self.ssbo.shader_inputs())
+            np.set_shader_inputs(**inputs)
+            sattr = np.get_attrib(ShaderAttrib)
+            base.graphicsEngine.dispatch_compute(
+                workgroups,
+                sattr,
+                base.win.get_gsg(),
+            )
+
+    def attach(self, np, bin_name):
+        self.np = np
+        self.bin_name = bin_name
+        self._attach_nodes()
+        self.ssbo.add_resize_callback(self.resize)
+
+    def _attach_nodes(self):
+        for idx, (shader, workgroups, inputs) in enumerate(self._steps()):
+            cn = ComputeNode(f"{self.__class__.__name__}-{idx}")
+            cn.add_dispatch(workgroups)
+            cnnp = self.np.attach_new_node(cn)
+            cnnp.set_shader(shader)
+            self.ssbo.bind(cnnp)
+            cnnp.set_shader_inputs(**inputs)
+            cnnp.set_bin(self.bin_name, idx)
+            cn.set_bounds_type(BoundingVolume.BT_box)
+            cn.set_bounds(self.np.get_bounds())
+            self.nodes.append((cn, cnnp))
+
+    def resize(self, ssbo):
+        old_levels = self.num_levels
+        self._allocate()
+        if self.num_levels != old_levels:
+            # There are more or fewer dispatches now.
+            for cn, cnnp in self.nodes:
+                self.ssbo.unbind(cnnp)
+                cnnp.remove_node()
+            self.nodes = []
+            self._attach_nodes()
+            return
+        for (cn, cnnp), (shader, workgroups, inputs) in zip(self.nodes, self._steps()):
+            cn.set_dispatch(0, workgroups)
+            cnnp.set_shader_inputs(**inputs)
@@ -0,0 +1,156 @@
+import numpy as np
+
+from panda3d.core import BoundingVolume
+from panda3d.core import NodePath
+from panda3d.core import ComputeNode
+from panda3d.core import ShaderAttrib
+from panda3d.core import ShaderBuffer
+from panda3d.core import GeomEnums
+
+from p3d_ssbo.shader_cache import compute_shader
+
+
+# Both buffers are declared as flat arrays of words, so that the copy
+# does not depend on their layout. What is copied is a list of segments,
+# sorted by the number of words to copy before them; Each invocation
+# looks up the segment of the words it copies. Buffers may be larger
+# than the maximum number of workgroups allows for one word per
+# invocation, so each invocation copies every n-th word.
+copy_template = """#version 430
+layout (local_size_x = 256, local_size_y = 1) in;
+
+layout(std430) buffer sourceBuffer {
+  uint sourceWords[];
+};
+
+layout(std430) buffer targetBuffer {
+  uint targetWords[];
+};
+
+layout(std430) buffer copySegments {
+  uvec4 segments[];  // (source word, target word, word count, words before)
+};
+
+uniform uint numSegments;
+uniform uint numWords;
+
+void main() {
+  uint step = gl_NumWorkGroups.x * gl_WorkGroupSize.x;
+  for (uint idx = gl_GlobalInvocationID.x; idx < numWords; idx += step) {
+    uint low = 0u;
+    uint high = numSegments - 1u;
+    while (low < high) {
+      uint mid = (low + high + 1u) / 2u;
+      if (segments[mid].w <= idx) {
+        low = mid;
+      } else {
+        high = mid - 1u;
+      }
+    }
+    uvec4 segment = segments[low];
+    uint offset = idx - segment.w;
+    targetWords[segment.y + offset] = sourceWords[segment.x + offset];
+  }
+}
+"""
+
+
+class ResizeCopy:
+    """
+    Copies the contents of a buffer from before it was replaced, e.g. by
+    `Buffer.resize` or `Arena.compact`, into its new `ShaderBuffer`; If
+    it was replaced several times since, from one to the next. This has
+    to run before anything else uses the buffer after that.
+    `PartialUpdate` does it before uploading writes by itself.
+    """
+    max_workgroups = 65535
+
+    def __init__(self, ssbo, debug=False):
+        if debug:
+            for line_nr, line_txt in enumerate(copy_template.split('\n')):
+                print(f"{line_nr+1:4d}  {line_txt}")
+        shader = compute_shader(copy_template, self.__class__.__name__)
+        self.ssbo = ssbo
+        self.shader = shader
+        self.nodes = []
+
+    def _pending_copies(self):
+        "(workgroups, inputs) of each copy to do, in order."
+        copies = []
+        for source, target, segments in self.ssbo.pop_pending_copies():
+            segments = np.array(
+                [segment for segment in segments if segment[2] > 0],
+                dtype=np.uint32,
+            ).reshape(-1, 3)
+            if len(segments) == 0:
+                continue
+            num_words = int(segments[:, 2].sum())
+            words_before = np.cumsum(segments[:, 2]) - segments[:, 2]
+            staging = ShaderBuffer(
+                'copySegments',
+                np.column_stack([segments, words_before]).astype(np.uint32).tobytes(),
+                GeomEnums.UH_stream,
+            )
+            workgroups = (min((num_words + 255) // 256, self.max_workgroups), 1, 1)
+            inputs = dict(
+                sourceBuffer=source,
+                targetBuffer=target,
+                copySegments=staging,
+                numSegments=len(segments),
+                numWords=num_words,
+            )
+            copies.append((workgroups, inputs))
+        return copies
+
+    def dispatch(self):
+        for workgroups, inputs in self._pending_copies():
+            nodepath = NodePath("dummy")
+            nodepath.set_shader(self.shader)
+            nodepath.set_shader_inputs(**inputs)
+            sattr = nodepath.get_attrib(ShaderAttrib)
+            base.graphicsEngine.dispatch_compute(
+                workgroups,
+                sattr,
+                base.win.get_gsg(),
+            )
+
+    def attach(self, nodepath, bin_name, update_task=True):
+        # Reallocations are rare, so the nodes are hidden in all frames
+        # but those after one, for which `update` sets up the copies.
+        # Their sorts in the bin are below 0, so that they run before
+        # anything sorted at 0 or above. Without `update_task`, whoever
+        # attaches this calls `update` each frame.
+        self.np = nodepath
+        self.bin_name = bin_name
+        if update_task:
+            base.task_mgr.add(self.update, self.__class__.__name__)
+
+    def _add_node(self):
+        cn = ComputeNode(f"{self.__class__.__name__}-{len(self.nodes)}")
+        cn.add_dispatch((1, 1, 1))
+        cnnp = self.np.attach_new_node(cn)
+        cnnp.set_shader(self.shader)
+        cn.set_bounds_type(BoundingVolume.BT_box)
+        cn.set_bounds(self.np.get_bounds())
+        cnnp.hide()
+        self.nodes.append((cn, cnnp))
+
+    def update(self, task):
+        copies = self._pending_copies()
+        while len(self.nodes) < len(copies):
+            self._add_node()
+        for idx, (cn, cnnp) in enumerate(self.nodes):
+            if idx < len(copies):
+                workgroups, inputs = copies[idx]
+                cn.set_dispatch(0, workgroups)
+                cnnp.set_shader_inputs(**inputs)
+                cnnp.set_bin(self.bin_name, idx - len(copies))
+                cnnp.show()
+            else:
+                # The old buffer has been copied in the last frame, so
+                # it need not be kept alive any longer.
+                cnnp.clear_shader_input('sourceBuffer')
+                cnnp.clear_shader_input('targetBuffer')
+                cnnp.clear_shader_input('copySegments')
+                cnnp.hide()
+        return task.cont
@@ -1,12 +1,146 @@
-from jinja2 import Template
+import warnings
 
 from panda3d.core import BoundingVolume
 from panda3d.core import NodePath
 from panda3d.core import ComputeNode
-from panda3d.core import Shader
 from panda3d.core import ShaderAttrib
 
 from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import _make_shader_buffer
+from p3d_ssbo.algos.prefix_sum import PrefixSum
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import compute_shader
+
+
+# Grid cells are numbered either linearly, row by row and layer by layer,
+# or with `indexing='morton'` along a Z-order curve, which interleaves
+# the bits of their coordinates as `...z1y1x1z0y0x0`. Along the curve,
+# cells that are close in space mostly get close indices, so a sorted
+# array keeps neighbouring cells' elements closer together in memory.
+# Morton indices of a grid that is not a cube of a power of two leave
+# gaps, so its pivot table needs `num_cells(resolution, 'morton')`
+# entries.
+#
+# With `indexing='hashed'`, the grid is unbounded: Cells have the size
+# `volume / resolution`, but continue beyond the volume in all
+# directions, and their integer coordinates are hashed into a table of
+# `table_size` entries. Distinct cells may share an entry, so there is
+# no way back from an index to its cell.
+cell_index_template = """
+{% if indexing == 'hashed' %}
+uint cellToCellIdx (ivec3 cell, ivec3 res) {
+  uvec3 c = uvec3(cell);
+  return ((c.x * 73856093u) ^ (c.y * 19349663u) ^ (c.z * 83492791u)) % {{table_size}}u;
+}
+{% elif indexing == 'morton' %}
+uint spreadBits(uint v) {
+  v &= 0x3FFu;
+  v = (v | (v << 16)) & 0x030000FFu;
+  v = (v | (v << 8)) & 0x0300F00Fu;
+  v = (v | (v << 4)) & 0x030C30C3u;
+  v = (v | (v << 2)) & 0x09249249u;
+  return v;
+}
+
+uint compactBits(uint v) {
+  v &= 0x09249249u;
+  v = (v | (v >> 2)) & 0x030C30C3u;
+  v = (v | (v >> 4)) & 0x0300F00Fu;
+  v = (v | (v >> 8)) & 0x030000FFu;
+  v = (v | (v >> 16)) & 0x000003FFu;
+  return v;
+}
+
+ivec3 cellIdxToCell (uint cellIdx, ivec3 res) {
+  return ivec3(compactBits(cellIdx),
+               compactBits(cellIdx >> 1),
+               compactBits(cellIdx >> 2));
+}
+
+uint cellToCellIdx (ivec3 cell, ivec3 res) {
+  return spreadBits(uint(cell.x)) |
+         (spreadBits(uint(cell.y)) << 1) |
+         (spreadBits(uint(cell.z)) << 2);
+}
+{% else %}
+ivec3 cellIdxToCell (uint cellIdx, ivec3 res) {
+  ivec3 cell = ivec3(mod(cellIdx, res.x),
+                     mod(floor(cellIdx / res.x), res.y),
+                     floor(cellIdx / (res.x * res.y)));
+  return cell;
+}
+
+uint cellToCellIdx (ivec3 cell, ivec3 res) {
+  uint cellIdx = cell.x + 
+                 cell.y * res.x + 
+                 cell.z * res.x * res.y;
+  return cellIdx;
+}
+{% endif %}
+"""[1:]
+
+
+def morton_index(cell):
+    "Z-order index of a 3D cell, interleaving its coordinates' bits."
+    cell_idx = 0
+    for bit in range(10):
+        for axis, coordinate in enumerate(cell):
+            cell_idx |= ((coordinate >> bit) & 1) << (bit * 3 + axis)
+    return cell_idx
+
+
+def hashed_index(cell, table_size):
+    "Index of a 3D cell in a hashed grid's table of `table_size` entries."
+    x, y, z = (c & 0xFFFFFFFF for c in cell)
+    mixed = (x * 73856093) ^ (y * 19349663) ^ (z * 83492791)
+    return (mixed & 0xFFFFFFFF) % table_size
+
+
+def num_cells(resolution, indexing='linear'):
+    """
+    Number of cell indices of a bounded 3D grid, i.e. the length that its
+    pivot table needs; For a hashed grid, that is its `table_size`.
+    """
+    assert indexing != 'hashed', "Hashed grids are as large as their table."
+    if indexing == 'morton':
+        return morton_index([r - 1 for r in resolution]) + 1
+    return resolution[0] * resolution[1] * resolution[2]
+
+
+# How many times the cells of a grid its Morton indices may span before
+# that is warned about.
+_max_morton_overhead = 8
+
+
+def _check_indexing(indexing, resolution, table_size):
+    assert indexing in ('linear', 'morton', 'hashed'), f"Unknown cell indexing {indexing!r}."
+    if indexing != 'linear':
+        assert len(resolution) == 3, f"{indexing.capitalize()} indices are for 3D grids."
+    if indexing == 'morton':
+        assert max(resolution) <= 1024, "Morton indices have 10 bits per axis."
+        # Flat or elongated grids leave most of the curve unused, e.g.
+        # (1024, 1024, 1) spans over 400 million indices for a million
+        # cells.
+        cells = resolution[0] * resolution[1] * resolution[2]
+        indices = num_cells(resolution, 'morton')
+        if indices > _max_morton_overhead * cells:
+            warnings.warn(
+                f"Morton indices of a {resolution} grid span {indices} entries "
+                f"for {cells} cells; Consider 'linear' or 'hashed' indexing.",
+                stacklevel=3,
+            )
+    assert (indexing == 'hashed') == (table_size is not None), \
+        "Hashed grids, and only those, need a table_size."
+
+
+def _check_pivot_table(ssbo, pivot_table, indexing, table_size):
+    # Hashes go up to `table_size`, so a shorter table would be indexed
+    # out of bounds.
+    if indexing == 'hashed':
+        length = ssbo.get_field(pivot_table).dims[0]
+        assert length >= table_size, \
+            f"Pivot table {pivot_table} has {length} entries, but table_size is {table_size}."
 
 
 spatial_hash_template = """
@@ -19,23 +153,25 @@ uvec3 resolution = uvec3({{res[0]}}, {{res[1]}}, {{res[2]}});
 vec3 volume = vec3({{vol[0]}}, {{vol[1]}}, {{vol[2]}});
 vec3 edges = volume / resolution;
 
+{{cell_index}}
+
 uint spatialHash ({{type}} pos) {
-  uvec3 cellV = uvec3(floor(pos / edges));
-  uint cell = cellV.x + 
-              cellV.y * resolution.x + 
-              cellV.z * resolution.x * resolution.y;
-  return cell;
+  ivec3 cellV = ivec3(floor(pos / edges));
+  return cellToCellIdx(cellV, ivec3(resolution));
 }
 
 void main() {
   uint idx = uint(gl_GlobalInvocationID.x);
-  {{array}}[idx].{{hash}} = spatialHash({{array}}[idx].{{key}});
+  if (idx >= {{array}}_length()) {
+    return;
+  }
+  {{array}}_set_{{hash}}(idx, spatialHash({{array}}_get_{{key}}(idx)));
 }
 """[1:]
 
 
 class SpatialHash:
-    def __init__(self, ssbo: Buffer, target: tuple[str], volume, resolution, debug=False):
+    def __init__(self, ssbo: Buffer, target: tuple[str], volume, resolution, indexing='linear', table_size=None, pivot_table=None, debug=False):
         # get variable names for SSBOs
         target_array, target_pos, target_hash = target
         # build struct for SSBO data
@@ -54,6 +190,9 @@ class SpatialHash:
             assert len(resolution) == 3
         else:
             assert False, "Unsupported position type"
+        _check_indexing(indexing, resolution, table_size)
+        if pivot_table is not None:
+            _check_pivot_table(ssbo, pivot_table, indexing, table_size)
 
         # Arguments to pass when calling render on the Template
         render_args = dict(
@@ -64,28 +203,35 @@ class SpatialHash:
             type=pos_type,
             vol=volume,
             res=resolution,
+            cell_index=render_template(
+                cell_index_template,
+                indexing=indexing,
+                table_size=table_size,
+            ),
         )
-        # construct jinja template for the spatial hash
-        template = Template(spatial_hash_template)
-        # run render method on template with args specified above
-        source = template.render(**render_args)
+        # render the jinja template for the spatial hash with args
+        # specified above
+        source = render_template(spatial_hash_template, **render_args)
         if debug:
             for line_nr, line_txt in enumerate(source.split('\n')):
                 print(f"{line_nr:4d}  {line_txt}")
         # create the compute shader
-        shader = Shader.make_compute(Shader.SL_GLSL, source)
-        shader.set_filename(Shader.STCompute, self.__class__.__name__)
-        # calculate workgroups with dimensions calculated above from struct
-        workgroups = (dims[0] // 32, 1, 1)
+        shader = compute_shader(source, self.__class__.__name__)
         # save local variables
         self.ssbo = ssbo
         self.shader = shader
-        self.workgroups = workgroups
+        self.target_array = target_array
+
+    @property
+    def workgroups(self):
+        # one invocation per live element of the array
+        num_elements = self.ssbo.get_length(self.target_array)
+        return ((num_elements + 31) // 32, 1, 1)
 
     def dispatch(self):
         np = NodePath("dummy")
         np.set_shader(self.shader)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         sattr = np.get_attrib(ShaderAttrib)
         base.graphicsEngine.dispatch_compute(
             self.workgroups,
@@ -99,12 +245,17 @@ class SpatialHash:
         cnnp = np.attach_new_node(cn)
 
         cnnp.set_shader(self.shader)
-        cnnp.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp)
 
         cnnp.set_bin(bin_name, 0)
         cn.set_bounds_type(BoundingVolume.BT_box)
         cn.set_bounds(np.get_bounds())
+        self.cn = cn
         self.cnnp = cnnp
+        self.ssbo.add_resize_callback(self.resize)
+
+    def resize(self, ssbo):
+        self.cn.set_dispatch(0, self.workgroups)
 
 
 pivot_start_source = """
@@ -116,7 +267,10 @@ layout (local_size_x = 32, local_size_y = 1) in;
 
 void main() {
   uint idx = uint(gl_GlobalInvocationID.x);
-  uint key = {{list_field}}[idx].{{list_key}};
+  if (idx >= {{list_field}}_length()) {
+    return;
+  }
+  uint key = {{list_field}}_get_{{list_key}}(idx);
   uint diff;
   if (idx == 0) {
     // This is the first element with the lowest index, and thus we'll
@@ -126,7 +280,7 @@ void main() {
   } else {
     // A regular element. How many cell indices further are we than the
     // last boid was? (If we're still in the same cell, that's 0.)
-    uint keyLeft = {{list_field}}[idx-1].{{list_key}};
+    uint keyLeft = {{list_field}}_get_{{list_key}}(idx - 1);
     diff = key - keyLeft;
   }
   // If this is such an cell-index-advancing element, we write its boid
@@ -136,15 +290,15 @@ void main() {
   // runlength for them will be 0.
   if (diff > 0) {
     for (uint pivotIdx = key; pivotIdx > key - diff; pivotIdx--) {
-      {{table_field}}[pivotIdx].start = idx;
+      {{table_field}}_set_{{table_start}}(pivotIdx, idx);
     }
   }
   // If this is the last boid, we may need to set the start of any
   // remaining cell indices, and we set them to "just beyond the end of
   // the list of boids."
-  if (idx+1 == {{list_field}}.length()) {
-    for (uint pivotIdx = key + 1; pivotIdx < pivot.length(); pivotIdx++) {
-      {{table_field}}[pivotIdx].{{table_start}} = {{list_field}}.length();
+  if (idx + 1 == {{list_field}}_length()) {
+    for (uint pivotIdx = key + 1; pivotIdx < {{table_field}}_length(); pivotIdx++) {
+      {{table_field}}_set_{{table_start}}(pivotIdx, {{list_field}}_length());
     }
   }
 }
@@ -160,14 +314,17 @@ layout (local_size_x = 32, local_size_y = 1) in;
 
 void main() {
   uint pivotIdx = uint(gl_GlobalInvocationID.x);
-  uint start = pivot[pivotIdx].start;
+  if (pivotIdx >= {{table_field}}_length()) {
+    return;
+  }
+  uint start = {{table_field}}_get_{{table_start}}(pivotIdx);
   uint end;
-  if (pivotIdx == pivot.length() - 1) {
-    end = boids.length();
+  if (pivotIdx == {{table_field}}_length() - 1) {
+    end = {{list_field}}_length();
   } else {
-    end = pivot[pivotIdx + 1].start;
+    end = {{table_field}}_get_{{table_start}}(pivotIdx + 1);
   }
-  pivot[pivotIdx].len = end - start;
+  {{table_field}}_set_{{table_len}}(pivotIdx, end - start);
 }
 """[1:]
 
@@ -177,11 +334,9 @@ class PivotTable:
         self.ssbo = ssbo
 
         list_field, list_key = key
-        list_struct = ssbo.get_field(list_field)
-        list_dims = list_struct.get_num_elements()
         table_field, table_start, table_len = table
-        table_struct = ssbo.get_field(table_field)
-        table_dims = table_struct.get_num_elements()
+        self.list_field = list_field
+        self.table_field = table_field
 
         # Start shader
         render_args_start = dict(
@@ -191,36 +346,42 @@ class PivotTable:
             table_field=table_field,
             table_start=table_start,
         )
-        template_start = Template(pivot_start_source)
-        source_start = template_start.render(**render_args_start)
+        source_start = render_template(pivot_start_source, **render_args_start)
         if debug:
             for line_nr, line_txt in enumerate(source_start.split('\n')):
                 print(f"{line_nr+1:4d}  {line_txt}")
-        shader_start = Shader.make_compute(Shader.SL_GLSL, source_start)
-        shader_start.set_filename(Shader.STCompute, self.__class__.__name__ + "::start")
-        workgroups_start = (list_dims[0] // 32, 1, 1)
+        shader_start = compute_shader(source_start, self.__class__.__name__ + "::start")
         self.shader_start = shader_start
-        self.workgroups_start = workgroups_start
 
         # Length shader
         render_args_length = dict(
             ssbo=ssbo.full_glsl(),
+            list_field=list_field,
+            table_field=table_field,
+            table_start=table_start,
+            table_len=table_len,
         )
-        template_length = Template(pivot_length_source)
-        source_length = template_length.render(**render_args_length)
+        source_length = render_template(pivot_length_source, **render_args_length)
         if debug:
             for line_nr, line_txt in enumerate(source_length.split('\n')):
                 print(f"{line_nr+1:4d}  {line_txt}")
-        shader_length = Shader.make_compute(Shader.SL_GLSL, source_length)
-        shader_start.set_filename(Shader.STCompute, self.__class__.__name__ + "::length")
-        workgroups_length = (table_dims[0] // 32, 1, 1)
+        shader_length = compute_shader(source_length, self.__class__.__name__ + "::length")
         self.shader_length = shader_length
-        self.workgroups_length = workgroups_length
+
+    @property
+    def workgroups_start(self):
+        num_elements = self.ssbo.get_length(self.list_field)
+        return ((num_elements + 31) // 32, 1, 1)
+
+    @property
+    def workgroups_length(self):
+        num_elements = self.ssbo.get_length(self.table_field)
+        return ((num_elements + 31) // 32, 1, 1)
 
     def dispatch(self):
         np = NodePath("dummy")
         np.set_shader(self.shader_start)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         sattr = np.get_attrib(ShaderAttrib)
         base.graphicsEngine.dispatch_compute(
             self.workgroups_start,
@@ -230,7 +391,7 @@ class PivotTable:
 
         np = NodePath("dummy")
         np.set_shader(self.shader_length)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         sattr = np.get_attrib(ShaderAttrib)
         base.graphicsEngine.dispatch_compute(
             self.workgroups_length,
@@ -244,11 +405,12 @@ class PivotTable:
         cnnp_s = np.attach_new_node(cn_s)
 
         cnnp_s.set_shader(self.shader_start)
-        cnnp_s.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp_s)
 
         cnnp_s.set_bin(bin_name, 0)
         cn_s.set_bounds_type(BoundingVolume.BT_box)
         cn_s.set_bounds(np.get_bounds())
+        self.cn_s = cn_s
         self.cnnp_s = cnnp_s
 
         cn_l = ComputeNode(self.__class__.__name__ + "_length")
@@ -256,12 +418,253 @@ class PivotTable:
         cnnp_l = np.attach_new_node(cn_l)
 
         cnnp_l.set_shader(self.shader_length)
-        cnnp_l.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp_l)
 
         cnnp_l.set_bin(bin_name, 1)
         cn_l.set_bounds_type(BoundingVolume.BT_box)
         cn_l.set_bounds(np.get_bounds())
+        self.cn_l = cn_l
         self.cnnp_l = cnnp_l
+        self.ssbo.add_resize_callback(self.resize)
+
+    def resize(self, ssbo):
+        self.cn_s.set_dispatch(0, self.workgroups_start)
+        self.cn_l.set_dispatch(0, self.workgroups_length)
+
+
+# Builds the pivot table and sorts the elements by cell in linear time,
+# as a counting sort:
+# * `clear`: Zero each cell's length, and its cursor.
+# * `count`: Each element atomically adds 1 to its cell's length.
+# * A `PrefixSum` turns the lengths into the cells' starts.
+# * `scatter`: Each element atomically takes the next slot of its cell,
+#   counted by the cell's cursor, and is copied there. The order of
+#   elements within a cell is not kept.
+# * `copy`: When sorting in place, elements were scattered into a scratch
+#   array, and are copied back.
+# Cell indices beyond the table are treated as its last cell, so that
+# no element is lost.
+grid_build_head = """
+#version 430
+
+layout (local_size_x = 32, local_size_y = 1) in;
+
+{{ssbo}}
+
+layout(std430) buffer {{cursors_name}} {
+  uint cursors[];
+};
+
+{% if in_place %}
+layout(std430) buffer {{scratch_name}} {
+  {{type_name}} scratchElements[];
+};
+{% endif %}
+
+uint cellOf(uint idx) {
+  return min({{array}}_get_{{key}}(idx), {{table}}_length() - 1u);
+}
+"""[1:]
+
+
+grid_clear_source = grid_build_head + """
+void main() {
+  uint cellIdx = uint(gl_GlobalInvocationID.x);
+  if (cellIdx >= {{table}}_length()) {
+    return;
+  }
+  {{table}}_set_{{table_len}}(cellIdx, 0u);
+  cursors[cellIdx] = 0u;
+}
+"""
+
+
+grid_count_source = grid_build_head + """
+void main() {
+  uint idx = uint(gl_GlobalInvocationID.x);
+  if (idx >= {{array}}_length()) {
+    return;
+  }
+  {{table}}_atomicAdd_{{table_len}}(cellOf(idx), 1u);
+}
+"""
+
+
+grid_scatter_source = grid_build_head + """
+void main() {
+  uint idx = uint(gl_GlobalInvocationID.x);
+  if (idx >= {{array}}_length()) {
+    return;
+  }
+  uint cellIdx = cellOf(idx);
+  uint target = {{table}}_get_{{table_start}}(cellIdx) + atomicAdd(cursors[cellIdx], 1u);
+{% if in_place %}
+  scratchElements[target] = {{array}}_get(idx);
+{% else %}
+  {{out_array}}_set(target, {{array}}_get(idx));
+{% endif %}
+}
+"""
+
+
+grid_copy_source = grid_build_head + """
+void main() {
+  uint idx = uint(gl_GlobalInvocationID.x);
+  if (idx >= {{array}}_length()) {
+    return;
+  }
+  {{array}}_set(idx, scratchElements[idx]);
+}
+"""
+
+
+class GridBuild:
+    """
+    Does the work of sorting an array by its spatial hashes and building
+    a `PivotTable` for it, in a handful of dispatches that each touch
+    every element or cell once. The elements are sorted into
+    `out_array`, or in place if it is not given; Either way, the order
+    of elements within a cell is arbitrary.
+    """
+    def __init__(self, ssbo, key, table, out_array=None, debug=False):
+        array, hash_field = key
+        table_field, table_start, table_len = table
+        struct = ssbo.get_field(array)
+        assert len(struct.dims) == 1, "Just 1D arrays for now."
+        assert type(struct.get_field(hash_field)) is GlUInt, "Cell indices have to be uints."
+        if out_array is not None:
+            out_struct = ssbo.get_field(out_array)
+            assert out_struct.glsl_type_name == struct.glsl_type_name, \
+                "Elements have to be sorted into an array of the same struct."
+            assert out_struct.dims[0] >= struct.dims[0], \
+                "The output array has to fit all elements."
+        self.scratch_name = ssbo.glsl_type_name + 'GridScratch'
+        self.cursors_name = ssbo.glsl_type_name + 'GridCursors'
+        render_args = dict(
+            ssbo=ssbo.full_glsl(),
+            array=array,
+            key=hash_field,
+            type_name=struct.glsl_type_name,
+            table=table_field,
+            table_start=table_start,
+            table_len=table_len,
+            out_array=out_array,
+            in_place=out_array is None,
+            scratch_name=self.scratch_name,
+            cursors_name=self.cursors_name,
+        )
+        shaders = {}
+        for stage, template in [
+            ('clear', grid_clear_source),
+            ('count', grid_count_source),
+            ('scatter', grid_scatter_source),
+            ('copy', grid_copy_source),
+        ]:
+            if stage == 'copy' and out_array is not None:
+                continue
+            source = render_template(template, **render_args)
+            if debug:
+                print(f"{self.__class__.__name__}::{stage}")
+                for line_nr, line_txt in enumerate(source.split('\n')):
+                    print(f"{line_nr+1:4d}  {line_txt}")
+            shaders[stage] = compute_shader(source, f"{self.__class__.__name__}::{stage}")
+        self.shaders = shaders
+        self.prefix_sum = PrefixSum(
+            ssbo,
+            (table_field, table_len),
+            (table_field, table_start),
+            exclusive=True,
+            debug=debug,
+        )
+        self.ssbo = ssbo
+        self.array = array
+        self.table_field = table_field
+        self.in_place = out_array is None
+        self.capacity = None
+        self.nodes = []
+        self._allocate()
+
+    def _allocate(self):
+        # The scratch array holds as many elements as the array can, and
+        # there is a cursor for each cell.
+        self.prefix_sum._allocate()
+        struct = self.ssbo.get_field(self.array)
+        capacity = struct.dims[0]
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        num_cells = self.ssbo.get_field(self.table_field).dims[0]
+        self.cursors = _make_shader_buffer(self.cursors_name, 4 * num_cells)
+        scratch_size = struct._stride() * 4 * capacity if self.in_place else 0
+        self.scratch = _make_shader_buffer(self.scratch_name, scratch_size)
+
+    def _steps(self):
+        "(shader, workgroups, inputs) of each dispatch."
+        inputs = {
+            self.cursors_name: self.cursors,
+            self.scratch_name: self.scratch,
+        }
+        num_cells = self.ssbo.get_length(self.table_field)
+        num_elements = self.ssbo.get_length(self.array)
+        cell_groups = ((num_cells + 31) // 32, 1, 1)
+        element_groups = ((num_elements + 31) // 32, 1, 1)
+        steps = [
+            (self.shaders['clear'], cell_groups, inputs),
+            (self.shaders['count'], element_groups, inputs),
+        ]
+        steps.extend(self.prefix_sum._steps())
+        steps.append((self.shaders['scatter'], element_groups, inputs))
+        if self.in_place:
+            steps.append((self.shaders['copy'], element_groups, inputs))
+        return steps
+
+    def dispatch(self):
+        self._allocate()
+        for shader, workgroups, inputs in self._steps():
+            np = NodePath("dummy")
+            np.set_shader(shader)
+            np.set_shader_inputs(**self.ssbo.shader_inputs())
+            np.set_shader_inputs(**inputs)
+            sattr = np.get_attrib(ShaderAttrib)
+            base.graphicsEngine.dispatch_compute(
+                workgroups,
+                sattr,
+                base.win.get_gsg(),
+            )
+
+    def attach(self, np, bin_name):
+        self.np = np
+        self.bin_name = bin_name
+        self._attach_nodes()
+        self.ssbo.add_resize_callback(self.resize)
+
+    def _attach_nodes(self):
+        for idx, (shader, workgroups, inputs) in enumerate(self._steps()):
+            cn = ComputeNode(f"{self.__class__.__name__}-{idx}")
+            cn.add_dispatch(workgroups)
+            cnnp = self.np.attach_new_node(cn)
+            cnnp.set_shader(shader)
+            self.ssbo.bind(cnnp)
+            cnnp.set_shader_inputs(**inputs)
+            cnnp.set_bin(self.bin_name, idx)
+            cn.set_bounds_type(BoundingVolume.BT_box)
+            cn.set_bounds(self.np.get_bounds())
+            self.nodes.append((cn, cnnp))
+
+    def resize(self, ssbo):
+        self._allocate()
+        steps = self._steps()
+        if len(steps) != len(self.nodes):
+            # The prefix sum has more or fewer levels now.
+            for cn, cnnp in self.nodes:
+                self.ssbo.unbind(cnnp)
+                cnnp.remove_node()
+            self.nodes = []
+            self._attach_nodes()
+            return
+        for (cn, cnnp), (shader, workgroups, inputs) in zip(self.nodes, steps):
+            cn.set_dispatch(0, workgroups)
+            cnnp.set_shader_inputs(**inputs)
 
 
 pairwise_action_source = """
@@ -271,19 +674,7 @@ layout (local_size_x = 32, local_size_y = 1) in;
 
 uniform float osg_DeltaFrameTime;
 
-ivec3 cellIdxToCell (uint cellIdx, ivec3 res) {
-  ivec3 cell = ivec3(mod(cellIdx, res.x),
-                     mod(floor(cellIdx / res.x), res.y),
-                     floor(cellIdx / (res.x * res.y)));
-  return cell;
-}
-
-uint cellToCellIdx (ivec3 cell, ivec3 res) {
-  uint cellIdx = cell.x + 
-                 cell.y * res.x + 
-                 cell.z * res.x * res.y;
-  return cellIdx;
-}
+{{cell_index}}
 
 vec3 clampVec(vec3 v, float minL, float maxL) {
   float vL = length(v);
@@ -305,32 +696,79 @@ vec3 clampVec(vec3 v, vec3 minV, vec3 maxV) {
 
 {{declarations}}
 
-void pairwiseInteraction(Boid a, Boid b) {
+{% if indexing == 'hashed' %}
+// The table entries scanned so far are kept in a list of up to this
+// many, so that an entry shared by several cells is scanned only once.
+const uint maxVisited = 32u;
+
+// Whether a cell that the scan visits before `cell` has the same table
+// entry `cellIdx`, so that the entry's elements were already considered.
+// Only used once the list of visited entries is full.
+bool scannedBefore(uint cellIdx, ivec3 cell, ivec3 lower, ivec3 upper, ivec3 res) {
+  for (int x=lower.x; x<=upper.x; x++) {
+    for (int y=lower.y; y<=upper.y; y++) {
+      for (int z=lower.z; z<=upper.z; z++) {
+        if (ivec3(x, y, z) == cell) {
+          return false;
+        }
+        if (cellToCellIdx(ivec3(x, y, z), res) == cellIdx) {
+          return true;
+        }
+      }
+    }
+  }
+  return false;
+}
+{% endif %}
+
+{% if neighbour_by_index %}
+// `a` is the element, and `aIdx` its index; Of the neighbour, only the
+// index `bIdx` is passed, so that just the fields that are used are
+// read, e.g. with `{{particles}}_get_{{position}}(bIdx)`.
+void pairwiseInteraction({{particle_type}} a, uint aIdx, uint bIdx) {
+{% else %}
+void pairwiseInteraction({{particle_type}} a, {{particle_type}} b) {
+{% endif %}
 {{pairwise}}
 }
 
 void main() {
   // Which boid are we processing? Where is it?
   uint boidIdx = uint(gl_GlobalInvocationID.x);
+  if (boidIdx >= {{particles}}_length()) {
+    return;
+  }
 
   // And where, in terms of spatial hash cell, are we?
-  uint cellIdx = boids[boidIdx].hashIdx;
   ivec3 res = ivec3({{gridRes[0]}}, {{gridRes[1]}}, {{gridRes[2]}});
   vec3 vol = vec3({{gridVol[0]}}, {{gridVol[1]}}, {{gridVol[2]}});
   vec3 cellSize = vec3(vol / res);
+{% if indexing == 'hashed' %}
+  // Hashes can't be turned back into cells, so we ask the position.
+  ivec3 cell = ivec3(floor({{particles}}_get_{{position}}(boidIdx) / cellSize));
+{% else %}
+  uint cellIdx = {{particles}}_get_{{hash_field}}(boidIdx);
   ivec3 cell = cellIdxToCell(cellIdx, res);
+{% endif %}
 
   // The radius, how many cells does it cover?
   // From where to where will we scan the cell grid?
   ivec3 reach = ivec3(ceil(vec3(radius) / cellSize));
   ivec3 lower = cell - reach;
-  lower = max(lower, ivec3(0));
-  lower = min(lower, res);
   ivec3 upper = (cell + reach);
+{% if indexing != 'hashed' %}
+  lower = max(lower, ivec3(0));
+  lower = min(lower, res - 1);
   upper = max(upper, ivec3(0));
-  upper = min(upper, res);
+  upper = min(upper, res - 1);
+{% endif %}
 
+  {{particle_type}} a = {{particles}}_get(boidIdx);
   uint scanIdx;
+{% if indexing == 'hashed' %}
+  uint visited[maxVisited];
+  uint numVisited = 0u;
+{% endif %}
   // For each cell that is considered relevant (because its volume is
   // less than radius away from the boid's cell), ...
   for (int x=lower.x; x<=upper.x; x++) {
@@ -338,10 +776,40 @@ void main() {
       for (int z=lower.z; z<=upper.z; z++) {
         // ...consider all boids in it, ...
         scanIdx = cellToCellIdx(ivec3(x, y, z), res);
-        Pivot p = pivot[scanIdx];
+{% if indexing == 'hashed' %}
+        // (unless its table entry was already scanned for another cell,)
+        if (numVisited < maxVisited) {
+          bool seen = false;
+          for (uint v = 0u; v < numVisited; v++) {
+            if (visited[v] == scanIdx) {
+              seen = true;
+              break;
+            }
+          }
+          if (seen) {
+            continue;
+          }
+          visited[numVisited] = scanIdx;
+          numVisited++;
+        } else if (scannedBefore(scanIdx, ivec3(x, y, z), lower, upper, res)) {
+          continue;
+        }
+{% endif %}
+        {{pivot_type}} p = {{pivot_table}}_get(scanIdx);
         for (uint idx = p.start; idx < p.start + p.len; idx++) {
+{% if indexing == 'hashed' %}
+          // (and skip those from other cells that share the entry,)
+          ivec3 otherCell = ivec3(floor({{particles}}_get_{{position}}(idx) / cellSize));
+          if (any(lessThan(otherCell, lower)) || any(greaterThan(otherCell, upper))) {
+            continue;
+          }
+{% endif %}
           if (idx != boidIdx) {  // Don't consider yourself!
-            pairwiseInteraction(boids[boidIdx], boids[idx]);
+{% if neighbour_by_index %}
+            pairwiseInteraction(a, boidIdx, idx);
+{% else %}
+            pairwiseInteraction(a, {{particles}}_get(idx));
+{% endif %}
           }
         }
       }
@@ -356,36 +824,55 @@ void main() {
 class PairwiseAction:
     def __init__(self, ssbo, particles, pivot_table,
                  declarations, pairwise, postprocessing,
+                 indexing='linear', table_size=None, position='pos',
+                 hash_field='hashIdx', neighbour_by_index=False,
                  debug=False, src_args=None, shader_args=None):
         if src_args is None:
             src_args = dict()
+        _check_indexing(indexing, src_args.get('gridRes', (0, 0, 0)), table_size)
+        _check_pivot_table(ssbo, pivot_table, indexing, table_size)
         struct = ssbo.get_field(particles)
-        dims = struct.get_num_elements()
         render_args = dict(
             ssbo=ssbo.full_glsl(),
+            particles=particles,
+            particle_type=struct.glsl_type_name,
+            pivot_table=pivot_table,
+            pivot_type=ssbo.get_field(pivot_table).glsl_type_name,
             declarations=declarations,
             pairwise=pairwise,
             postprocessing=postprocessing,
+            indexing=indexing,
+            position=position,
+            hash_field=hash_field,
+            neighbour_by_index=neighbour_by_index,
+            cell_index=render_template(
+                cell_index_template,
+                indexing=indexing,
+                table_size=table_size,
+            ),
             **src_args,
         )
-        template = Template(pairwise_action_source)
-        source = template.render(**render_args)
+        source = render_template(pairwise_action_source, **render_args)
         if debug:
             for line_nr, line_txt in enumerate(source.split('\n')):
                 print(f"{line_nr+1:4d}  {line_txt}")
-        shader = Shader.make_compute(Shader.SL_GLSL, source)
-        workgroups = (dims[0] // 32, 1, 1)
+        shader = compute_shader(source, self.__class__.__name__)
         self.ssbo = ssbo
         self.shader = shader
-        self.workgroups = workgroups
+        self.particles = particles
         if shader_args is None:
             shader_args = dict()
         self.shader_args = shader_args
 
+    @property
+    def workgroups(self):
+        num_elements = self.ssbo.get_length(self.particles)
+        return ((num_elements + 31) // 32, 1, 1)
+
     def dispatch(self):
         np = NodePath("dummy")
         np.set_shader(self.shader)
-        np.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        np.set_shader_inputs(**self.ssbo.shader_inputs())
         for glsl_name, value in self.shader_args.items():
             np.set_shader_input(glsl_name, value)            
         sattr = np.get_attrib(ShaderAttrib)
@@ -401,14 +888,19 @@ class PairwiseAction:
         cnnp = np.attach_new_node(cn)
 
         cnnp.set_shader(self.shader)
-        cnnp.set_shader_input(self.ssbo.glsl_type_name, self.ssbo.ssbo)
+        self.ssbo.bind(cnnp)
         for glsl_name, value in self.shader_args.items():
             cnnp.set_shader_input(glsl_name, value)            
 
         cnnp.set_bin(bin_name, 0)
         cn.set_bounds_type(BoundingVolume.BT_box)
         cn.set_bounds(np.get_bounds())
+        self.cn = cn
         self.cnnp = cnnp
+        self.ssbo.add_resize_callback(self.resize)
+
+    def resize(self, ssbo):
+        self.cn.set_dispatch(0, self.workgroups)
 
     def set_shader_arg(self, name, value):
         self.cnnp.set_shader_input(name, value)
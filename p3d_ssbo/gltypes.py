@@ -42,28 +42,101 @@
 #   at the top level. Syntactic candy, like `pack` and `unpack`.
 #   * `_size`: (buffer size, trailing) -> (new size, new trailing)
 # * `pack`: py_data -> byte_data.
-#   * `_pack`: (py_data, byte_data, rest_dims, trailing) ->
-#              (new byte_data, new trailing)
-#     There are two possible cases:
-#     1) This element is *not* an array. Pad to trailing alignment,
-#        `_add_element`, return the updated buffer and the new trailing.
-#     2) It *is* an array. Pad to trailing alignment, then call `_pack`
-#        recursively (sidestepping the padding to trailing) until
-#        individual elements are reached again.
-#     * `_add_element`: (byte_data, py_data)->(new byte_data, trailing)
-#       * pack_element`: Turn Python data to byte data
+#   Packing and unpacking do not walk the type tree for every element.
+#   Instead, each type compiles a layout plan once and caches it:
+#   * `element_format`: `struct` format of a single element, including
+#     the padding inside of it. Structs inline their fields' formats,
+#     arrays of fields within them included.
+#   * `_element_struct`: The compiled `struct.Struct` for that format.
+#     For struct instances, it is cached on the `Struct`, so that all
+#     instances of a struct type share it.
+#   * `_stride`: Distance between two elements' starts in an array.
+#   * `_field_offsets`: For structs and buffers, where their fields
+#     start, as calculated with `_size`.
+#   * `pack_into`: (buffer, py_data, offset) -> None
+#     Like `pack`, but writes into an existing writable buffer
+#     (`bytearray`, `memoryview`, ...). `pack` itself preallocates one
+#     `bytearray` of the final length and fills it in place, so packing
+#     is linear in the buffer size.
+#   * `_pack_into`: (buffer, py_data, write_at) -> None
+#     Flattens each element's Python data into a list of scalars with
+#     `_flatten_element`, and packs it with the element struct straight
+#     into the buffer. Padding is never written, it is left as the
+#     zeroes that the buffer was allocated with. Buffers let each of
+#     their fields do this for themselves, so top-level arrays are
+#     packed element by element.
+#   * `pack_stream`: (iterator, buffer, offset) -> buffer
+#     Packs an array from an iterator of its (outermost) elements, taking
+#     `chunk_size` of them at a time, so that the Python data never has
+#     to be in memory all at once.
 # * `unpack`: byte_data -> py_data
-#   * `_unpack`: (byte_data, read_at, rest_dims, trailing) ->
-#                (py_data, read_at, trailing)
-#     The converse to `_pack`. Instead of removing data from the buffer,
-#     though, it uses an index into the data (read_at). Otherwise, it
-#     works exactly like `_pack`.
-#     * `_read_element`: (byte_data, read_at)->(py_data, trailing)
-#       * `unpack_element`: Return Python data at read_at
+#   * `_unpack_from`: (byte_data, read_at) -> py_data
+#     The converse to `_pack_into`, reading each element with the
+#     element struct, and rebuilding the Python data from the scalars
+#     with `_build_element`.
+# * `numpy_dtype`: NumPy dtype of one element, padded to the array
+#   stride. Structs and buffers are structured dtypes with explicit field
+#   offsets and item sizes, so `np.frombuffer(byte_data, dtype)` views
+#   buffer contents without copying or decoding anything.
+#   * `_numpy_field_dtype`: A field's dtype inside of its struct or
+#     buffer, its array dimensions included.
+#   Arrays of vectors with padding between their elements (`vec3`)
+#   expose that padding as an additional component.
+#   * `_numpy_encode`: Converts a column of values to what a NumPy view
+#     holds, for types like `GlUnorm4x8` which pack floats into ints.
+# * `glsl_helpers`: GLSL functions that a type needs in shaders, added
+#   once by `full_glsl`.
+# * `view`: byte_data -> lazy view
+#   Wraps the data in a `memoryview` without decoding anything. Indexing
+#   into the returned `ArrayView` / `StructView` decodes only the element
+#   or field that is asked for, using the same offsets and element
+#   structs as `unpack`.
+#   * `_view`: (byte_data, read_at, rest_dims) -> view or Python data
+# * `get_offset`, `get_stride`, `layout_table`: Where fields are, in
+#   bytes. Paths name fields with dots and index arrays with brackets,
+#   e.g. `'boids[3].nextDir'`; Arrays that are not indexed are read as
+#   index 0. These use the same `_field_offsets` and `_stride` as the
+#   packer, and are memoized per path.
+#
+# Buffers can also be saved to and loaded from files (`save`,
+# `from_file`), which hold the raw buffer data behind a header with a
+# hash of `full_glsl()`, so that data is only ever loaded into buffers
+# of the same layout.
+#
+# Buffers can store their top-level arrays of structs as one array per
+# struct field (`layout='soa'`). Their `declared_fields` are then the
+# fields as given, and `fields` the arrays that are actually stored;
+# Python data is split into / joined from those by `_soa_split` and
+# `_soa_join`. Shaders access elements through the functions from
+# `glsl_accessors`, which hide which layout is used.
+#
+# An unbounded array at the end of a buffer is resizable: Its dims are
+# its capacity, and `num_elements` of them are live, which shaders get
+# as a uniform through `shader_inputs` / `bind`. `resize` reallocates
+# the `ShaderBuffer`, leaving the copy of the old contents to
+# `p3d_ssbo.algos.resize_copy.ResizeCopy`, and tells the nodes and
+# callbacks that are registered with it.
+#
+# An `Arena` packs many small logical buffers into one `ShaderBuffer`.
+# Each `ArenaAllocation` is laid out like a `Buffer`, starting at a word
+# offset (its `base`), and shaders read and write it through word-level
+# accessors that take that base. Allocation is first fit; When nothing
+# fits, the live allocations are compacted into a new `ShaderBuffer`,
+# which is copied into by `ResizeCopy` like a resized buffer is.
+#
+# Leaf types are scalars (`GlFloat`, `GlInt`, `GlUInt`, `GlDouble`),
+# vectors (`GlVectorType` subclasses), square matrices (`GlMatrixType`,
+# stored as arrays of columns), and packed types (`GlPackedType`). Sizes
+# and alignments are counted in 4-byte words throughout, so a `double`
+# is two words.
 #
 # Structs are a bit special, FIXME:
 # * There's Type and there's Instance
-# * They overwrite `_add_element` and `_read_element`.
+# * The type holds the layout plan, the instance dims and a field name.
+# * With `optimize_layout=True`, the type stores its fields in the order
+#   that needs the least padding (`fields`), while Python data stays in
+#   the declaration order (`declared_fields`). `_flatten_element` and
+#   `_build_element` translate between the two.
 #
 # Often used variable names
 # * buffer_so_far: Binary buffer content.
@@ -72,16 +145,33 @@
 #   align to.
 
 
-from array import array
+from collections import namedtuple
+from collections.abc import Iterator
+import copy
+from functools import cached_property
+from functools import lru_cache
+import hashlib
+from itertools import islice
 import math
+import mmap
+import re
+import struct
+
+import numpy as np
 
-from panda3d.core import LVecBase2f
-from panda3d.core import LVecBase3f
 from panda3d.core import ShaderBuffer
 from panda3d.core import GeomEnums
 
 
 class GlType:
+    # GLSL code that fields of this type need in shaders, e.g. functions
+    # to decode them; Added once per type by `Buffer.full_glsl`.
+    glsl_helpers = ''
+    # How single-word values are turned from and into the `uint` words
+    # that `Arena` shaders read and write.
+    glsl_from_word = '{}'
+    glsl_to_word = '{}'
+
     def __init__(self, field_name, *dims, unbounded=False):
         self.field_name = field_name
         self.dims = dims
@@ -92,7 +182,7 @@ class GlType:
         Return the GLSL string defining the element.
         """
         if self.unbounded:
-            dim_string = ''.join(f'[{d}]' for d in self.dims[:-1]) + '[]'
+            dim_string = '[]' + ''.join(f'[{d}]' for d in self.dims[1:])
         else:
             dim_string = ''.join(f'[{d}]' for d in self.dims)
         return self.glsl_type_name  + ' ' + self.field_name + dim_string + ';'
@@ -131,173 +221,949 @@ class GlType:
             trailing = self.alignment
         return size_so_far, trailing
 
+    def _stride(self):
+        "Distance between the starts of two array elements, in words."
+        return self.element_size + self._calculate_offset(self.element_size)
+
+    def _extent(self):
+        "Words from the start of the first element to the end of the last."
+        count = math.prod(self.dims)
+        return self._stride() * (count - 1) + self.element_size
+
+    def _array_format(self):
+        """
+        `struct` format of all of this field's elements, including the
+        padding between them. Used to inline fields into a struct's
+        format.
+        """
+        element_format = self.element_format
+        gap = _pad_format(self._stride() - self.element_size)
+        count = math.prod(self.dims)
+        return (element_format + gap) * (count - 1) + element_format
+
+    @cached_property
+    def _element_struct(self):
+        "Compiled `struct.Struct` that packs and unpacks one element."
+        return struct.Struct('<' + self.element_format)
+
     def pack(self, py_data):
-        "Turn this Python data structure into buffer byte data."
-        byte_data, trailing = self._pack(
-            py_data,
-            b''
-        )
-        byte_data += b'\x00' * self._calculate_offset(len(byte_data), trailing)
+        """
+        Turn this Python data structure into buffer byte data. Returns a
+        `bytearray`.
+        """
+        byte_data = bytearray(self._extent() * 4)
+        self._pack_into(byte_data, py_data, 0)
         return byte_data
 
-    def _pack(self, py_data, byte_data, rest_dims=None, trailing=0):
-        if rest_dims is None:
-            rest_dims = self.dims
-            byte_data = self._pad_to_alignment(byte_data, trailing)
-        # Add data
-        if rest_dims == ():  # Individual element
-            byte_data = self._pad_to_alignment(byte_data)
-            byte_data, next_trailing = self._add_element(byte_data, py_data)
-        else:  # Array
-            assert len(py_data) == self.dims[0], f"{len(py_data)} elements given for a size {self.dims[0]} array."
-            for idx, py_data_piece in enumerate(py_data):
-                byte_data, trailing = self._pack(
-                    py_data_piece,
-                    byte_data,
-                    rest_dims[1:],
-                )
-            next_trailing = self.alignment
-        return byte_data, next_trailing
+    def pack_into(self, byte_data, py_data, offset=0):
+        """
+        Write this Python data structure into the writable buffer
+        `byte_data`, starting at byte `offset`. Padding bytes are not
+        written, so the buffer should be zeroed beforehand.
+        """
+        assert offset % 4 == 0
+        assert len(byte_data) >= offset + self._extent() * 4, "Buffer is too small."
+        self._pack_into(byte_data, py_data, offset)
 
-    def _pad_to_alignment(self, byte_data, trailing=0):
-        assert len(byte_data) % 4 == 0
-        pad_length = self._calculate_offset(len(byte_data) // 4, trailing)
-        byte_data += b'\x00' * pad_length * 4
+    def _pack_into(self, byte_data, py_data, write_at):
+        pack_element = self._element_struct.pack_into
+        stride = self._stride() * 4
+        for idx, element in enumerate(_iter_elements(py_data, self.dims)):
+            values = []
+            self._flatten_element(element, values)
+            pack_element(byte_data, write_at + idx * stride, *values)
+
+    def pack_stream(self, elements, byte_data=None, offset=0, chunk_size=4096):
+        """
+        Pack an array from an iterable of its elements (its rows, for
+        multidimensional arrays), e.g. a generator that creates them on
+        the fly. Elements are taken `chunk_size` at a time, so only that
+        many are held in memory at once. Writes into `byte_data` at byte
+        `offset` like
+        `pack_into` if it is given, otherwise into a new `bytearray`,
+        and returns it.
+        """
+        assert self.dims != (), f"{self.field_name} is not an array."
+        if byte_data is None:
+            byte_data = bytearray(self._extent() * 4)
+        assert offset % 4 == 0
+        assert len(byte_data) >= offset + self._extent() * 4, "Buffer is too small."
+        _pack_chunks(
+            elements,
+            self.dims[0],
+            lambda first, chunk: self._pack_elements(byte_data, chunk, first, offset),
+            chunk_size,
+        )
         return byte_data
 
-    def _add_element(self, byte_data, py_data):
-        byte_data += self.pack_element(py_data)
-        trailing = 0
-        return byte_data, trailing
+    def _pack_elements(self, byte_data, elements, first, write_at):
+        "Pack rows of the array, starting with row `first`."
+        pack_element = self._element_struct.pack_into
+        stride = self._stride() * 4
+        rest_dims = self.dims[1:]
+        idx = first * math.prod(rest_dims)
+        for row in elements:
+            for element in _iter_elements(row, rest_dims):
+                values = []
+                self._flatten_element(element, values)
+                pack_element(byte_data, write_at + idx * stride, *values)
+                idx += 1
+
+    def _flatten(self, py_data, values, rest_dims):
+        "Append the scalars of (an array of) elements to `values`."
+        if rest_dims == ():
+            self._flatten_element(py_data, values)
+        else:
+            for element in _iter_elements(py_data, rest_dims):
+                self._flatten_element(element, values)
 
     def unpack(self, byte_data):
-        py_data, read_at, trailing = self._unpack(byte_data)
-        return py_data
+        "Turn buffer byte data into a Python data structure."
+        return self._unpack_from(byte_data, 0)
+
+    def _unpack_from(self, byte_data, read_at):
+        element_struct = self._element_struct
+        stride = self._stride() * 4
+        start = read_at * 4
+        elements = [
+            self._build_element(
+                element_struct.unpack_from(byte_data, start + idx * stride),
+                0,
+            )[0]
+            for idx in range(math.prod(self.dims))
+        ]
+        return _nest(elements, self.dims)
+
+    def view(self, byte_data):
+        """
+        Return a lazy view on buffer byte data, which decodes only the
+        elements and fields that are indexed, e.g.
+        `buffer.view(byte_data)['boids'][42]['pos']`.
+        """
+        return self._view(memoryview(byte_data), 0, self.dims)
+
+    def _view(self, byte_data, read_at, rest_dims):
+        if rest_dims != ():
+            return ArrayView(self, byte_data, read_at, rest_dims)
+        return self._view_element(byte_data, read_at)
+
+    def _view_element(self, byte_data, read_at):
+        values = self._element_struct.unpack_from(byte_data, read_at * 4)
+        return self._build_element(values, 0)[0]
+
+    def numpy_dtype(self):
+        """
+        Return the NumPy dtype of one element, padded to the array
+        stride.
+        """
+        stride = self._stride()
+        if stride == self.element_size:
+            return self._numpy_element_dtype()
+        component_size = np.dtype(self.numpy_format).itemsize
+        return np.dtype((self.numpy_format, (stride * 4 // component_size,)))
+
+    def _numpy_element_dtype(self):
+        if self.numpy_shape == ():
+            return np.dtype(self.numpy_format)
+        return np.dtype((self.numpy_format, self.numpy_shape))
+
+    def _numpy_field_dtype(self):
+        if self.dims == ():
+            return self._numpy_element_dtype()
+        return np.dtype((self.numpy_dtype(), self.dims))
+
+    def _numpy_encode(self, values):
+        "Convert a column of values to what a NumPy view on the field holds."
+        return values
+
+    @classmethod
+    def _glsl_read_element(cls, word):
+        """
+        GLSL expression for one element stored in `uint` words, where
+        `word(k)` is the expression of its k-th word.
+        """
+        return cls.glsl_from_word.format(word(0))
 
-    def _unpack(self, byte_data, read_at=0, rest_dims=None, trailing=0):
-        # Align to trailing offset
-        if rest_dims is None:
-            rest_dims = self.dims
-            read_at += self._calculate_offset(read_at, trailing)
-        # Unpack_data
+    @classmethod
+    def _glsl_write_element(cls, word, value):
+        "GLSL statements storing the element `value` into words."
+        return [f"{word(0)} = {cls.glsl_to_word.format(value)};"]
+
+    def _numpy_unpad(self, view):
+        "Strip padding components off a NumPy view on this field."
+        if self.dims != () and self._stride() > self.element_size:
+            return view[..., :self.numpy_shape[0]]
+        return view
+
+    def _build(self, values, read_at, rest_dims):
+        """
+        Rebuild (an array of) elements from the scalars in `values`,
+        starting at index `read_at`. Returns the Python data and the
+        index after the consumed scalars.
+        """
         if rest_dims == ():
-            read_at += self._calculate_offset(read_at)
-            py_data, trailing = self._read_element(byte_data, read_at)
-            read_at += self.element_size
+            return self._build_element(values, read_at)
+        py_data = []
+        for _ in range(rest_dims[0]):
+            py_data_piece, read_at = self._build(values, read_at, rest_dims[1:])
+            py_data.append(py_data_piece)
+        return tuple(py_data), read_at
+
+
+def _pad_format(length):
+    "`struct` format for `length` words of padding."
+    if length == 0:
+        return ''
+    return f'{length * 4}x'
+
+
+def _field_offsets(fields):
+    "Offsets (in words) at which the fields of a struct or buffer start."
+    offsets = []
+    size = 0
+    trailing = 0
+    for field in fields:
+        offsets.append(size + field._calculate_offset(size, trailing))
+        size, trailing = field._size(size, trailing)
+    return offsets
+
+
+def _numpy_struct_dtype(fields, offsets, itemsize):
+    "Structured dtype of fields at the given word offsets."
+    return np.dtype(
+        dict(
+            names=[f.field_name for f in fields],
+            formats=[f._numpy_field_dtype() for f in fields],
+            offsets=[offset * 4 for offset in offsets],
+            itemsize=itemsize,
+        )
+    )
+
+
+def _struct_stride(fields):
+    "Array stride in words of a struct with these fields, in this order."
+    size = 0
+    trailing = 0
+    for field in fields:
+        size, trailing = field._size(size, trailing)
+    alignment = max(f.alignment for f in fields)
+    return size + (-size) % alignment
+
+
+def _optimized_field_order(fields):
+    """
+    Return the fields in the order that gives a struct of them the
+    smallest array stride. Fields that align, extend, and make the next
+    field align the same are interchangeable, so the search runs over
+    those kinds of fields, remembering the best order for the kinds that
+    are left to place, where in the struct's alignment the next one
+    would start, and the trailing alignment. Fields of a kind keep their
+    declaration order, and if no order is better than the declared one,
+    that is what is returned.
+    """
+    alignment = max(f.alignment for f in fields)
+    kinds = []
+    fields_of_kind = {}
+    for field in fields:
+        kind = (field.alignment, field._extent(), field._size()[1])
+        if kind not in fields_of_kind:
+            kinds.append(kind)
+            fields_of_kind[kind] = []
+        fields_of_kind[kind].append(field)
+
+    @lru_cache(maxsize=None)
+    def best_order(counts, phase, trailing):
+        # -> (words until the end of the struct, order of kind indices)
+        if not any(counts):
+            return (-phase) % alignment, ()
+        best = None
+        for kind_idx, count in enumerate(counts):
+            if count == 0:
+                continue
+            field_alignment, extent, next_trailing = kinds[kind_idx]
+            pad_length = (-phase) % max(field_alignment, trailing)
+            rest_counts = list(counts)
+            rest_counts[kind_idx] -= 1
+            rest_size, rest_order = best_order(
+                tuple(rest_counts),
+                (phase + pad_length + extent) % alignment,
+                next_trailing,
+            )
+            size = pad_length + extent + rest_size
+            if best is None or size < best[0]:
+                best = (size, (kind_idx, ) + rest_order)
+        return best
+
+    counts = tuple(len(fields_of_kind[kind]) for kind in kinds)
+    size, order = best_order(counts, 0, 0)
+    if size >= _struct_stride(fields):
+        return fields
+    remaining = {kind: iter(fields_of_kind[kind]) for kind in kinds}
+    return tuple(next(remaining[kinds[kind_idx]]) for kind_idx in order)
+
+
+FieldLayout = namedtuple(
+    'FieldLayout',
+    ['path', 'glsl_type_name', 'offset', 'size', 'stride', 'dims'],
+)
+FieldLayout.__doc__ = """
+Where a field is, in bytes. `size` covers all of an array's elements,
+`stride` is the distance between them, or for fields of structs in an
+array, between those of consecutive elements, like `get_stride` tells
+(`None` if the field isn't in an array).
+"""
+
+
+_path_token = re.compile(r'\.?(\w+)|\[(\d+)\]')
+
+
+def _resolve_path(container, field, path):
+    """
+    Follow a field path like `'boids[3].pos'`, starting either in a
+    struct or buffer (`container`), or at an array field (`field`).
+    Returns the field at the end of the path, its offset in words, and
+    the stride in words of the innermost array on the path (or `None`).
+    """
+    offset = 0
+    stride = None
+    rest_dims = () if field is None else field.dims
+    if field is not None and field.dims != ():
+        stride = field._stride()
+    end = 0
+    for match in _path_token.finditer(path):
+        assert match.start() == end, f"Can't parse field path {path!r}."
+        end = match.end()
+        field_name, index = match.groups()
+        if index is not None:
+            assert rest_dims != (), f"{path!r} indexes something that is not an array."
+            index = int(index)
+            assert index < rest_dims[0], f"Index {index} out of range in {path!r}."
+            offset += index * field._stride() * math.prod(rest_dims[1:])
+            rest_dims = rest_dims[1:]
         else:
-            stride = self.element_size * math.prod(rest_dims[1:])
-            py_data = tuple(
-                self._unpack(
-                    byte_data,
-                    read_at + index * stride,
-                    rest_dims[1:],
-                )[0]
-                for index in range(rest_dims[0])
+            if field is not None:
+                assert isinstance(field, StructInstance), f"{field.field_name} in {path!r} has no fields."
+                container = field.type_obj
+                rest_dims = ()
+            field = container.field_by_name[field_name]
+            offset += container._field_offset_by_name[field_name]
+            rest_dims = field.dims
+            if field.dims != ():
+                stride = field._stride()
+    assert end == len(path), f"Can't parse field path {path!r}."
+    return field, offset, stride
+
+
+def _layout_rows(container, prefix='', base=0, array_stride=None):
+    """
+    `FieldLayout`s for the fields of a struct or buffer, recursively.
+    `array_stride` is the stride of the array the container is in.
+    """
+    rows = []
+    for field, offset in zip(container.fields, container._field_offsets):
+        path = prefix + field.field_name
+        stride = array_stride
+        if field.dims != ():
+            stride = field._stride() * 4
+        rows.append(
+            FieldLayout(
+                path,
+                field.glsl_type_name,
+                (base + offset) * 4,
+                field._extent() * 4,
+                stride,
+                field.dims,
             )
-            read_at += stride * rest_dims[0]
-            trailing = self.alignment
-        return py_data, read_at, trailing
+        )
+        if isinstance(field, StructInstance):
+            rows.extend(_layout_rows(field.type_obj, path + '.', base + offset, stride))
+    return rows
+
+
+def _iter_elements(py_data, rest_dims):
+    "Yield the individual elements of a (nested) array in row-major order."
+    if rest_dims == ():
+        yield py_data
+    else:
+        assert len(py_data) == rest_dims[0], f"{len(py_data)} elements given for a size {rest_dims[0]} array."
+        for py_data_piece in py_data:
+            yield from _iter_elements(py_data_piece, rest_dims[1:])
 
-    def _read_element(self, byte_data, read_at):
-        py_data = self.unpack_element(byte_data, read_at)
-        trailing = 0  # FIXME?
-        return py_data, trailing
+
+def _pack_chunks(elements, num_elements, pack_chunk, chunk_size):
+    """
+    Call `pack_chunk(first_index, chunk)` for consecutive chunks of
+    `elements`. Packing holds the GIL, so there is nothing to gain from
+    doing it on several threads; For that, pack columns with NumPy.
+    """
+    elements = iter(elements)
+    for first in range(0, num_elements, chunk_size):
+        chunk = list(islice(elements, min(chunk_size, num_elements - first)))
+        assert len(chunk) == min(chunk_size, num_elements - first), \
+            f"{first + len(chunk)} elements given for a size {num_elements} array."
+        pack_chunk(first, chunk)
+    assert next(elements, None) is None, \
+        f"More than {num_elements} elements given for a size {num_elements} array."
+
+
+def _nest(elements, dims):
+    "Turn a flat list of elements into nested tuples of shape `dims`."
+    if dims == ():
+        return elements[0]
+    if len(dims) == 1:
+        return tuple(elements)
+    chunk = len(elements) // dims[0]
+    return tuple(
+        _nest(elements[idx * chunk:(idx + 1) * chunk], dims[1:])
+        for idx in range(dims[0])
+    )
 
 
 class GlFloat(GlType):
     glsl_type_name = 'float'
     alignment = 1
     element_size = 1
+    element_format = 'f'
+    numpy_format = '<f4'
+    numpy_shape = ()
+    glsl_from_word = 'uintBitsToFloat({})'
+    glsl_to_word = 'floatBitsToUint({})'
 
-    def pack_element(self, py_data):
+    def _flatten_element(self, py_data, values):
         assert isinstance(py_data, (int, float))
-        return array('f', [py_data]).tobytes()
+        values.append(py_data)
 
-    def unpack_element(self, byte_data, read_at):
-        start = read_at * 4
-        end = (read_at + self.element_size) * 4
-        element_byte_data = byte_data[start:end]
-        a = array('f')
-        a.frombytes(element_byte_data)
-        py_data = a.tolist()[0]
-        return py_data
+    def _build_element(self, values, read_at):
+        return values[read_at], read_at + 1
 
 
 class GlUInt(GlType):
     glsl_type_name = 'uint'
     alignment = 1
     element_size = 1
+    element_format = 'I'
+    numpy_format = '<u4'
+    numpy_shape = ()
 
-    def pack_element(self, py_data):
+    def _flatten_element(self, py_data, values):
         assert isinstance(py_data, int)
-        return array('I', [py_data]).tobytes()
+        values.append(py_data)
+
+    def _build_element(self, values, read_at):
+        return values[read_at], read_at + 1
+
+
+class GlInt(GlType):
+    glsl_type_name = 'int'
+    alignment = 1
+    element_size = 1
+    element_format = 'i'
+    numpy_format = '<i4'
+    numpy_shape = ()
+    glsl_from_word = 'int({})'
+    glsl_to_word = 'uint({})'
+
+    def _flatten_element(self, py_data, values):
+        assert isinstance(py_data, int)
+        values.append(py_data)
+
+    def _build_element(self, values, read_at):
+        return values[read_at], read_at + 1
 
-    def unpack_element(self, byte_data, read_at):
-        start = read_at * 4
-        end = (read_at + self.element_size) * 4
-        element_byte_data = byte_data[start:end]
-        a = array('I')
-        a.frombytes(element_byte_data)
-        py_data = a.tolist()[0]
-        return py_data
 
+class GlDouble(GlType):
+    glsl_type_name = 'double'
+    alignment = 2
+    element_size = 2
+    element_format = 'd'
+    numpy_format = '<f8'
+    numpy_shape = ()
+
+    def _flatten_element(self, py_data, values):
+        assert isinstance(py_data, (int, float))
+        values.append(py_data)
+
+    def _build_element(self, values, read_at):
+        return values[read_at], read_at + 1
+
+    @classmethod
+    def _glsl_read_element(cls, word):
+        return f"packDouble2x32(uvec2({word(0)}, {word(1)}))"
+
+    @classmethod
+    def _glsl_write_element(cls, word, value):
+        return [
+            f"{word(0)} = unpackDouble2x32({value}).x;",
+            f"{word(1)} = unpackDouble2x32({value}).y;",
+        ]
+
+
+class GlVectorType(GlType):
+    """
+    Base class for vectors. Vectors of two components align to twice
+    their component's size, those of three and four to four times it.
+    Elements are sequences of `num_components` components, e.g. tuples
+    or Panda3D's `LVecBase*`.
+    """
+    def _flatten_element(self, py_data, values):
+        assert len(py_data) == self.num_components
+        values.extend(py_data)
+
+    def _build_element(self, values, read_at):
+        end = read_at + self.num_components
+        return tuple(values[read_at:end]), end
+
+    def _glsl_read_element(self, word):
+        component = self.component_type
+        size = component.element_size
+        components = [
+            component._glsl_read_element(lambda k, c=c: word(c * size + k))
+            for c in range(self.num_components)
+        ]
+        return f"{self.glsl_type_name}({', '.join(components)})"
+
+    def _glsl_write_element(self, word, value):
+        component = self.component_type
+        size = component.element_size
+        statements = []
+        for c in range(self.num_components):
+            statements.extend(
+                component._glsl_write_element(
+                    lambda k, c=c: word(c * size + k),
+                    f"{value}[{c}]",
+                )
+            )
+        return statements
 
-class GlVec2(GlType):
+
+class GlVec2(GlVectorType):
     glsl_type_name = 'vec2'
+    num_components = 2
+    component_type = GlFloat
+    alignment = 2
+    element_size = 2
+    element_format = '2f'
+    numpy_format = '<f4'
+    numpy_shape = (2,)
+
+
+class GlVec3(GlVectorType):
+    glsl_type_name = 'vec3'
+    num_components = 3
+    component_type = GlFloat
     alignment = 4
+    element_size = 3
+    element_format = '3f'
+    numpy_format = '<f4'
+    numpy_shape = (3,)
+
+
+class GlVec4(GlVectorType):
+    glsl_type_name = 'vec4'
+    num_components = 4
+    component_type = GlFloat
+    alignment = 4
+    element_size = 4
+    element_format = '4f'
+    numpy_format = '<f4'
+    numpy_shape = (4,)
+
+
+class GlIVec2(GlVectorType):
+    glsl_type_name = 'ivec2'
+    num_components = 2
+    component_type = GlInt
+    alignment = 2
     element_size = 2
+    element_format = '2i'
+    numpy_format = '<i4'
+    numpy_shape = (2,)
 
-    def pack_element(self, py_data):
-        if isinstance(py_data, LVecBase2f):
-            x, y = py_data.x, py_data.y
-        else:
-            assert len(py_data) == 2
-            assert all(isinstance(e, (int, float)) for e in py_data)
-            x, y = py_data
-        byte_data = array('f', [x,y]).tobytes()
-        return byte_data
 
-    def unpack_element(self, byte_data, read_at):
-        start = read_at * 4
-        end = (read_at + 2) * 4
-        element_byte_data = byte_data[start:end]
-        a = array('f')
-        a.frombytes(element_byte_data)
-        py_data = tuple(a.tolist())
-        return py_data
+class GlIVec3(GlVectorType):
+    glsl_type_name = 'ivec3'
+    num_components = 3
+    component_type = GlInt
+    alignment = 4
+    element_size = 3
+    element_format = '3i'
+    numpy_format = '<i4'
+    numpy_shape = (3,)
 
 
-class GlVec3(GlType):
-    glsl_type_name = 'vec3'
+class GlIVec4(GlVectorType):
+    glsl_type_name = 'ivec4'
+    num_components = 4
+    component_type = GlInt
+    alignment = 4
+    element_size = 4
+    element_format = '4i'
+    numpy_format = '<i4'
+    numpy_shape = (4,)
+
+
+class GlUVec2(GlVectorType):
+    glsl_type_name = 'uvec2'
+    num_components = 2
+    component_type = GlUInt
+    alignment = 2
+    element_size = 2
+    element_format = '2I'
+    numpy_format = '<u4'
+    numpy_shape = (2,)
+
+
+class GlUVec3(GlVectorType):
+    glsl_type_name = 'uvec3'
+    num_components = 3
+    component_type = GlUInt
     alignment = 4
     element_size = 3
+    element_format = '3I'
+    numpy_format = '<u4'
+    numpy_shape = (3,)
 
-    def pack_element(self, py_data):
-        if isinstance(py_data, LVecBase3f):
-            x,y,z = py_data.x, py_data.y, py_data.z
-        else:
-            assert len(py_data) == 3
-            assert all(isinstance(e, (int, float)) for e in py_data)
-            x,y,z = py_data
-        byte_data = array('f', [x,y,z]).tobytes()
-        return byte_data
 
-    def unpack_element(self, byte_data, read_at):
-        start = read_at * 4
-        end = (read_at + 3) * 4
-        element_byte_data = byte_data[start:end]
-        a = array('f')
-        a.frombytes(element_byte_data)
-        py_data = tuple(a.tolist())
-        return py_data
+class GlUVec4(GlVectorType):
+    glsl_type_name = 'uvec4'
+    num_components = 4
+    component_type = GlUInt
+    alignment = 4
+    element_size = 4
+    element_format = '4I'
+    numpy_format = '<u4'
+    numpy_shape = (4,)
+
+
+class GlDVec2(GlVectorType):
+    glsl_type_name = 'dvec2'
+    num_components = 2
+    component_type = GlDouble
+    alignment = 4
+    element_size = 4
+    element_format = '2d'
+    numpy_format = '<f8'
+    numpy_shape = (2,)
+
+
+class GlDVec3(GlVectorType):
+    glsl_type_name = 'dvec3'
+    num_components = 3
+    component_type = GlDouble
+    alignment = 8
+    element_size = 6
+    element_format = '3d'
+    numpy_format = '<f8'
+    numpy_shape = (3,)
+
+
+class GlDVec4(GlVectorType):
+    glsl_type_name = 'dvec4'
+    num_components = 4
+    component_type = GlDouble
+    alignment = 8
+    element_size = 8
+    element_format = '4d'
+    numpy_format = '<f8'
+    numpy_shape = (4,)
+
+
+class GlMatrixType(GlType):
+    """
+    Base class for square float matrices. They are stored column-major,
+    like an array of column vectors, so a `mat3`'s columns are padded
+    to four floats. Elements are sequences of columns, or Panda3D
+    matrices, whose rows are what GLSL sees as columns. NumPy views have
+    the shape (columns, rows), with the padding of `mat3` stripped.
+    """
+    alignment = 4
+
+    def _flatten_element(self, py_data, values):
+        num_columns = self.num_columns
+        if hasattr(py_data, 'get_row'):
+            py_data = [py_data.get_row(idx) for idx in range(num_columns)]
+        assert len(py_data) == num_columns
+        for column in py_data:
+            assert len(column) == num_columns
+            values.extend(column)
+
+    def _build_element(self, values, read_at):
+        num_columns = self.num_columns
+        end = read_at + num_columns * num_columns
+        py_data = tuple(
+            tuple(values[idx:idx + num_columns])
+            for idx in range(read_at, end, num_columns)
+        )
+        return py_data, end
+
+    def _numpy_unpad(self, view):
+        return view[..., :self.num_columns]
+
+    def _glsl_read_element(self, word):
+        column_stride = self.element_size // self.num_columns
+        components = [
+            f"uintBitsToFloat({word(column * column_stride + row)})"
+            for column in range(self.num_columns)
+            for row in range(self.num_columns)
+        ]
+        return f"{self.glsl_type_name}({', '.join(components)})"
+
+    def _glsl_write_element(self, word, value):
+        column_stride = self.element_size // self.num_columns
+        return [
+            f"{word(column * column_stride + row)} = floatBitsToUint({value}[{column}][{row}]);"
+            for column in range(self.num_columns)
+            for row in range(self.num_columns)
+        ]
+
+
+class GlMat2(GlMatrixType):
+    glsl_type_name = 'mat2'
+    num_columns = 2
+    alignment = 2
+    element_size = 4
+    element_format = '4f'
+    numpy_format = '<f4'
+    numpy_shape = (2, 2)
+
+
+class GlMat3(GlMatrixType):
+    glsl_type_name = 'mat3'
+    num_columns = 3
+    element_size = 12
+    element_format = '3f4x3f4x3f4x'
+    numpy_format = '<f4'
+    numpy_shape = (3, 4)
+
+
+class GlMat4(GlMatrixType):
+    glsl_type_name = 'mat4'
+    num_columns = 4
+    element_size = 16
+    element_format = '16f'
+    numpy_format = '<f4'
+    numpy_shape = (4, 4)
+
+
+class GlPackedType(GlType):
+    """
+    Base class for types that store a small float vector in a single
+    `uint`, like GLSL's `packUnorm4x8()` and friends do. In GLSL, the
+    field is declared as a `uint` and converted with the functions named
+    by `glsl_unpack_function` and `glsl_pack_function`; Where those are
+    not GLSL built-ins, `glsl_helpers` defines them, and `full_glsl`
+    adds them to the buffer's GLSL.
+
+    In Python, elements are tuples of floats. NumPy views on buffers
+    show the stored integer (or half float) components instead;
+    `numpy_encode` and `numpy_decode` convert columns of floats to and
+    from those, and `Buffer.pack_columns` and `Buffer.write` encode
+    automatically.
+    """
+    glsl_type_name = 'uint'
+    alignment = 1
+    element_size = 1
+    # Largest stored integer, which 1.0 is mapped to.
+    scale = None
+    signed = False
+
+    def _flatten_element(self, py_data, values):
+        assert len(py_data) == self.num_components
+        scale = self.scale
+        low = -1.0 if self.signed else 0.0
+        values.extend(round(min(max(c, low), 1.0) * scale) for c in py_data)
+
+    def _build_element(self, values, read_at):
+        end = read_at + self.num_components
+        scale = self.scale
+        py_data = tuple(max(c / scale, -1.0) for c in values[read_at:end])
+        return py_data, end
+
+    def numpy_encode(self, values):
+        "Convert an array of float vectors to their stored components."
+        low = -1.0 if self.signed else 0.0
+        values = np.clip(np.asarray(values, dtype=np.float64), low, 1.0)
+        return np.round(values * self.scale).astype(self.numpy_format)
+
+    def numpy_decode(self, stored):
+        "Convert an array of stored components to float vectors."
+        values = np.asarray(stored).astype(np.float32) / self.scale
+        return np.maximum(values, -1.0)
+
+    def _numpy_encode(self, values):
+        return self.numpy_encode(values)
+
+
+class GlHalf2x16(GlPackedType):
+    glsl_value_type = 'vec2'
+    glsl_pack_function = 'packHalf2x16'
+    glsl_unpack_function = 'unpackHalf2x16'
+    num_components = 2
+    element_format = '2e'
+    numpy_format = '<f2'
+    numpy_shape = (2,)
+
+    def _flatten_element(self, py_data, values):
+        assert len(py_data) == 2
+        values.extend(py_data)
+
+    def _build_element(self, values, read_at):
+        return tuple(values[read_at:read_at + 2]), read_at + 2
+
+    def numpy_encode(self, values):
+        return np.asarray(values).astype(self.numpy_format)
+
+    def numpy_decode(self, stored):
+        return np.asarray(stored).astype(np.float32)
+
+
+class GlUnorm4x8(GlPackedType):
+    glsl_value_type = 'vec4'
+    glsl_pack_function = 'packUnorm4x8'
+    glsl_unpack_function = 'unpackUnorm4x8'
+    num_components = 4
+    scale = 255
+    element_format = '4B'
+    numpy_format = '<u1'
+    numpy_shape = (4,)
+
+
+class GlSnorm4x8(GlPackedType):
+    glsl_value_type = 'vec4'
+    glsl_pack_function = 'packSnorm4x8'
+    glsl_unpack_function = 'unpackSnorm4x8'
+    num_components = 4
+    scale = 127
+    signed = True
+    element_format = '4b'
+    numpy_format = '<i1'
+    numpy_shape = (4,)
+
+
+class GlUnorm2x16(GlPackedType):
+    glsl_value_type = 'vec2'
+    glsl_pack_function = 'packUnorm2x16'
+    glsl_unpack_function = 'unpackUnorm2x16'
+    num_components = 2
+    scale = 65535
+    element_format = '2H'
+    numpy_format = '<u2'
+    numpy_shape = (2,)
+
+
+class GlSnorm2x16(GlPackedType):
+    glsl_value_type = 'vec2'
+    glsl_pack_function = 'packSnorm2x16'
+    glsl_unpack_function = 'unpackSnorm2x16'
+    num_components = 2
+    scale = 32767
+    signed = True
+    element_format = '2h'
+    numpy_format = '<i2'
+    numpy_shape = (2,)
+
+
+snorm_10_10_10_2_glsl = """
+#ifndef P3D_SSBO_SNORM_10_10_10_2
+#define P3D_SSBO_SNORM_10_10_10_2
+uint packSnorm10_10_10_2(vec4 v) {
+  ivec4 i = ivec4(round(clamp(v, -1.0, 1.0) * vec4(511.0, 511.0, 511.0, 1.0)));
+  uvec4 u = uvec4(i) & uvec4(0x3ffu, 0x3ffu, 0x3ffu, 0x3u);
+  return u.x | (u.y << 10) | (u.z << 20) | (u.w << 30);
+}
+
+vec4 unpackSnorm10_10_10_2(uint p) {
+  ivec4 i = ivec4(int(p << 22), int(p << 12), int(p << 2), int(p)) >> ivec4(22, 22, 22, 30);
+  return max(vec4(i) / vec4(511.0, 511.0, 511.0, 1.0), -1.0);
+}
+#endif
+"""[1:-1]
+
+
+class GlSnorm10_10_10_2(GlPackedType):
+    """
+    A signed normalized vec4 with 10 bits for each of x, y and z, and 2
+    for w, e.g. for normals, or tangents with their handedness in w.
+    Bits are assigned from the least significant one upwards, as in
+    `GL_INT_2_10_10_10_REV`.
+    """
+    glsl_value_type = 'vec4'
+    glsl_pack_function = 'packSnorm10_10_10_2'
+    glsl_unpack_function = 'unpackSnorm10_10_10_2'
+    glsl_helpers = snorm_10_10_10_2_glsl
+    num_components = 4
+    signed = True
+    element_format = 'I'
+    numpy_format = '<u4'
+    numpy_shape = ()
+    _bits = (10, 10, 10, 2)
+    _shifts = (0, 10, 20, 30)
+    _scales = (511, 511, 511, 1)
+
+    def _flatten_element(self, py_data, values):
+        assert len(py_data) == 4
+        word = 0
+        for c, bits, shift, scale in zip(py_data, self._bits, self._shifts, self._scales):
+            i = round(min(max(c, -1.0), 1.0) * scale)
+            word |= (i & ((1 << bits) - 1)) << shift
+        values.append(word)
+
+    def _build_element(self, values, read_at):
+        word = values[read_at]
+        py_data = []
+        for bits, shift, scale in zip(self._bits, self._shifts, self._scales):
+            i = (word >> shift) & ((1 << bits) - 1)
+            if i >= 1 << (bits - 1):
+                i -= 1 << bits
+            py_data.append(max(i / scale, -1.0))
+        return tuple(py_data), read_at + 1
+
+    def numpy_encode(self, values):
+        values = np.clip(np.asarray(values, dtype=np.float64), -1.0, 1.0)
+        ints = np.round(values * np.array(self._scales)).astype(np.int64)
+        masks = (1 << np.array(self._bits)) - 1
+        words = (ints & masks) << np.array(self._shifts)
+        return np.bitwise_or.reduce(words, axis=-1).astype(np.uint32)
+
+    def numpy_decode(self, stored):
+        words = np.asarray(stored, dtype=np.uint32)[..., None].astype(np.int64)
+        bits = np.array(self._bits)
+        ints = (words >> np.array(self._shifts)) & ((1 << bits) - 1)
+        ints = np.where(ints >= 1 << (bits - 1), ints - (1 << bits), ints)
+        return np.maximum(ints / np.array(self._scales, dtype=np.float32), -1.0).astype(np.float32)
 
 
 class Struct:
-    def __init__(self, type_name, *fields):
+    """
+    A GLSL struct type. With `optimize_layout=True`, the fields are
+    stored in the order that needs the least padding, e.g. with scalars
+    moved into the words after `vec3`s, and `bytes_saved` tells how
+    much smaller an element got. `fields` and the GLSL definition are in
+    that storage order; Python data keeps using the declaration order,
+    `declared_fields`, and fields are accessed by name as usual.
+    """
+    def __init__(self, type_name, *fields, optimize_layout=False):
+        self.declared_fields = fields
+        if optimize_layout:
+            fields = _optimized_field_order(fields)
         self.fields = fields
         self.field_by_name = {f.field_name: f for f in fields}
         self.glsl_type_name = type_name
         self.alignment = max(f.alignment for f in fields)
+        # Where each field's Python data is in the declared order, and
+        # vice versa; `None` if the orders are the same.
+        self._storage_order = None
+        self._declared_order = None
+        if fields != self.declared_fields:
+            self._storage_order = tuple(
+                self.declared_fields.index(f) for f in fields
+            )
+            self._declared_order = tuple(
+                fields.index(f) for f in self.declared_fields
+            )
+        self.bytes_saved = (
+            _struct_stride(self.declared_fields) - self._array_stride
+        ) * 4
 
     def __call__(self, field_name, *dims, unbounded=False):
         instance = StructInstance(self, field_name, dims, unbounded=unbounded)
@@ -323,6 +1189,85 @@ class Struct:
             types.append(self)
         return types
 
+    @cached_property
+    def _field_offsets(self):
+        return _field_offsets(self.fields)
+
+    @cached_property
+    def _field_offset_by_name(self):
+        return {
+            field.field_name: offset
+            for field, offset in zip(self.fields, self._field_offsets)
+        }
+
+    @cached_property
+    def element_format(self):
+        "`struct` format of one element, with all fields inlined."
+        element_format = ''
+        write_at = 0
+        for field, offset in zip(self.fields, self._field_offsets):
+            element_format += _pad_format(offset - write_at)
+            element_format += field._array_format()
+            write_at = offset + field._extent()
+        return element_format
+
+    @cached_property
+    def _element_struct(self):
+        return struct.Struct('<' + self.element_format)
+
+    def get_offset(self, path):
+        """
+        Return the byte offset of the field at `path`, e.g.
+        `'boids.nextDir'` or `'boids[3].nextDir'`.
+        """
+        return self._resolve_path(path)[1] * 4
+
+    def get_stride(self, path):
+        """
+        Return the distance in bytes between consecutive elements of the
+        innermost array on `path`, e.g. between `boids[i].nextDir` and
+        `boids[i+1].nextDir` for `'boids.nextDir'`.
+        """
+        stride = self._resolve_path(path)[2]
+        if stride is None:
+            raise ValueError(f"{path!r} is not in an array.")
+        return stride * 4
+
+    def layout_table(self):
+        "Return a `FieldLayout` for every field, nested ones included."
+        return self._layout_table
+
+    @cached_property
+    def _layout_table(self):
+        return _layout_rows(self)
+
+    def _resolve_path(self, path):
+        if path not in self._resolved_paths:
+            self._resolved_paths[path] = _resolve_path(self, None, path)
+        return self._resolved_paths[path]
+
+    @cached_property
+    def _resolved_paths(self):
+        "Results of `_resolve_path`, by path."
+        return {}
+
+    @cached_property
+    def _array_stride(self):
+        "Distance between two elements in an array of this struct, in words."
+        return _struct_stride(self.fields)
+
+    def numpy_dtype(self):
+        "Return the NumPy structured dtype of one element of this struct."
+        return self._numpy_dtype
+
+    @cached_property
+    def _numpy_dtype(self):
+        return _numpy_struct_dtype(
+            self.fields,
+            self._field_offsets,
+            self._array_stride * 4,
+        )
+
 
 class StructInstance(GlType):
     def __init__(self, type_obj, field_name, dims, unbounded=False):
@@ -340,23 +1285,73 @@ class StructInstance(GlType):
 
     def glsl(self):
         if self.unbounded:
-            dim_string = ''.join(f'[{d}]' for d in self.dims[:-1]) + '[]'
+            dim_string = '[]' + ''.join(f'[{d}]' for d in self.dims[1:])
         else:
             dim_string = ''.join(f'[{d}]' for d in self.dims)
         text = f"{self.type_obj.glsl_type_name} {self.field_name}{dim_string};"
         return text
 
-    def _add_element(self, byte_data, py_data):
+    @property
+    def element_format(self):
+        return self.type_obj.element_format
+
+    @property
+    def _element_struct(self):
+        return self.type_obj._element_struct
+
+    def numpy_dtype(self):
+        """
+        Return the NumPy structured dtype of one element of this struct,
+        with explicit std430 offsets and an item size of the array
+        stride.
+        """
+        return self.type_obj.numpy_dtype()
+
+    def _numpy_element_dtype(self):
+        return self.type_obj.numpy_dtype()
+
+    def _numpy_unpad(self, view):
+        return view
+
+    def _view_element(self, byte_data, read_at):
+        return StructView(self.type_obj, byte_data, read_at)
+
+    def _flatten_element(self, py_data, values):
+        storage_order = self.type_obj._storage_order
+        if storage_order is not None:
+            py_data = [py_data[idx] for idx in storage_order]
         for field, data in zip(self.type_obj.fields, py_data):
-            byte_data, trailing = field._pack(data, byte_data)
-        return byte_data, self.alignment
+            field._flatten(data, values, field.dims)
 
-    def _read_element(self, byte_data, read_at):
+    def _build_element(self, values, read_at):
         struct_py_data = []
-        for field in self.type_obj.fields:          
-            py_data, read_at, trailing = field._unpack(byte_data, read_at)
+        for field in self.type_obj.fields:
+            py_data, read_at = field._build(values, read_at, field.dims)
             struct_py_data.append(py_data)
-        return tuple(struct_py_data), self.alignment
+        declared_order = self.type_obj._declared_order
+        if declared_order is not None:
+            struct_py_data = [struct_py_data[idx] for idx in declared_order]
+        return tuple(struct_py_data), read_at
+
+    def _glsl_read_element(self, word):
+        members = [
+            _glsl_read_words(field, lambda k, offset=offset: word(offset + k), field.dims)
+            for field, offset in zip(self.type_obj.fields, self.type_obj._field_offsets)
+        ]
+        return f"{self.glsl_type_name}({', '.join(members)})"
+
+    def _glsl_write_element(self, word, value):
+        statements = []
+        for field, offset in zip(self.type_obj.fields, self.type_obj._field_offsets):
+            statements.extend(
+                _glsl_write_words(
+                    field,
+                    lambda k, offset=offset: word(offset + k),
+                    f"{value}.{field.field_name}",
+                    field.dims,
+                )
+            )
+        return statements
 
     def _get_struct_types(self, types=None):
         if types is None:
@@ -372,35 +1367,453 @@ class StructInstance(GlType):
         field = self.type_obj.field_by_name[field_name]
         return field
 
+    def get_offset(self, path):
+        """
+        Return the byte offset of the field at `path`, relative to the
+        start of this array, e.g. `'pos'` (in the first element) or
+        `'[3].pos'`.
+        """
+        return self._resolve_path(path)[1] * 4
+
+    def get_stride(self, path=''):
+        """
+        Return the distance in bytes between consecutive elements of the
+        innermost array on `path`; By default, this array's stride.
+        """
+        stride = self._resolve_path(path)[2]
+        if stride is None:
+            raise ValueError(f"{path!r} is not in an array.")
+        return stride * 4
+
+    def layout_table(self):
+        """
+        Return a `FieldLayout` for every field of the struct, relative to
+        the start of an element.
+        """
+        return self.type_obj.layout_table()
+
+    def _resolve_path(self, path):
+        if path not in self._resolved_paths:
+            self._resolved_paths[path] = _resolve_path(None, self, path)
+        return self._resolved_paths[path]
+
+    @cached_property
+    def _resolved_paths(self):
+        "Results of `_resolve_path`, by path."
+        return {}
+
+
+def _copy_field(field):
+    "A copy of `field`, without anything cached about its dims."
+    field = copy.copy(field)
+    field.__dict__.pop('_resolved_paths', None)
+    return field
+
+
+def _soa_fields(fields):
+    """
+    Split the top-level 1D arrays of structs among `fields` into one
+    array per struct field, named `<array>_<field>`, for the
+    struct-of-arrays layout. 3-component vectors are stored as a scalar
+    array three times as long, so that they are not padded. Returns the
+    storage fields, and for each split array its struct fields in
+    declaration order, as `(field, storage field, is 3-vector)`.
+    """
+    storage_fields = []
+    soa_arrays = {}
+    for field in fields:
+        if not isinstance(field, StructInstance) or len(field.dims) != 1:
+            storage_fields.append(field)
+            continue
+        assert not field.unbounded, \
+            "Unbounded arrays can't be split into struct-of-arrays."
+        num_elements = field.dims[0]
+        split_fields = {}
+        for sub_field in field.type_obj.fields:
+            name = f'{field.field_name}_{sub_field.field_name}'
+            tight = sub_field.dims == () and getattr(sub_field, 'num_components', None) == 3
+            if tight:
+                storage_field = sub_field.component_type(name, num_elements * 3)
+            elif isinstance(sub_field, StructInstance):
+                storage_field = sub_field.type_obj(name, num_elements, *sub_field.dims)
+            else:
+                storage_field = type(sub_field)(name, num_elements, *sub_field.dims)
+            storage_fields.append(storage_field)
+            split_fields[sub_field.field_name] = (sub_field, storage_field, tight)
+        soa_arrays[field.field_name] = [
+            split_fields[sub_field.field_name]
+            for sub_field in field.type_obj.declared_fields
+        ]
+    return tuple(storage_fields), soa_arrays
+
+
+def _glsl_read_words(field, word, dims):
+    """
+    GLSL expression for a value of `field`'s type with array dimensions
+    `dims`, stored in `uint` words, where `word(k)` is the expression of
+    its k-th word. Used to address data at run-time offsets in an
+    `Arena`.
+    """
+    if dims == ():
+        return field._glsl_read_element(word)
+    stride = field._stride() * math.prod(dims[1:])
+    elements = [
+        _glsl_read_words(field, lambda k, idx=idx: word(idx * stride + k), dims[1:])
+        for idx in range(dims[0])
+    ]
+    array_type = field.glsl_type_name + ''.join(f'[{d}]' for d in dims)
+    return f"{array_type}({', '.join(elements)})"
+
+
+def _glsl_write_words(field, word, value, dims):
+    "GLSL statements storing `value` into words, see `_glsl_read_words`."
+    if dims == ():
+        return field._glsl_write_element(word, value)
+    stride = field._stride() * math.prod(dims[1:])
+    statements = []
+    for idx in range(dims[0]):
+        statements.extend(
+            _glsl_write_words(
+                field,
+                lambda k, idx=idx: word(idx * stride + k),
+                f"{value}[{idx}]",
+                dims[1:],
+            )
+        )
+    return statements
+
+
+def _glsl_atomic_accessors(name, field, dims, variable):
+    """
+    GLSL function adding to a scalar `uint` or `int` buffer variable
+    atomically, returning its previous value; Nothing for other types,
+    or values with array dimensions `dims`.
+    """
+    if type(field) not in (GlUInt, GlInt) or dims != ():
+        return []
+    value_type = field.glsl_type_name
+    return [
+        f"{value_type} {name}(uint idx, {value_type} value) {{ return atomicAdd({variable}, value); }}",
+    ]
+
+
+def _glsl_value_accessors(get_name, set_name, field, dims, read, write, params='uint idx'):
+    """
+    GLSL getter and setter for one value of `field`'s type with array
+    dimensions `dims`, given the expression that reads it, and a function
+    that returns the statement writing a given value. `params` are the
+    parameters that address the value.
+    """
+    if isinstance(field, GlPackedType) and dims == ():
+        value_type = field.glsl_value_type
+        read = f"{field.glsl_unpack_function}({read})"
+        write_statement = write(f"{field.glsl_pack_function}(newValue)")
+    else:
+        value_type = field.glsl_type_name + ''.join(f'[{d}]' for d in dims)
+        write_statement = write('newValue')
+    return [
+        f"{value_type} {get_name}({params}) {{ return {read}; }}",
+        f"void {set_name}({params}, {value_type} newValue) {{ {write_statement} }}",
+    ]
+
+
+class _ShaderBufferOwner:
+    """
+    Bookkeeping for classes that own a `ShaderBuffer` which may be
+    replaced by a larger or compacted one: The nodes to update the shader
+    inputs on, callbacks to call, and the copies of the old contents that
+    are yet to be done on the GPU by
+    `p3d_ssbo.algos.resize_copy.ResizeCopy`. Subclasses provide
+    `shader_inputs`, and tell with `_replaceable` whether their
+    `ShaderBuffer` can be replaced at all.
+    """
+    _replaceable = True
+
+    def _init_bindings(self):
+        self._bound_nodes = []
+        self._resize_callbacks = []
+        self._pending_copies = []
 
-class Buffer(GlType):
+    def pop_pending_copies(self):
+        """
+        Return the copies of the contents of replaced `ShaderBuffer`s into
+        the ones that replaced them, as (source, target, segments) tuples
+        with lists of (source word, target word, number of words)
+        segments. If the buffer was replaced more than once since the
+        last call, the copies are chained, and have to be done in order.
+        """
+        pending_copies = self._pending_copies
+        self._pending_copies = []
+        return pending_copies
+
+    def bind(self, np):
+        """
+        Set the buffer's shader inputs on `np`, and, if the buffer can be
+        resized, set them anew whenever it is.
+        """
+        np.set_shader_inputs(**self.shader_inputs())
+        if self._replaceable and np not in self._bound_nodes:
+            self._bound_nodes.append(np)
+
+    def unbind(self, np):
+        "Stop updating the shader inputs of `np`."
+        if np in self._bound_nodes:
+            self._bound_nodes.remove(np)
+
+    def add_resize_callback(self, callback):
+        """
+        Call `callback(buffer)` whenever the buffer is resized, e.g. to
+        dispatch compute shaders over the new number of elements.
+        """
+        self._resize_callbacks.append(callback)
+
+    def remove_resize_callback(self, callback):
+        self._resize_callbacks.remove(callback)
+
+    def _notify_resize(self):
+        inputs = self.shader_inputs()
+        for np in self._bound_nodes:
+            np.set_shader_inputs(**inputs)
+        for callback in self._resize_callbacks:
+            callback(self)
+
+
+class Buffer(GlType, _ShaderBufferOwner):
     dims = ()
 
-    def __init__(self, type_name: str, *fields: GlType, initial_data=None, bind_buffer=None, num_elements=0):
+    def __init__(self, type_name: str, *fields: GlType, initial_data=None, bind_buffer=None, num_elements=None, layout='aos', growth_factor=2, allocate=True, chunk_size=4096):
+        self._pending_writes = []
+        assert layout in ('aos', 'soa'), f"Unknown buffer layout {layout!r}."
+        # The capacity of an unbounded array changes when the buffer is
+        # resized, so the buffer gets a copy of the field of its own.
+        fields = tuple(_copy_field(f) if f.unbounded else f for f in fields)
+        self.layout = layout
+        self.declared_fields = fields
+        self._soa_arrays = {}
+        if layout == 'soa':
+            fields, self._soa_arrays = _soa_fields(fields)
         self.fields = fields
-        self.field_by_name = {f.field_name: f for f in fields}
+        self.field_by_name = {f.field_name: f for f in self.declared_fields}
+        for field in fields:
+            assert self.field_by_name.get(field.field_name, field) is field, \
+                f"Struct-of-arrays field {field.field_name} shadows a buffer field."
+            self.field_by_name[field.field_name] = field
         self.glsl_type_name = type_name
         self.alignment = max(f.alignment for f in fields)
-        size = 0
-        trailing = 0
-        for field in self.fields:
-            size, trailing = field._size(size, trailing)
-        self.element_size = size
+        self._calculate_element_size()
+        # An unbounded array at the end of the buffer can be resized; Its
+        # current dims are its capacity, and `num_elements` of them are
+        # live.
+        self.resizable_array = None
+        for field in self.declared_fields:
+            if field.unbounded:
+                assert field is self.declared_fields[-1], \
+                    f"Only the last field can be unbounded, not {field.field_name}."
+                assert len(field.dims) == 1, "Only 1D arrays can be unbounded."
+                self.resizable_array = field
+                if num_elements is None:
+                    num_elements = field.dims[0]
+                assert num_elements <= field.dims[0], \
+                    f"{num_elements} elements do not fit into the capacity of {field.dims[0]}."
+        self.num_elements = num_elements
+        self.growth_factor = growth_factor
+        # Top-level arrays given as iterators are packed this many
+        # elements at a time.
+        self.chunk_size = chunk_size
+        self._init_bindings()
         if bind_buffer is not None:
             assert type(bind_buffer) is ShaderBuffer, f'Only ShaderBuffers can be bound to p3d_ssbo.gltypes.Buffer!'
             size = bind_buffer.data_size_bytes
-            assert size % self.element_size == 0, f'buffer bound to p3d_ssbo.gltypes.Buffer is not a multiple of {self.element_size} long!'
+            # Buffers that this module allocates may be padded.
+            if size != _padded_size(self.size()):
+                assert size % self.element_size == 0, f'buffer bound to p3d_ssbo.gltypes.Buffer is not a multiple of {self.element_size} long!'
             self.ssbo = bind_buffer
+        elif not allocate:
+            # Only the layout is wanted for now; `ssbo` is set later.
+            self.ssbo = None
         else:
             if initial_data is None:
-                size_or_data = self.size()
+                self.ssbo = _make_shader_buffer(self.glsl_type_name, self.size())
             else:
-                size_or_data = self.pack(initial_data)
-            self.ssbo = ShaderBuffer(
-                self.glsl_type_name,
-                size_or_data,
-                GeomEnums.UH_static
+                byte_data = self._initial_byte_data(initial_data)
+                self.ssbo = _make_shader_buffer(self.glsl_type_name, byte_data)
+
+    def _initial_byte_data(self, initial_data):
+        """
+        Turn initial data into byte data: Dicts of columns are packed
+        with `pack_columns`, bytes-like objects are used as they are, and
+        anything else is packed as Python data.
+        """
+        if isinstance(initial_data, dict):
+            return self.pack_columns(initial_data)
+        if isinstance(initial_data, (bytes, bytearray, memoryview, mmap.mmap)):
+            assert memoryview(initial_data).nbytes == self.size(), \
+                f"Initial data is not {self.size()} bytes long."
+            return initial_data
+        byte_data = bytearray(self.size())
+        self._pack_into(byte_data, initial_data, 0)
+        return byte_data
+
+    def _calculate_element_size(self):
+        size = 0
+        trailing = 0
+        for field in self.fields:
+            size, trailing = field._size(size, trailing)
+        self.element_size = size
+
+    @property
+    def _replaceable(self):
+        return self.resizable_array is not None
+
+    @property
+    def capacity(self):
+        "The number of elements allocated for the resizable array."
+        return self.resizable_array.dims[0]
+
+    def get_length(self, array_name):
+        """
+        Return the number of elements of the top-level array
+        `array_name` that are in use, which for the resizable array is
+        `num_elements`, and for others their size.
+        """
+        field = self.field_by_name[array_name]
+        if field is self.resizable_array:
+            return self.num_elements
+        return field.dims[0]
+
+    def resize(self, num_elements):
+        """
+        Set the number of elements in the resizable array. If they do not
+        fit into its capacity, it grows by `growth_factor` (or to
+        `num_elements`, if that is more), and a new `ShaderBuffer` is
+        allocated. The old contents are copied into it on the GPU by
+        `p3d_ssbo.algos.resize_copy.ResizeCopy`. Returns whether the
+        buffer was reallocated.
+        """
+        assert self.resizable_array is not None, "The buffer has no unbounded array."
+        reallocated = False
+        if num_elements > self.capacity:
+            capacity = max(num_elements, math.ceil(self.capacity * self.growth_factor))
+            self._reallocate(capacity)
+            reallocated = True
+        self.num_elements = num_elements
+        self._notify_resize()
+        return reallocated
+
+    def reserve(self, capacity):
+        "Grow the resizable array to at least `capacity` elements."
+        assert self.resizable_array is not None, "The buffer has no unbounded array."
+        if capacity > self.capacity:
+            self._reallocate(capacity)
+            self._notify_resize()
+
+    def shrink_to_fit(self):
+        "Shrink the resizable array's capacity to its live elements."
+        assert self.resizable_array is not None, "The buffer has no unbounded array."
+        capacity = max(self.num_elements, 1)
+        if capacity < self.capacity:
+            self._reallocate(capacity)
+            self._notify_resize()
+
+    def _reallocate(self, capacity):
+        old_ssbo = self.ssbo
+        old_size = self.size()
+        array = self.resizable_array
+        array.dims = (capacity, ) + array.dims[1:]
+        array.__dict__.pop('_resolved_paths', None)
+        self._calculate_element_size()
+        self.__dict__.pop('_layout_table', None)
+        self.__dict__.pop('_resolved_paths', None)
+        self.ssbo = _make_shader_buffer(self.glsl_type_name, self.size())
+        num_words = min(old_size, self.size()) // 4
+        self._pending_copies.append((old_ssbo, self.ssbo, [(0, 0, num_words)]))
+
+    def shader_inputs(self):
+        """
+        Return the shader inputs needed by shaders that use `full_glsl()`:
+        The `ShaderBuffer` itself, and the number of live elements of the
+        resizable array.
+        """
+        inputs = {self.glsl_type_name: self.ssbo}
+        if self.resizable_array is not None:
+            inputs[self.resizable_array.field_name + '_count'] = self.num_elements
+        return inputs
+
+    @classmethod
+    def from_file(cls, path, type_name, *fields, **kwargs):
+        """
+        Create a buffer like the constructor does, with the initial data
+        read from a file written by `save`. The file is memory-mapped,
+        and its contents are given to the `ShaderBuffer` as they are.
+        The resizable array gets the capacity and number of elements that
+        it had when it was saved. Raises `ValueError` if the file was
+        saved from a buffer with a different layout.
+        """
+        header_size = _file_header.size
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if len(mapped) < header_size:
+                    raise ValueError(f"{path} is not an SSBO file.")
+                magic, version, layout_hash, size, capacity, num_elements = \
+                    _file_header.unpack_from(mapped)
+                if magic != _file_magic or version != _file_version:
+                    raise ValueError(f"{path} is not an SSBO file.")
+                if fields and fields[-1].unbounded:
+                    resizable = _copy_field(fields[-1])
+                    resizable.dims = (capacity, ) + resizable.dims[1:]
+                    fields = fields[:-1] + (resizable, )
+                    kwargs = dict(kwargs, num_elements=num_elements)
+                buffer = cls(type_name, *fields, allocate=False, **kwargs)
+                if layout_hash != buffer._layout_hash() or size != buffer.size():
+                    raise ValueError(f"{path} was saved from a buffer with a different layout.")
+                if len(mapped) < header_size + size:
+                    raise ValueError(f"{path} is truncated.")
+                with memoryview(mapped) as view:
+                    with view[header_size:header_size + size] as byte_data:
+                        buffer.ssbo = _make_shader_buffer(type_name, byte_data)
+        return buffer
+
+    def save(self, path, byte_data=None):
+        """
+        Write the buffer's contents into a file that `from_file` can
+        load. The file starts with a header holding a hash of
+        `full_glsl()`, the data size, and the capacity and number of
+        elements of the resizable array, followed by the data itself.
+        `byte_data` is the data to save; If it is not given, it is read
+        back from the GPU, which needs a Panda3D with
+        `GraphicsEngine.extract_shader_buffer_data`, so on Panda3D 1.10,
+        `byte_data` has to be given.
+        """
+        if byte_data is None:
+            extract = getattr(base.graphicsEngine, 'extract_shader_buffer_data', None)
+            if extract is None:
+                raise NotImplementedError(
+                    "This Panda3D can't read buffers back; Pass byte_data."
+                )
+            # The `ShaderBuffer` may be padded beyond the buffer's size.
+            byte_data = extract(self.ssbo, base.win.get_gsg())[:self.size()]
+        size = self.size()
+        with memoryview(byte_data) as view:
+            assert view.nbytes == size, f"Data is not {size} bytes long."
+            capacity, num_elements = 0, 0
+            if self.resizable_array is not None:
+                capacity, num_elements = self.capacity, self.num_elements
+            header = _file_header.pack(
+                _file_magic,
+                _file_version,
+                self._layout_hash(),
+                size,
+                capacity,
+                num_elements,
             )
+            with open(path, 'w+b') as f:
+                f.truncate(len(header) + size)
+                with mmap.mmap(f.fileno(), 0) as mapped:
+                    mapped[:len(header)] = header
+                    mapped[len(header):] = view.cast('B')
+
+    def _layout_hash(self):
+        return hashlib.sha256(self.full_glsl().encode('utf-8')).digest()
 
     def glsl(self):
         text = f"layout(std430) buffer {self.glsl_type_name} {{\n"
@@ -409,26 +1822,369 @@ class Buffer(GlType):
         text += "};"
         return text
 
-    def _add_element(self, byte_data, py_data):
-        for field, data in zip(self.fields, py_data):
-            byte_data, trailing = field._pack(data, byte_data)
-        return byte_data, self.alignment
+    @cached_property
+    def _field_offsets(self):
+        return _field_offsets(self.fields)
 
-    def _read_element(self, byte_data, read_at):
-        struct_py_data = []
-        for field in self.fields:
-            raa = read_at
-            py_data, read_at, trailing = field._unpack(byte_data, read_at)
-            print(raa, read_at, trailing)
-            struct_py_data.append(py_data)
-        return tuple(struct_py_data), self.alignment
+    @cached_property
+    def _field_offset_by_name(self):
+        return {
+            field.field_name: offset
+            for field, offset in zip(self.fields, self._field_offsets)
+        }
+
+    def _extent(self):
+        return self.size() // 4
+
+    def get_offset(self, path):
+        """
+        Return the byte offset of the field at `path`, e.g.
+        `'boids.nextDir'` or `'boids[3].nextDir'`.
+        """
+        return self._resolve_path(path)[1] * 4
+
+    def get_stride(self, path):
+        """
+        Return the distance in bytes between consecutive elements of the
+        innermost array on `path`, e.g. between `boids[i].nextDir` and
+        `boids[i+1].nextDir` for `'boids.nextDir'`.
+        """
+        stride = self._resolve_path(path)[2]
+        if stride is None:
+            raise ValueError(f"{path!r} is not in an array.")
+        return stride * 4
+
+    def layout_table(self):
+        "Return a `FieldLayout` for every field, nested ones included."
+        return self._layout_table
+
+    @cached_property
+    def _layout_table(self):
+        return _layout_rows(self)
+
+    def _resolve_path(self, path):
+        if path not in self._resolved_paths:
+            self._resolved_paths[path] = _resolve_path(self, None, path)
+        return self._resolved_paths[path]
+
+    @cached_property
+    def _resolved_paths(self):
+        "Results of `_resolve_path`, by path."
+        return {}
+
+    def view(self, byte_data):
+        if self._soa_arrays:
+            raise NotImplementedError(
+                "Views on struct-of-arrays buffers are not supported; "
+                "Use numpy_dtype() instead."
+            )
+        return StructView(self, memoryview(byte_data), 0)
+
+    def numpy_dtype(self):
+        """
+        Return a NumPy structured dtype describing the whole buffer, so
+        that `np.frombuffer(byte_data, buffer.numpy_dtype())[0]` gives a
+        view on its contents.
+        """
+        return _numpy_struct_dtype(self.fields, self._field_offsets, self.size())
+
+    def pack_columns(self, columns, byte_data=None):
+        """
+        Scatter NumPy arrays into the buffer's layout. `columns` maps
+        field paths to arrays of the field's shape, e.g.
+        `{'boids.pos': (num_boids, 3) array, 'boids.hashIdx': ...}`.
+        Fields that are not mentioned stay zeroed. Writes into
+        `byte_data` if it is given, otherwise into a new `bytearray`,
+        and returns it.
+        """
+        if byte_data is None:
+            byte_data = bytearray(self.size())
+        view = self._numpy_view(byte_data)
+        for path, column in columns.items():
+            field_view, field = self._numpy_field_view(view, path)
+            field_view[...] = field._numpy_encode(column)
+        return byte_data
+
+    def write(self, array_name, index, field=None, data=None):
+        """
+        Queue new data for part of a top-level array, to be uploaded by
+        `p3d_ssbo.algos.partial_update.PartialUpdate`. `index` is either
+        an element index or a slice of them, `field` optionally names the
+        struct field to write. Only the words covered by the written
+        data will be uploaded; Neighbouring fields and elements are left
+        untouched.
+
+        `data` is whatever `pack` accepts for the elements, or a NumPy
+        array (or nested sequence) of the field's shape.
+
+        ```python
+        buffer.write('boids', slice(100, 200), field='pos', data=positions)
+        ```
+        """
+        self._pending_writes.extend(self._word_writes(array_name, index, field, data))
+
+    def _word_writes(self, array_name, index, field, data):
+        "Return the (word indices, words) pairs that `write` queues."
+        array = self.get_field(array_name)
+        assert len(array.dims) == 1, "Only 1D arrays for now."
+        if not (field is None or isinstance(array, StructInstance)):
+            raise ValueError(
+                f"field= only applies to struct arrays, not to {array_name} of {array.glsl_type_name}."
+            )
+        if isinstance(index, slice):
+            start, stop, step = index.indices(array.dims[0])
+            assert step == 1, "Only contiguous ranges can be written."
+        else:
+            if index < 0:
+                index += array.dims[0]
+            if not 0 <= index < array.dims[0]:
+                raise IndexError(f"Index {index} out of range for a size {array.dims[0]} array.")
+            start, stop = index, index + 1
+            data = [data]
+        if array_name in self._soa_arrays:
+            return self._write_soa(array_name, start, stop, field, data)
+        array_offset = self._field_offset_by_name[array_name]
+        return [self._write_elements(array, array_offset, start, stop, field, data)]
+
+    def _write_elements(self, array, array_offset, start, stop, field, data):
+        count = stop - start
+        stride = array._stride()
+        scratch = bytearray(count * stride * 4)
+        if field is None:
+            first_word, num_words = 0, array.element_size
+            if isinstance(array, StructInstance):
+                for idx, element in enumerate(_iter_elements(data, (count, ))):
+                    values = []
+                    array._flatten_element(element, values)
+                    array._element_struct.pack_into(scratch, idx * stride * 4, *values)
+            else:
+                view = np.ndarray((count, ), dtype=array.numpy_dtype(), buffer=scratch)
+                array._numpy_unpad(view)[...] = array._numpy_encode(data)
+        else:
+            sub_field = array.get_field(field)
+            first_word = array.type_obj._field_offset_by_name[field]
+            num_words = sub_field._extent()
+            view = np.ndarray((count, ), dtype=array.numpy_dtype(), buffer=scratch)
+            sub_field._numpy_unpad(view[field])[...] = sub_field._numpy_encode(data)
+        words = np.frombuffer(scratch, dtype=np.uint32).reshape(count, stride)
+        word_indices = (
+            array_offset + first_word
+            + (start + np.arange(count, dtype=np.uint32))[:, None] * stride
+            + np.arange(num_words, dtype=np.uint32)
+        )
+        return (
+            word_indices.ravel(),
+            words[:, first_word:first_word + num_words].ravel(),
+        )
+
+    def _write_soa(self, array_name, start, stop, field, data):
+        # Each struct field is an array of its own, so writes to an array
+        # of structs turn into writes to those.
+        split_fields = self._soa_arrays[array_name]
+        if field is None:
+            columns = list(zip(*data))
+        else:
+            split_fields = [
+                split_field for split_field in split_fields
+                if split_field[0].field_name == field
+            ]
+            columns = [data]
+        num_elements = self.get_field(array_name).dims[0]
+        writes = []
+        for (sub_field, storage_field, tight), column in zip(split_fields, columns):
+            offset = self._field_offset_by_name[storage_field.field_name]
+            if not tight and sub_field.dims == ():
+                writes.append(
+                    self._write_elements(storage_field, offset, start, stop, None, column)
+                )
+                continue
+            # 3-vectors and fields with array dimensions are written as
+            # a range of their components / elements.
+            assert not isinstance(sub_field, StructInstance), \
+                "Arrays of structs in struct-of-arrays buffers can't be written."
+            if tight:
+                per_element = 3
+                flat_field = sub_field.component_type(storage_field.field_name, num_elements * 3)
+                trailing_dims = 1
+            else:
+                per_element = math.prod(sub_field.dims)
+                flat_field = type(sub_field)(storage_field.field_name, num_elements * per_element)
+                trailing_dims = len(sub_field.dims)
+            column = np.asarray(column)
+            column = column.reshape((-1, ) + column.shape[1 + trailing_dims:])
+            writes.append(
+                self._write_elements(
+                    flat_field,
+                    offset,
+                    start * per_element,
+                    stop * per_element,
+                    None,
+                    column,
+                )
+            )
+        return writes
+
+    def has_pending_writes(self):
+        return bool(self._pending_writes)
+
+    def pop_pending_writes(self):
+        """
+        Return the queued writes as arrays of word indices and the words
+        to write there, and clear the queue. If a word was written
+        several times, only the last write to it is returned.
+        """
+        writes = self._pending_writes
+        self._pending_writes = []
+        return _merge_writes(writes)
+
+    def _numpy_view(self, byte_data):
+        "0-d structured array viewing the buffer data in `byte_data`."
+        return np.ndarray((), dtype=self.numpy_dtype(), buffer=byte_data)
+
+    def _numpy_field_view(self, view, path):
+        """
+        Given a view from `_numpy_view`, return the view on the field
+        denoted by the dotted field path, e.g. `'boids.pos'`, without
+        padding components, and the field itself. In struct-of-arrays
+        buffers, `'boids.pos'` is read from the `boids_pos` array.
+        """
+        field_names = path.split('.')
+        field = self
+        if field_names[0] in self._soa_arrays and len(field_names) > 1:
+            array_name, sub_name, *field_names = field_names
+            for sub_field, storage_field, tight in self._soa_arrays[array_name]:
+                if sub_field.field_name == sub_name:
+                    break
+            else:
+                raise KeyError(sub_name)
+            view = view[storage_field.field_name]
+            if tight:
+                view = view.reshape(-1, 3)
+            field = sub_field
+        for field_name in field_names:
+            field = field.get_field(field_name)
+            view = view[field_name]
+        return field._numpy_unpad(view), field
+
+    def pack_stream(self, array_name, elements, byte_data=None, chunk_size=None):
+        """
+        Pack the top-level array `array_name` from an iterable of its
+        elements, like `GlType.pack_stream` does, also for arrays stored
+        as struct-of-arrays. Writes into `byte_data` if it is given,
+        otherwise into a new zeroed `bytearray` of the buffer's size, and
+        returns it. `chunk_size` defaults to the buffer's.
+        """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        if byte_data is None:
+            byte_data = bytearray(self.size())
+        assert len(byte_data) >= self.size(), "Buffer is too small."
+        self._pack_stream(byte_data, array_name, elements, 0, chunk_size)
+        return byte_data
+
+    def _pack_stream(self, byte_data, array_name, elements, write_at, chunk_size):
+        field = self.field_by_name[array_name]
+        assert field in self.declared_fields, f"{array_name} is not a top-level array."
+        assert field.dims != (), f"{array_name} is not an array."
+        if array_name not in self._soa_arrays:
+            offset = self._field_offsets[self.fields.index(field)] * 4
+            pack_chunk = lambda first, chunk: field._pack_elements(
+                byte_data, chunk, first, write_at + offset,
+            )
+        else:
+            split_fields = [
+                (storage_field, tight, self._field_offsets[self.fields.index(storage_field)] * 4)
+                for _, storage_field, tight in self._soa_arrays[array_name]
+            ]
+
+            def pack_chunk(first, chunk):
+                columns = zip(*chunk)
+                for (storage_field, tight, offset), column in zip(split_fields, columns):
+                    if tight:
+                        column = [c for vector in column for c in vector]
+                        storage_field._pack_elements(byte_data, column, first * 3, write_at + offset)
+                    else:
+                        storage_field._pack_elements(byte_data, column, first, write_at + offset)
+        _pack_chunks(elements, field.dims[0], pack_chunk, chunk_size)
+
+    def _pack_into(self, byte_data, py_data, write_at):
+        # Top-level arrays given as iterators (e.g. generators) are
+        # streamed into the buffer, so they are never fully in memory.
+        py_data = list(py_data)
+        streams = []
+        for idx, (field, data) in enumerate(zip(self.declared_fields, py_data)):
+            if isinstance(data, Iterator):
+                streams.append((field.field_name, data))
+                py_data[idx] = None
+        if self._soa_arrays:
+            py_data = self._soa_split(py_data)
+        # Top-level arrays may be huge, so instead of compiling a format
+        # for the whole buffer, each field packs its own elements.
+        for field, offset, data in zip(self.fields, self._field_offsets, py_data):
+            if data is not None:
+                field._pack_into(byte_data, data, write_at + offset * 4)
+        for array_name, elements in streams:
+            self._pack_stream(byte_data, array_name, elements, write_at, self.chunk_size)
+
+    def _unpack_from(self, byte_data, read_at):
+        py_data = tuple(
+            field._unpack_from(byte_data, read_at + offset)
+            for field, offset in zip(self.fields, self._field_offsets)
+        )
+        if self._soa_arrays:
+            py_data = self._soa_join(py_data)
+        return py_data
+
+    def _soa_split(self, py_data):
+        "Turn Python data for the declared fields into that for storage."
+        storage_data = {}
+        for field, data in zip(self.declared_fields, py_data):
+            if field.field_name not in self._soa_arrays:
+                storage_data[field.field_name] = data
+                continue
+            if data is None:
+                for _, storage_field, _ in self._soa_arrays[field.field_name]:
+                    storage_data[storage_field.field_name] = None
+                continue
+            assert len(data) == field.dims[0], \
+                f"{len(data)} elements given for a size {field.dims[0]} array."
+            split_fields = self._soa_arrays[field.field_name]
+            for element in data:
+                assert len(element) == len(split_fields), \
+                    f"{len(element)} fields given for a {field.glsl_type_name} with {len(split_fields)}."
+            columns = list(zip(*data))
+            for (_, storage_field, tight), column in zip(split_fields, columns):
+                if tight:
+                    column = [c for vector in column for c in vector]
+                storage_data[storage_field.field_name] = column
+        return [storage_data[field.field_name] for field in self.fields]
+
+    def _soa_join(self, storage_data):
+        "Turn Python data for storage into that for the declared fields."
+        storage_data = {
+            field.field_name: data
+            for field, data in zip(self.fields, storage_data)
+        }
+        py_data = []
+        for field in self.declared_fields:
+            if field.field_name not in self._soa_arrays:
+                py_data.append(storage_data[field.field_name])
+                continue
+            columns = []
+            for _, storage_field, tight in self._soa_arrays[field.field_name]:
+                column = storage_data[storage_field.field_name]
+                if tight:
+                    column = tuple(zip(column[0::3], column[1::3], column[2::3]))
+                columns.append(column)
+            py_data.append(tuple(zip(*columns)))
+        return tuple(py_data)
 
     def _get_struct_types(self, types=None):
         if types is None:
             types = []
         structs = [
             f
-            for f in self.fields
+            for f in self.declared_fields
             if isinstance(f, StructInstance)
         ]
         for field in structs:
@@ -443,14 +2199,297 @@ class Buffer(GlType):
         structs = self._get_struct_types()
         struct_glsl = '\n\n'.join([s.glsl() for s in structs])
         buffer_glsl = self.glsl()
-        glsl = '\n\n'.join([struct_glsl, buffer_glsl])
+        helpers = _glsl_helpers(structs, [self])
+        accessors = self.glsl_accessors()
+        if accessors:
+            helpers.append(accessors)
+        glsl = '\n\n'.join([struct_glsl, buffer_glsl] + helpers)
         return glsl
 
+    def glsl_accessors(self):
+        """
+        Return GLSL functions to access the elements of the buffer's 1D
+        arrays, which work the same in both layouts. For an array of
+        structs `boids`, these are
+
+        * `uint boids_length()`
+        * `Boid boids_get(uint idx)` and `void boids_set(uint idx, Boid newValue)`
+        * `vec3 boids_get_pos(uint idx)` and
+          `void boids_set_pos(uint idx, vec3 newValue)` for each field,
+
+        and for other arrays, the first three. Packed fields (e.g.
+        `GlUnorm4x8`) are decoded and encoded by their accessors, but
+        stay packed in the structs that `boids_get` returns.
+
+        Scalar `uint` and `int` fields, and arrays of them, also get
+        `uint pivot_atomicAdd_len(uint idx, uint value)` resp.
+        `counts_atomicAdd(uint idx, uint value)`, which add to the value
+        atomically and return what it was before.
+        """
+        functions = []
+        for field in self.declared_fields:
+            if len(field.dims) != 1:
+                continue
+            functions.extend(self._glsl_array_accessors(field))
+        return '\n'.join(functions)
+
+    def _glsl_array_accessors(self, array):
+        name = array.field_name
+        functions = []
+        if array is self.resizable_array:
+            functions.append(f"uniform uint {name}_count;")
+            length = f"{name}_count"
+        else:
+            length = f"{array.dims[0]}u"
+        functions.append(f"uint {name}_length() {{ return {length}; }}")
+        if not isinstance(array, StructInstance):
+            functions.extend(
+                _glsl_value_accessors(
+                    f"{name}_get",
+                    f"{name}_set",
+                    array,
+                    (),
+                    f"{name}[idx]",
+                    lambda value: f"{name}[idx] = {value};",
+                )
+            )
+            functions.extend(
+                _glsl_atomic_accessors(f"{name}_atomicAdd", array, (), f"{name}[idx]")
+            )
+            return functions
+
+        # How each field of an element is read and written
+        sub_fields = array.type_obj.fields
+        reads = []
+        writes = []
+        if name in self._soa_arrays:
+            storage = {
+                sub_field.field_name: (storage_field.field_name, tight)
+                for sub_field, storage_field, tight in self._soa_arrays[name]
+            }
+            for sub_field in sub_fields:
+                storage_name, tight = storage[sub_field.field_name]
+                if tight:
+                    components = [f"{storage_name}[idx * 3u + {c}u]" for c in range(3)]
+                    reads.append(f"{sub_field.glsl_type_name}({', '.join(components)})")
+                    writes.append(
+                        lambda value, components=components: ' '.join(
+                            f"{component} = {value}[{c}];"
+                            for c, component in enumerate(components)
+                        )
+                    )
+                else:
+                    reads.append(f"{storage_name}[idx]")
+                    writes.append(
+                        lambda value, storage_name=storage_name:
+                        f"{storage_name}[idx] = {value};"
+                    )
+        else:
+            for sub_field in sub_fields:
+                element = f"{name}[idx].{sub_field.field_name}"
+                reads.append(element)
+                writes.append(lambda value, element=element: f"{element} = {value};")
+
+        type_name = array.glsl_type_name
+        if name in self._soa_arrays:
+            get_body = f"return {type_name}({', '.join(reads)});"
+            set_body = ' '.join(
+                write(f"newValue.{sub_field.field_name}")
+                for sub_field, write in zip(sub_fields, writes)
+            )
+        else:
+            get_body = f"return {name}[idx];"
+            set_body = f"{name}[idx] = newValue;"
+        functions.append(f"{type_name} {name}_get(uint idx) {{ {get_body} }}")
+        functions.append(f"void {name}_set(uint idx, {type_name} newValue) {{ {set_body} }}")
+        for sub_field, read, write in zip(sub_fields, reads, writes):
+            functions.extend(
+                _glsl_value_accessors(
+                    f"{name}_get_{sub_field.field_name}",
+                    f"{name}_set_{sub_field.field_name}",
+                    sub_field,
+                    sub_field.dims,
+                    read,
+                    write,
+                )
+            )
+            functions.extend(
+                _glsl_atomic_accessors(
+                    f"{name}_atomicAdd_{sub_field.field_name}",
+                    sub_field,
+                    sub_field.dims,
+                    read,
+                )
+            )
+        return functions
+
     def get_field(self, field_name):
         field = self.field_by_name[field_name]
         return field
 
 
+def _glsl_helpers(structs, buffers):
+    "The `glsl_helpers` of the fields of `structs` and `buffers`, each once."
+    helpers = []
+    fields = [f for s in structs for f in s.fields] + [f for b in buffers for f in b.fields]
+    for field in fields:
+        if field.glsl_helpers and field.glsl_helpers not in helpers:
+            helpers.append(field.glsl_helpers)
+    return helpers
+
+
+# Header of files written by `Buffer.save`: magic, format version,
+# SHA-256 of the buffer's `full_glsl()`, the data size in bytes, and the
+# capacity and number of elements of the resizable array (0 if there is
+# none). 64 bytes, so the data after it stays well aligned.
+_file_header = struct.Struct('<8sI4x32sQII')
+_file_magic = b'P3DSSBO\0'
+_file_version = 1
+
+
+def _glsl_word_accessors(get_name, set_name, field, dims, word, params):
+    """
+    GLSL getter and setter for a value stored in `uint` words, where
+    `word(k)` is the expression of its k-th word.
+    """
+    return _glsl_value_accessors(
+        get_name,
+        set_name,
+        field,
+        dims,
+        _glsl_read_words(field, word, dims),
+        lambda value: ' '.join(_glsl_write_words(field, word, value, dims)),
+        params,
+    )
+
+
+def _merge_writes(writes):
+    """
+    Join a list of (word indices, words) pairs into one such pair. If a
+    word was written several times, only the last write to it is kept.
+    """
+    if not writes:
+        return (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32))
+    indices = np.concatenate([i for i, _ in writes])
+    words = np.concatenate([w for _, w in writes])
+    # np.unique returns the first occurrence, so look for it from the
+    # end, where the newest writes are.
+    indices, last = np.unique(indices[::-1], return_index=True)
+    words = words[::-1][last]
+    return indices.astype(np.uint32), words
+
+
+# Panda3D refuses to bind a buffer that is smaller than its GLSL block
+# rounded up to this many bytes, and GL rejects empty buffers, so all
+# buffers are padded to a non-zero multiple of it.
+_buffer_alignment = 16
+
+
+def _padded_size(size):
+    return max(-(-size // _buffer_alignment), 1) * _buffer_alignment
+
+
+def _make_shader_buffer(name, byte_data, usage=GeomEnums.UH_static):
+    """
+    Create a `ShaderBuffer` of a size in bytes, or from a buffer-protocol
+    object, padded with zeroes to a multiple of 16 bytes (and to at
+    least 16). Panda3D versions that only accept `bytes` as initial data
+    get a copy.
+    """
+    if isinstance(byte_data, int):
+        return ShaderBuffer(name, _padded_size(byte_data), usage)
+    size = memoryview(byte_data).nbytes
+    if size != _padded_size(size):
+        byte_data = bytes(byte_data).ljust(_padded_size(size), b'\0')
+    try:
+        return ShaderBuffer(name, byte_data, usage)
+    except TypeError:
+        return ShaderBuffer(name, bytes(byte_data), usage)
+
+
+class ArrayView:
+    """
+    Lazy view on an array in buffer byte data. Indexing it decodes only
+    the indexed element; Indexing multi-dimensional arrays returns views
+    on the subarrays.
+    """
+    def __init__(self, field, byte_data, read_at, dims):
+        self.field = field
+        self.byte_data = byte_data
+        self.read_at = read_at
+        self.dims = dims
+        self.stride = field._stride() * math.prod(dims[1:])
+
+    def __len__(self):
+        return self.dims[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self[idx] for idx in range(*index.indices(self.dims[0])))
+        if index < 0:
+            index += self.dims[0]
+        if not 0 <= index < self.dims[0]:
+            raise IndexError(f"Index {index} out of range for a size {self.dims[0]} array.")
+        return self.field._view(
+            self.byte_data,
+            self.read_at + index * self.stride,
+            self.dims[1:],
+        )
+
+    def __iter__(self):
+        for idx in range(self.dims[0]):
+            yield self[idx]
+
+    def unpack(self):
+        "Decode the whole array into Python data."
+        return tuple(
+            element.unpack() if isinstance(element, (ArrayView, StructView)) else element
+            for element in self
+        )
+
+    def __repr__(self):
+        return f"<ArrayView {self.field.glsl_type_name} {self.field.field_name}{list(self.dims)}>"
+
+
+class StructView:
+    """
+    Lazy view on a struct (or a whole buffer) in buffer byte data.
+    Fields can be accessed by indexing with their name, or as
+    attributes. Only the accessed field is decoded.
+    """
+    def __init__(self, type_obj, byte_data, read_at):
+        self.type_obj = type_obj
+        self.byte_data = byte_data
+        self.read_at = read_at
+
+    def __getitem__(self, field_name):
+        field = self.type_obj.field_by_name[field_name]
+        offset = self.type_obj._field_offset_by_name[field_name]
+        return field._view(self.byte_data, self.read_at + offset, field.dims)
+
+    def __getattr__(self, field_name):
+        if field_name.startswith('_') or field_name not in self.type_obj.field_by_name:
+            raise AttributeError(field_name)
+        return self[field_name]
+
+    def keys(self):
+        return [field.field_name for field in self.type_obj.declared_fields]
+
+    def unpack(self):
+        "Decode the whole struct into Python data."
+        offsets = self.type_obj._field_offset_by_name
+        return tuple(
+            field._unpack_from(
+                self.byte_data,
+                self.read_at + offsets[field.field_name],
+            )
+            for field in self.type_obj.declared_fields
+        )
+
+    def __repr__(self):
+        return f"<StructView {self.type_obj.glsl_type_name}>"
+
+
 class BufferSet:
     def __init__(self, *buffers):
         self.buffers = buffers
@@ -476,5 +2515,276 @@ class BufferSet:
         buffers = self._get_buffers()
         struct_glsl = '\n\n'.join([s.glsl() for s in structs])
         buffer_glsl = '\n\n'.join([b.glsl() for b in buffers])
-        glsl = '\n\n'.join([struct_glsl, buffer_glsl])
+        helpers = _glsl_helpers(structs, buffers)
+        glsl = '\n\n'.join([struct_glsl, buffer_glsl] + helpers)
+        return glsl
+
+
+class ArenaAllocation:
+    """
+    A logical buffer inside of an `Arena`, laid out like the `Buffer`
+    given as its `layout`. Shaders address it through `base`, the index
+    of its first word in the arena, which changes when the arena is
+    compacted; `size` is its size in bytes.
+    """
+    def __init__(self, arena, layout, base):
+        self.arena = arena
+        self.layout = layout
+        self.base = base
+        self.num_words = layout.size() // 4
+        self.size = layout.size()
+        self.freed = False
+
+    def write(self, array_name, index, field=None, data=None):
+        """
+        Queue new data for part of a top-level array of this allocation,
+        like `Buffer.write` does, to be uploaded into the arena by
+        `p3d_ssbo.algos.partial_update.PartialUpdate`.
+        """
+        assert not self.freed, "The allocation has been freed."
+        writes = self.layout._word_writes(array_name, index, field, data)
+        self.arena._pending_writes.append((self, writes))
+
+    def free(self):
+        self.arena.free(self)
+
+    def unpack(self, byte_data):
+        "Unpack this allocation's data from the arena's byte data."
+        start = self.base * 4
+        return self.layout.unpack(memoryview(byte_data)[start:start + self.size])
+
+
+class Arena(_ShaderBufferOwner):
+    """
+    One `ShaderBuffer` that holds many small logical buffers, so that
+    shaders working on all of them need only a single binding. Each
+    allocation is laid out like a `Buffer` (of which only the layout is
+    used), starting at a word offset in the arena. In GLSL, the arena is
+    a flat array of words, and the functions from `glsl_accessors` read
+    and write a layout's fields given an allocation's base offset.
+
+    When an allocation does not fit into any gap, the live allocations
+    are compacted into a new `ShaderBuffer`, which grows by
+    `growth_factor` if needed; `ResizeCopy` moves their contents there.
+    """
+    def __init__(self, type_name, size, growth_factor=2):
+        assert size % 4 == 0, "Arenas are made of whole words."
+        self.glsl_type_name = type_name
+        self.words_name = type_name + 'Words'
+        self.capacity = size // 4
+        self.growth_factor = growth_factor
+        self.allocations = []  # sorted by base
+        self.ssbo = _make_shader_buffer(type_name, size)
+        self._pending_writes = []
+        self._init_bindings()
+
+    def size(self):
+        return self.capacity * 4
+
+    def allocate(self, layout, initial_data=None):
+        """
+        Allocate space for a buffer laid out like the `Buffer` `layout`,
+        and return the `ArenaAllocation`. `initial_data` is whatever the
+        `Buffer` constructor accepts; It is queued like writes are, to
+        be uploaded by `PartialUpdate`. Without it, the allocation's
+        contents are undefined.
+        """
+        assert layout.layout == 'aos', "Arenas hold only array-of-structs layouts."
+        assert layout.resizable_array is None, "Arena allocations can't be resized."
+        num_words = layout.size() // 4
+        base = self._find_gap(num_words, layout.alignment)
+        replaced = base is None
+        if replaced:
+            needed = sum(
+                allocation.num_words + allocation.layout.alignment - 1
+                for allocation in self.allocations
+            ) + num_words + layout.alignment - 1
+            capacity = self.capacity
+            if needed > capacity:
+                capacity = max(needed, math.ceil(capacity * self.growth_factor))
+            self._reallocate(capacity)
+            base = self._find_gap(num_words, layout.alignment)
+        allocation = ArenaAllocation(self, layout, base)
+        self.allocations.append(allocation)
+        self.allocations.sort(key=lambda allocation: allocation.base)
+        if initial_data is not None:
+            byte_data = layout._initial_byte_data(initial_data)
+            words = np.frombuffer(byte_data, dtype=np.uint32)
+            indices = np.arange(num_words, dtype=np.uint32)
+            self._pending_writes.append((allocation, [(indices, words)]))
+        if replaced:
+            self._notify_resize()
+        return allocation
+
+    def free(self, allocation):
+        "Return the allocation's space to the arena."
+        assert allocation.arena is self and not allocation.freed
+        self.allocations.remove(allocation)
+        allocation.freed = True
+
+    def compact(self, shrink=False):
+        """
+        Move all allocations together at the start of the arena, into a
+        new `ShaderBuffer`; With `shrink`, that is only as large as they
+        need.
+        """
+        capacity = self.capacity
+        if shrink:
+            capacity = max(self._compacted_size(), 1)
+        self._reallocate(capacity)
+        self._notify_resize()
+
+    def records(self):
+        """
+        Return the (base, number of words) of each allocation, ordered by
+        base, as a NumPy array, e.g. to be uploaded so that shaders can
+        find the allocations.
+        """
+        return np.array(
+            [(allocation.base, allocation.num_words) for allocation in self.allocations],
+            dtype=np.uint32,
+        ).reshape(-1, 2)
+
+    def _find_gap(self, num_words, alignment):
+        "First word offset where `num_words` fit, or `None`."
+        cursor = 0
+        for allocation in self.allocations:
+            start = -(-cursor // alignment) * alignment
+            if start + num_words <= allocation.base:
+                return start
+            cursor = allocation.base + allocation.num_words
+        start = -(-cursor // alignment) * alignment
+        if start + num_words <= self.capacity:
+            return start
+        return None
+
+    def _compacted_size(self):
+        cursor = 0
+        for allocation in self.allocations:
+            alignment = allocation.layout.alignment
+            cursor = -(-cursor // alignment) * alignment + allocation.num_words
+        return cursor
+
+    def _reallocate(self, capacity):
+        old_ssbo = self.ssbo
+        old_bases = [allocation.base for allocation in self.allocations]
+        cursor = 0
+        for allocation in self.allocations:
+            alignment = allocation.layout.alignment
+            allocation.base = -(-cursor // alignment) * alignment
+            cursor = allocation.base + allocation.num_words
+        assert cursor <= capacity, "The allocations do not fit."
+        self.capacity = capacity
+        self.ssbo = _make_shader_buffer(self.glsl_type_name, capacity * 4)
+        self._pending_copies.append(
+            (
+                old_ssbo,
+                self.ssbo,
+                [
+                    (old_base, allocation.base, allocation.num_words)
+                    for old_base, allocation in zip(old_bases, self.allocations)
+                ],
+            )
+        )
+
+    def has_pending_writes(self):
+        return bool(self._pending_writes)
+
+    def pop_pending_writes(self):
+        """
+        Return the queued writes of all allocations like
+        `Buffer.pop_pending_writes` does, with word indices into the
+        arena. Writes to freed allocations are dropped.
+        """
+        writes = [
+            (indices + allocation.base, words)
+            for allocation, allocation_writes in self._pending_writes
+            if not allocation.freed
+            for indices, words in allocation_writes
+        ]
+        self._pending_writes = []
+        return _merge_writes(writes)
+
+    def shader_inputs(self):
+        return {self.glsl_type_name: self.ssbo}
+
+    def glsl(self):
+        return (
+            f"layout(std430) buffer {self.glsl_type_name} {{\n"
+            f"  uint {self.words_name}[];\n"
+            "};"
+        )
+
+    def glsl_accessors(self, layout):
+        """
+        Return GLSL functions to access allocations laid out like the
+        `Buffer` `layout`, given their base. For a layout `Sim` with an
+        array of structs `boids` and a `uint` field `count`, these are
+
+        * `uint Sim_boids_length()`
+        * `Boid Sim_boids_get(uint base, uint idx)` and
+          `void Sim_boids_set(uint base, uint idx, Boid newValue)`
+        * `vec3 Sim_boids_get_pos(uint base, uint idx)` and
+          `void Sim_boids_set_pos(uint base, uint idx, vec3 newValue)`
+          for each field of the struct,
+        * `uint Sim_count_get(uint base)` and
+          `void Sim_count_set(uint base, uint newValue)`.
+
+        Fields that are not 1D arrays are read and written as a whole.
+        """
+        words_name = self.words_name
+        functions = []
+        for field in layout.declared_fields:
+            offset = layout._field_offset_by_name[field.field_name]
+            name = f"{layout.glsl_type_name}_{field.field_name}"
+            if len(field.dims) != 1:
+                functions.extend(
+                    _glsl_word_accessors(
+                        f"{name}_get",
+                        f"{name}_set",
+                        field,
+                        field.dims,
+                        lambda k, offset=offset: f"{words_name}[base + {offset + k}u]",
+                        'uint base',
+                    )
+                )
+                continue
+            stride = field._stride()
+
+            def word(k, offset=offset, stride=stride):
+                return f"{words_name}[base + idx * {stride}u + {offset + k}u]"
+
+            params = 'uint base, uint idx'
+            functions.append(f"uint {name}_length() {{ return {field.dims[0]}u; }}")
+            functions.extend(
+                _glsl_word_accessors(f"{name}_get", f"{name}_set", field, (), word, params)
+            )
+            if isinstance(field, StructInstance):
+                struct = field.type_obj
+                for sub_field, sub_offset in zip(struct.fields, struct._field_offsets):
+                    functions.extend(
+                        _glsl_word_accessors(
+                            f"{name}_get_{sub_field.field_name}",
+                            f"{name}_set_{sub_field.field_name}",
+                            sub_field,
+                            sub_field.dims,
+                            lambda k, sub_offset=sub_offset, word=word: word(sub_offset + k),
+                            params,
+                        )
+                    )
+        return '\n'.join(functions)
+
+    def full_glsl(self, *layouts):
+        """
+        Return the GLSL for the arena, the structs used by `layouts`, and
+        the accessor functions for each of them.
+        """
+        structs = []
+        for layout in layouts:
+            structs = layout._get_struct_types(structs)
+        helpers = _glsl_helpers(structs, layouts)
+        accessors = [self.glsl_accessors(layout) for layout in layouts]
+        glsl = '\n\n'.join(
+            [s.glsl() for s in structs] + [self.glsl()] + helpers + accessors
+        )
         return glsl
@@ -0,0 +1,127 @@
+# Algorithms and tools render their shaders from Jinja templates, and
+# building the same pipeline twice would parse the same templates, render
+# the same sources, and compile the same shaders again. This module keeps
+# all three around for the whole process:
+#
+# * Templates are parsed once per template source.
+# * Rendered sources are kept per template source and render arguments.
+# * `Shader` objects are kept per hash of their sources, so the GSG
+#   prepares (and compiles) each distinct shader only once, no matter how
+#   many algorithm instances use it.
+#
+# With `set_disk_cache(path)`, parsed templates are also stored as Jinja
+# bytecode and rendered sources as files in that directory, so that
+# later runs start up faster. Everything on disk is named by the hash of
+# what it was made from, so stale entries are never used, only left
+# behind.
+import hashlib
+import os
+
+from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
+from jinja2 import FunctionLoader
+
+from panda3d.core import Shader
+
+
+_template_sources = {}  # hash -> template source
+_rendered_sources = {}  # hash -> rendered source
+_shaders = {}  # hash -> Shader
+_disk_cache_dir = None
+_environment = Environment(loader=FunctionLoader(_template_sources.get))
+
+
+def _hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def set_disk_cache(path):
+    """
+    Store parsed templates and rendered sources in the directory `path`
+    (which is created if needed), and look them up there. `None` turns
+    the disk cache off again.
+    """
+    global _disk_cache_dir
+    if path is None:
+        _disk_cache_dir = None
+        _environment.bytecode_cache = None
+    else:
+        os.makedirs(path, exist_ok=True)
+        _disk_cache_dir = path
+        _environment.bytecode_cache = FileSystemBytecodeCache(path)
+    _environment.cache.clear()
+
+
+def clear():
+    "Forget everything cached in memory; The disk cache is kept."
+    _template_sources.clear()
+    _rendered_sources.clear()
+    _shaders.clear()
+    _environment.cache.clear()
+
+
+def get_template(template_source):
+    "Return the parsed Jinja template for a template source."
+    key = _hash(template_source)
+    _template_sources[key] = template_source
+    return _environment.get_template(key)
+
+
+def render_template(template_source, **render_args):
+    """
+    Render a Jinja template source with `render_args`, which have to be
+    the strings, numbers and lists thereof that algorithms pass, so that
+    their `repr` identifies them.
+    """
+    key = _hash(template_source, repr(sorted(render_args.items())))
+    source = _rendered_sources.get(key)
+    if source is not None:
+        return source
+    if _disk_cache_dir is not None:
+        filename = os.path.join(_disk_cache_dir, key + '.glsl')
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                source = f.read()
+    if source is None:
+        source = get_template(template_source).render(**render_args)
+        if _disk_cache_dir is not None:
+            # Written under a temporary name first, so that concurrent
+            # processes never read half a file.
+            tmp_filename = f"{filename}.{os.getpid()}.tmp"
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                f.write(source)
+            os.replace(tmp_filename, filename)
+    _rendered_sources[key] = source
+    return source
+
+
+def compute_shader(source, name):
+    """
+    Return the compute `Shader` for a GLSL source, making it (and naming
+    it `name` for error messages) only if it has not been made before.
+    """
+    key = _hash('compute', source)
+    shader = _shaders.get(key)
+    if shader is None:
+        shader = Shader.make_compute(Shader.SL_GLSL, source)
+        shader.set_filename(Shader.STCompute, name)
+        _shaders[key] = shader
+    return shader
+
+
+def vertex_fragment_shader(vertex, fragment):
+    """
+    Like `compute_shader`, but for vertex and fragment shader sources.
+    Returns `None` if they can not be made into a `Shader`.
+    """
+    key = _hash('vertex', vertex, 'fragment', fragment)
+    shader = _shaders.get(key)
+    if shader is None:
+        shader = Shader.make(Shader.SL_GLSL, vertex=vertex, fragment=fragment)
+        if shader is not None:
+            _shaders[key] = shader
+    return shader
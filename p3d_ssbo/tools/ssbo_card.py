@@ -1,12 +1,12 @@
 import enum
 
-from jinja2 import Template
-
 from panda3d.core import NodePath
 from panda3d.core import CardMaker
-from panda3d.core import Shader
 from panda3d.core import CullBinManager
 
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import vertex_fragment_shader
+
 
 class GraphStyle:
     def __init__(self, bars=True, low=(1, 1, 1), high=(1, 1, 1),
@@ -43,8 +43,8 @@ out vec4 p3d_FragColor;
 {{ssbo}}
 
 void main() {
-  int idx = int(floor(v_texcoord.x * float({{array}}.length())));
-  float value_data = {{array}}[idx].{{key}};
+  uint idx = uint(floor(v_texcoord.x * float({{array}}_length())));
+  float value_data = {{array}}_get_{{key}}(idx);
   float value_pos = v_texcoord.y;
   vec3 color_chart = mix(vec3({{low}}), vec3({{high}}), value_data);
   vec3 color_background = vec3({{background}});
@@ -87,8 +87,7 @@ class SSBOCard:
             background=f"{style.bg[0]}, {style.bg[1]}, {style.bg[2]}",
             graph=graph_style,
         )
-        template = Template(fragment_template)
-        fragment_source = template.render(**render_args)
+        fragment_source = render_template(fragment_template, **render_args)
         if debug:
             print(self.__class__.__name__ + "::vertex")
             for line_nr, line_txt in enumerate(vertex_source.split('\n')):
@@ -97,11 +96,7 @@ class SSBOCard:
             for line_nr, line_txt in enumerate(fragment_source.split('\n')):
                 print(f"{line_nr:4d}  {line_txt}")
 
-        vis_shader = Shader.make(
-            Shader.SL_GLSL,
-            vertex=vertex_source,
-            fragment=fragment_source,
-        )
+        vis_shader = vertex_fragment_shader(vertex_source, fragment_source)
         if vis_shader is None:
             print("Couldn't compile SSBOCard shaders!")
             raise Exception
@@ -114,10 +109,7 @@ class SSBOCard:
                                                 CullBinManager.BT_fixed, 20)
         card.set_shader(vis_shader)
         card.set_bin("SSBOCard", 25)
-        card.set_shader_input(
-            data_buffer.glsl_type_name,
-            data_buffer.ssbo,
-        )
+        data_buffer.bind(card)
         self.card = card
 
     def get_np(self):
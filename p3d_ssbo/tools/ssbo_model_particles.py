@@ -1,4 +1,5 @@
-from jinja2 import Template
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import vertex_fragment_shader
 
 vertex_template = """#version 430
 
@@ -7,7 +8,7 @@ vertex_template = """#version 430
 uniform mat4 p3d_ModelViewProjectionMatrix;
 
 void main() {
-  vec3 pos = {{array}}[gl_VertexID].{{key}};
+  vec3 pos = {{array}}_get_{{key}}(uint(gl_VertexID));
   gl_Position = p3d_ModelViewProjectionMatrix * vec4(pos, 1);
 }
 """
@@ -31,22 +32,13 @@ class SSBOModelParticles:
             array=array_name,
             key=key,
         )
-        vert_template = Template(vertex_template)
-        vert_source = vert_template.render(**render_args)
-        frag_template = Template(fragment_template)
-        frag_source = frag_template.render(**render_args)
-        vis_shader = Shader.make(
-            Shader.SL_GLSL,
-            vertex=vert_source,
-            fragment=frag_source,
-        )
+        vert_source = render_template(vertex_template, **render_args)
+        frag_source = render_template(fragment_template, **render_args)
+        vis_shader = vertex_fragment_shader(vert_source, frag_source)
         num_particles = data_buffer.get_field(array_name).get_num_elements()[0]
         particles = self.set_up_particle_visualization(parent, num_particles)
         particles.set_shader(vis_shader)
-        particles.set_shader_input(
-            data_buffer.glsl_type_name,
-            data_buffer.ssbo,
-        )
+        data_buffer.bind(particles)
         self.particles = particles
         
     def get_np(self):
@@ -1,5 +1,3 @@
-from jinja2 import Template
-
 from panda3d.core import GeomVertexFormat
 from panda3d.core import GeomVertexData
 from panda3d.core import GeomEnums
@@ -8,7 +6,9 @@ from panda3d.core import Geom
 from panda3d.core import GeomNode
 from panda3d.core import BoundingVolume
 from panda3d.core import BoundingBox
-from panda3d.core import Shader
+
+from p3d_ssbo.shader_cache import render_template
+from p3d_ssbo.shader_cache import vertex_fragment_shader
 
 
 vertex_template = """#version 430
@@ -18,7 +18,7 @@ vertex_template = """#version 430
 uniform mat4 p3d_ModelViewProjectionMatrix;
 
 void main() {
-  vec3 pos = {{array}}[gl_VertexID].{{key}};
+  vec3 pos = {{array}}_get_{{key}}(uint(gl_VertexID));
   gl_Position = p3d_ModelViewProjectionMatrix * vec4(pos, 1);
 }
 """
@@ -42,24 +42,23 @@ class SSBOParticles:
             array=array_name,
             key=key,
         )
-        vert_template = Template(vertex_template)
-        vert_source = vert_template.render(**render_args)
-        frag_template = Template(fragment_template)
-        frag_source = frag_template.render(**render_args)
-        vis_shader = Shader.make(
-            Shader.SL_GLSL,
-            vertex=vert_source,
-            fragment=frag_source,
-        )
-        num_particles = data_buffer.get_field(array_name).get_num_elements()[0]
+        vert_source = render_template(vertex_template, **render_args)
+        frag_source = render_template(fragment_template, **render_args)
+        vis_shader = vertex_fragment_shader(vert_source, frag_source)
+        num_particles = data_buffer.get_length(array_name)
         particles = self.set_up_particle_visualization(parent, num_particles)
         particles.set_shader(vis_shader)
-        particles.set_shader_input(
-            data_buffer.glsl_type_name,
-            data_buffer.ssbo,
-        )
+        data_buffer.bind(particles)
         self.particles = particles
-        
+        self.array_name = array_name
+        data_buffer.add_resize_callback(self.resize)
+
+    def resize(self, data_buffer):
+        # One point per live particle
+        points = self.geom.modify_primitive(0)
+        points.clear_vertices()
+        points.add_next_vertices(data_buffer.get_length(self.array_name))
+
     def get_np(self):
         return self.particles
 
@@ -79,6 +78,7 @@ class SSBOParticles:
         geom = Geom(v_data)
         geom.add_primitive(points)
         geom.set_bounds(BoundingBox((0, 0, 0), (1, 1, 1)))
+        self.geom = geom
         node = GeomNode("node")
         node.add_geom(geom)
         node.set_bounds_type(BoundingVolume.BT_box)
@@ -0,0 +1,162 @@
+import numpy as np
+
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.gltypes import Arena
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlFloat('mass'),
+)
+emitter = Buffer(
+    'Emitter',
+    particle('particles', 4),
+    GlUInt('count'),
+)
+small = Buffer(
+    'Small',
+    GlFloat('values', 4),
+)
+
+
+def test_allocate_first_fit():
+    arena = Arena('MyArena', 64 * 4)
+    first = arena.allocate(small)
+    second = arena.allocate(small)
+    third = arena.allocate(small)
+    assert (first.base, second.base, third.base) == (0, 4, 8)
+    arena.free(second)
+    assert arena.allocate(small).base == 4
+    assert arena.pop_pending_copies() == []
+
+
+def test_allocate_aligned():
+    arena = Arena('MyArena', 64 * 4)
+    arena.allocate(Buffer('Odd', GlFloat('values', 3)))
+    allocation = arena.allocate(emitter)
+    assert allocation.base == 4
+    assert allocation.num_words == 20
+
+
+def test_allocate_compacts():
+    arena = Arena('MyArena', 12 * 4)
+    first = arena.allocate(small)
+    second = arena.allocate(small)
+    third = arena.allocate(small)
+    old_ssbo = arena.ssbo
+    arena.free(first)
+    arena.free(third)
+    big = arena.allocate(Buffer('Big', GlFloat('values', 8)))
+    assert arena.capacity == 12
+    assert (second.base, big.base) == (0, 4)
+    assert arena.ssbo is not old_ssbo
+    assert arena.pop_pending_copies() == [(old_ssbo, arena.ssbo, [(4, 0, 4)])]
+    assert arena.pop_pending_copies() == []
+
+
+def test_allocate_grows():
+    arena = Arena('MyArena', 8 * 4)
+    arena.allocate(small)
+    arena.allocate(small)
+    arena.allocate(small)
+    assert arena.capacity == 16
+    assert arena.size() == 64
+    [(_, _, segments)] = arena.pop_pending_copies()
+    assert [segment[2] for segment in segments] == [4, 4]
+
+
+def test_compact_twice_before_copy():
+    arena = Arena('MyArena', 16 * 4)
+    first = arena.allocate(small)
+    second = arena.allocate(small)
+    third = arena.allocate(small)
+    old_ssbo = arena.ssbo
+    arena.free(first)
+    arena.compact()
+    middle_ssbo = arena.ssbo
+    arena.free(second)
+    fourth = arena.allocate(small)
+    assert fourth.base == 0
+    arena.compact(shrink=True)
+    assert arena.capacity == 8
+    assert (fourth.base, third.base) == (0, 4)
+    # The fourth allocation only ever was in the middle buffer, and is
+    # copied from there like the others.
+    assert arena.pop_pending_copies() == [
+        (old_ssbo, middle_ssbo, [(4, 0, 4), (8, 4, 4)]),
+        (middle_ssbo, arena.ssbo, [(0, 0, 4), (4, 4, 4)]),
+    ]
+
+
+def test_records():
+    arena = Arena('MyArena', 64 * 4)
+    arena.allocate(small)
+    arena.allocate(emitter)
+    assert arena.records().tolist() == [[0, 4], [4, 20]]
+
+
+def test_pending_writes():
+    arena = Arena('MyArena', 64 * 4)
+    first = arena.allocate(small)
+    second = arena.allocate(emitter)
+    first.write('values', 2, data=1.0)
+    second.write('particles', 1, field='mass', data=2.0)
+    indices, words = arena.pop_pending_writes()
+    assert indices.tolist() == [2, 4 + 7]
+    assert words.view(np.float32).tolist() == [1.0, 2.0]
+    assert not arena.has_pending_writes()
+
+
+def test_pending_writes_follow_compaction():
+    arena = Arena('MyArena', 64 * 4)
+    first = arena.allocate(small)
+    second = arena.allocate(small, initial_data=[[1.0, 2.0, 3.0, 4.0]])
+    arena.free(first)
+    arena.compact()
+    indices, words = arena.pop_pending_writes()
+    assert indices.tolist() == [0, 1, 2, 3]
+    assert words.view(np.float32).tolist() == [1.0, 2.0, 3.0, 4.0]
+    second.free()
+    with pytest.raises(AssertionError):
+        second.write('values', 0, data=1.0)
+
+
+def test_unpack():
+    arena = Arena('MyArena', 16 * 4)
+    arena.allocate(small)
+    allocation = arena.allocate(small)
+    byte_data = np.arange(16, dtype=np.float32).tobytes()
+    assert allocation.unpack(byte_data) == ((4.0, 5.0, 6.0, 7.0),)
+
+
+def test_only_aos_fixed_size_layouts():
+    arena = Arena('MyArena', 64 * 4)
+    with pytest.raises(AssertionError):
+        arena.allocate(Buffer('Soa', particle('particles', 4), layout='soa'))
+    with pytest.raises(AssertionError):
+        arena.allocate(Buffer('Resizable', particle('particles', 4, unbounded=True)))
+
+
+def test_glsl_accessors():
+    arena = Arena('MyArena', 64 * 4)
+    glsl = arena.full_glsl(emitter)
+    assert 'struct Particle {' in glsl
+    assert 'layout(std430) buffer MyArena {\n  uint MyArenaWords[];\n};' in glsl
+    assert 'uint Emitter_particles_length() { return 4u; }' in glsl
+    assert (
+        'float Emitter_particles_get_mass(uint base, uint idx) { '
+        'return uintBitsToFloat(MyArenaWords[base + idx * 4u + 3u]); }'
+    ) in glsl
+    assert 'Particle Emitter_particles_get(uint base, uint idx)' in glsl
+    assert 'void Emitter_particles_set_pos(uint base, uint idx, vec3 newValue)' in glsl
+    assert (
+        'void Emitter_count_set(uint base, uint newValue) { '
+        'MyArenaWords[base + 16u] = newValue; }'
+    ) in glsl
@@ -0,0 +1,63 @@
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlFloat('mass'),
+)
+
+
+def test_save_and_load(tmp_path):
+    my_buffer = Buffer('MyBuffer', particle('particles', 32))
+    byte_data = my_buffer.pack_columns({'particles.mass': range(32)})
+    path = tmp_path / 'particles.ssbo'
+    my_buffer.save(path, byte_data)
+    file_data = path.read_bytes()
+    assert len(file_data) == 64 + my_buffer.size()
+    assert file_data[64:] == byte_data
+
+    loaded = Buffer.from_file(path, 'MyBuffer', particle('particles', 32))
+    assert loaded.ssbo.data_size_bytes == my_buffer.size()
+
+
+def test_load_other_layout(tmp_path):
+    my_buffer = Buffer('MyBuffer', particle('particles', 32))
+    path = tmp_path / 'particles.ssbo'
+    my_buffer.save(path, bytes(my_buffer.size()))
+    with pytest.raises(ValueError):
+        Buffer.from_file(path, 'MyBuffer', particle('particles', 64))
+    with pytest.raises(ValueError):
+        Buffer.from_file(path, 'MyBuffer', particle('particles', 32), layout='soa')
+
+
+def test_load_not_a_file(tmp_path):
+    path = tmp_path / 'particles.ssbo'
+    path.write_bytes(b'\0' * 128)
+    with pytest.raises(ValueError):
+        Buffer.from_file(path, 'MyBuffer', particle('particles', 32))
+
+
+def test_load_truncated(tmp_path):
+    my_buffer = Buffer('MyBuffer', particle('particles', 32))
+    path = tmp_path / 'particles.ssbo'
+    my_buffer.save(path, bytes(my_buffer.size()))
+    path.write_bytes(path.read_bytes()[:-16])
+    with pytest.raises(ValueError):
+        Buffer.from_file(path, 'MyBuffer', particle('particles', 32))
+
+
+def test_load_resized(tmp_path):
+    my_buffer = Buffer('MyBuffer', particle('particles', 8, unbounded=True))
+    my_buffer.resize(20)
+    path = tmp_path / 'particles.ssbo'
+    my_buffer.save(path, bytes(my_buffer.size()))
+    loaded = Buffer.from_file(path, 'MyBuffer', particle('particles', 8, unbounded=True))
+    assert loaded.capacity == my_buffer.capacity
+    assert loaded.num_elements == 20
+    assert loaded.ssbo.data_size_bytes == my_buffer.size()
@@ -41,3 +41,8 @@ def test_unpack_float_array():
     byte_data = array('f', (1,2,3,4,5,6)).tobytes()
     py_data = GlFloat('myFloat', 2, 3).unpack(byte_data)
     assert py_data == ((1,2,3), (4,5,6))
+
+
+def test_pack_float_array_2d():
+    data_buffer = GlFloat('myFloat', 2, 3).pack([[1,2,3], [4,5,6]])
+    assert data_buffer == array('f', [1,2,3,4,5,6]).tobytes()
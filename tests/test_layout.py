@@ -0,0 +1,104 @@
+import gc
+import weakref
+
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+boid = Struct(
+    'Boid',
+    GlVec3('pos'),
+    GlVec3('dir'),
+    GlVec3('nextPos'),
+    GlVec3('nextDir'),
+    GlUInt('hashIdx'),
+)
+pivot = Struct(
+    'Pivot',
+    GlUInt('start'),
+    GlUInt('len'),
+)
+data_buffer = Buffer(
+    'dataBuffer',
+    GlFloat('scale'),
+    boid('boids', 16),
+    pivot('pivot', 8),
+)
+
+
+def test_get_offset_buffer():
+    assert data_buffer.get_offset('scale') == 0
+    assert data_buffer.get_offset('boids') == 16
+    assert data_buffer.get_offset('boids.nextDir') == 16 + 48
+    assert data_buffer.get_offset('boids[3].nextDir') == 16 + 3 * 64 + 48
+    assert data_buffer.get_offset('boids[3].hashIdx') == 16 + 3 * 64 + 60
+    assert data_buffer.get_offset('pivot[2].len') == 16 + 16 * 64 + 2 * 8 + 4
+
+
+def test_get_stride():
+    assert data_buffer.get_stride('boids') == 64
+    assert data_buffer.get_stride('boids.nextDir') == 64
+    assert data_buffer.get_stride('pivot.len') == 8
+    with pytest.raises(ValueError):
+        data_buffer.get_stride('scale')
+
+
+def test_get_offset_struct():
+    assert boid.get_offset('hashIdx') == 60
+    my_boids = boid('boids', 16)
+    assert my_boids.get_offset('[2].dir') == 2 * 64 + 16
+    assert my_boids.get_stride() == 64
+
+
+def test_offsets_match_packer():
+    py_data = (
+        0.5,
+        tuple(
+            ((i, 0, 0), (0, i, 0), (0, 0, i), (i, i, i), i)
+            for i in range(16)
+        ),
+        tuple((i, 2 * i) for i in range(8)),
+    )
+    byte_data = data_buffer.pack(py_data)
+    offset = data_buffer.get_offset('boids[5].hashIdx')
+    assert int.from_bytes(byte_data[offset:offset + 4], 'little') == 5
+    offset = data_buffer.get_offset('pivot[7].len')
+    assert int.from_bytes(byte_data[offset:offset + 4], 'little') == 14
+
+
+def test_layout_table():
+    table = data_buffer.layout_table()
+    assert [row.path for row in table] == [
+        'scale',
+        'boids',
+        'boids.pos',
+        'boids.dir',
+        'boids.nextPos',
+        'boids.nextDir',
+        'boids.hashIdx',
+        'pivot',
+        'pivot.start',
+        'pivot.len',
+    ]
+    rows = {row.path: row for row in table}
+    assert rows['boids'].offset == 16
+    assert rows['boids'].size == 16 * 64
+    assert rows['boids'].stride == 64
+    assert rows['boids.hashIdx'].offset == 16 + 60
+    assert rows['boids.hashIdx'].stride == data_buffer.get_stride('boids.hashIdx')
+    assert rows['scale'].stride is None
+    assert data_buffer.layout_table() is table
+
+
+def test_resolved_paths_do_not_keep_buffers_alive():
+    my_buffer = Buffer('MyBuffer', boid('boids', 4))
+    assert my_buffer.get_offset('boids[1].hashIdx') == 64 + 60
+    ref = weakref.ref(my_buffer)
+    del my_buffer
+    gc.collect()
+    assert ref() is None
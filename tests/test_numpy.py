@@ -0,0 +1,115 @@
+import numpy as np
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+def test_dtype_scalar():
+    assert GlFloat('foo').numpy_dtype() == np.dtype('<f4')
+    assert GlUInt('foo', 3).numpy_dtype() == np.dtype('<u4')
+
+
+def test_dtype_vec3_array():
+    # vec3 arrays have a stride of four floats, the padding is exposed.
+    dtype = GlVec3('foo', 2).numpy_dtype()
+    assert dtype == np.dtype(('<f4', (4,)))
+
+
+def test_dtype_struct():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlFloat('foo'),
+        GlVec3('bar'),
+    )
+    dtype = my_struct_type('fnord', 2).numpy_dtype()
+    assert dtype.itemsize == 32
+    assert dtype.fields['foo'][1] == 0
+    assert dtype.fields['bar'][1] == 16
+    assert dtype['bar'] == np.dtype(('<f4', (3,)))
+
+
+def test_frombuffer_struct_array():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlFloat('foo'),
+        GlVec3('bar'),
+    )
+    my_struct = my_struct_type('fnord', 2)
+    py_data = (
+        (1.5, (0.25, 0.5, 0.75)),
+        (3.0, (0.125, 0.625, 0.875)),
+    )
+    byte_data = my_struct.pack(py_data) + b'\x00' * 4
+    view = np.frombuffer(byte_data, my_struct.numpy_dtype())
+    assert view['foo'].tolist() == [1.5, 3.0]
+    assert view['bar'].tolist() == [[0.25, 0.5, 0.75], [0.125, 0.625, 0.875]]
+
+
+def test_frombuffer_buffer():
+    boid = Struct(
+        'Boid',
+        GlVec3('pos'),
+        GlVec3('dir'),
+        GlUInt('hashIdx'),
+    )
+    my_buffer = Buffer(
+        'MyBuffer',
+        GlFloat('scale'),
+        boid('boids', 3),
+        GlVec3('points', 2),
+    )
+    py_data = (
+        2.0,
+        tuple(
+            ((i, i + 0.5, i + 0.25), (-i, 0, 1), i * 7)
+            for i in range(3)
+        ),
+        ((1, 2, 3), (4, 5, 6)),
+    )
+    byte_data = my_buffer.pack(py_data)
+    dtype = my_buffer.numpy_dtype()
+    assert dtype.itemsize == my_buffer.size()
+    view = np.frombuffer(byte_data, dtype)[0]
+    assert view['scale'] == 2.0
+    assert view['boids']['pos'][2].tolist() == [2, 2.5, 2.25]
+    assert view['boids']['dir'][1].tolist() == [-1, 0, 1]
+    assert view['boids']['hashIdx'].tolist() == [0, 7, 14]
+    assert view['points'][:, :3].tolist() == [[1, 2, 3], [4, 5, 6]]
+
+
+def test_pack_columns():
+    boid = Struct(
+        'Boid',
+        GlVec3('pos'),
+        GlVec3('dir'),
+        GlUInt('hashIdx'),
+    )
+    num_boids = 5
+    pos = np.random.random((num_boids, 3)).astype(np.float32)
+    hash_idx = np.arange(num_boids, dtype=np.uint32) * 3
+    points = np.array([[1, 2, 3], [4, 5, 6]], dtype=np.float32)
+    columns = {
+        'scale': 0.5,
+        'boids.pos': pos,
+        'boids.hashIdx': hash_idx,
+        'points': points,
+    }
+    my_buffer = Buffer(
+        'MyBuffer',
+        GlFloat('scale'),
+        boid('boids', num_boids),
+        GlVec3('points', 2),
+        initial_data=columns,
+    )
+    byte_data = my_buffer.pack_columns(columns)
+    assert len(byte_data) == my_buffer.size()
+
+    scale, boids, py_points = my_buffer.unpack(byte_data)
+    assert scale == 0.5
+    assert [b[0] for b in boids] == [tuple(p) for p in pos.tolist()]
+    assert [b[1] for b in boids] == [(0.0, 0.0, 0.0)] * num_boids
+    assert [b[2] for b in boids] == hash_idx.tolist()
+    assert py_points == ((1, 2, 3), (4, 5, 6))
@@ -0,0 +1,116 @@
+from array import array
+import struct
+
+import numpy as np
+
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import GlHalf2x16
+from p3d_ssbo.gltypes import GlUnorm4x8
+from p3d_ssbo.gltypes import GlSnorm4x8
+from p3d_ssbo.gltypes import GlUnorm2x16
+from p3d_ssbo.gltypes import GlSnorm2x16
+from p3d_ssbo.gltypes import GlSnorm10_10_10_2
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.gltypes import BufferSet
+
+
+def test_glsl_packed():
+    assert GlUnorm4x8('foo').glsl() == 'uint foo;'
+    assert GlSnorm10_10_10_2('foo', 2).glsl() == 'uint foo[2];'
+
+
+def test_size_packed():
+    assert GlHalf2x16('foo').size() == 4
+    assert GlUnorm4x8('foo', 3).size() == 12
+
+
+def test_pack_half2x16():
+    data_buffer = GlHalf2x16('foo').pack((0.5, -2.0))
+    assert data_buffer == struct.pack('<2e', 0.5, -2.0)
+    assert GlHalf2x16('foo').unpack(data_buffer) == (0.5, -2.0)
+
+
+def test_pack_unorm4x8():
+    data_buffer = GlUnorm4x8('foo').pack((1.0, 0.0, 2.0, -1.0))
+    # Components are clamped, and the first one is the lowest byte.
+    assert data_buffer == array('I', [0x00ff00ff]).tobytes()
+    assert GlUnorm4x8('foo').unpack(data_buffer) == (1.0, 0.0, 1.0, 0.0)
+
+
+def test_pack_snorm():
+    data_buffer = GlSnorm4x8('foo').pack((1.0, -1.0, 0.0, -2.0))
+    assert data_buffer == struct.pack('<4b', 127, -127, 0, -127)
+    data_buffer = GlSnorm2x16('foo').pack((1.0, -0.5))
+    assert data_buffer == struct.pack('<2h', 32767, -16384)
+    data_buffer = GlUnorm2x16('foo').pack((1.0, 0.5))
+    assert data_buffer == struct.pack('<2H', 65535, 32768)
+
+
+def test_pack_snorm_10_10_10_2():
+    field = GlSnorm10_10_10_2('foo')
+    data_buffer = field.pack((1.0, -1.0, 0.0, -1.0))
+    word = 511 | (0x3ff & -511) << 10 | 0 << 20 | 0x3 << 30
+    assert data_buffer == array('I', [word]).tobytes()
+    assert field.unpack(data_buffer) == (1.0, -1.0, 0.0, -1.0)
+
+
+def test_numpy_codecs_match_pack():
+    values = np.array(
+        [
+            [0.3, -0.7, 0.9, 1.0],
+            [-1.0, 0.25, 0.0, -0.4],
+        ],
+        dtype=np.float32,
+    )
+    for field_type in (GlUnorm4x8, GlSnorm4x8, GlSnorm10_10_10_2):
+        field = field_type('foo', 2)
+        data_buffer = field.pack(values.tolist())
+        stored = np.frombuffer(data_buffer, field.numpy_dtype())
+        assert (stored == field.numpy_encode(values)).all()
+        decoded = field.numpy_decode(stored)
+        assert np.allclose(decoded, field.unpack(data_buffer))
+
+
+def test_pack_columns_encodes():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlVec3('pos'),
+        GlUnorm4x8('color'),
+    )
+    my_buffer = Buffer(
+        'MyBuffer',
+        my_struct_type('fnord', 2),
+    )
+    colors = np.array([[1.0, 0.5, 0.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+    byte_data = my_buffer.pack_columns({'fnord.color': colors})
+    py_data = my_buffer.unpack(byte_data)
+    assert py_data[0][0][1] == (1.0, 128 / 255, 0.0, 0.0)
+    assert py_data[0][1][1] == (0.0, 0.0, 0.0, 1.0)
+
+
+def test_full_glsl_helpers():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlSnorm10_10_10_2('normal'),
+        GlUnorm4x8('color'),
+    )
+    my_buffer = Buffer(
+        'MyBuffer',
+        my_struct_type('fnord', 2),
+        GlSnorm10_10_10_2('extra'),
+    )
+    glsl = my_buffer.full_glsl()
+    assert glsl.count('vec4 unpackSnorm10_10_10_2(uint p)') == 1
+    # Built-in functions are not defined again.
+    assert 'vec4 unpackUnorm4x8(' not in glsl
+
+
+def test_buffer_set_glsl_helpers():
+    my_struct_type = Struct('MyStruct', GlSnorm10_10_10_2('normal'))
+    buffer_set = BufferSet(
+        Buffer('MyBuffer', my_struct_type('fnord', 2)),
+        Buffer('OtherBuffer', GlSnorm10_10_10_2('extra', 4)),
+    )
+    glsl = buffer_set.full_glsl()
+    assert glsl.count('vec4 unpackSnorm10_10_10_2(uint p)') == 1
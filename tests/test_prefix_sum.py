@@ -0,0 +1,103 @@
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.algos.prefix_sum import PrefixSum
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlUInt('count'),
+    GlUInt('start'),
+)
+
+
+def make_scan(capacity, **kwargs):
+    my_buffer = Buffer('MyBuffer', particle('particles', capacity, **kwargs))
+    scan = PrefixSum(my_buffer, ('particles', 'count'), ('particles', 'start'), exclusive=True)
+    return my_buffer, scan
+
+
+def plan(scan):
+    "Stage, level, workgroups and the uniforms of each step."
+    stages = {shader: key for key, shader in scan.shaders.items()}
+    return [
+        (
+            *stages[shader],
+            workgroups,
+            {name: value for name, value in inputs.items() if name != scan.sums_name},
+        )
+        for shader, workgroups, inputs in scan._steps()
+    ]
+
+
+def test_level_sizes():
+    _, scan = make_scan(8)
+    assert scan._level_sizes(0) == [0]
+    assert scan._level_sizes(512) == [512]
+    assert scan._level_sizes(513) == [513, 2]
+    assert scan._level_sizes(300000) == [300000, 586, 2]
+    assert scan._level_sizes(512 ** 3 + 1) == [512 ** 3 + 1, 512 ** 2 + 1, 513, 2]
+
+
+def test_single_tile():
+    _, scan = make_scan(512)
+    assert plan(scan) == [
+        ('scan', True, (1, 1, 1), dict(count=512, valuesOffset=0, totalsOffset=0)),
+    ]
+    assert scan.total_index == 0
+    # Just the total, padded to 16 bytes.
+    assert scan.sums.data_size_bytes == 16
+
+
+def test_three_levels():
+    _, scan = make_scan(300000)
+    assert scan.num_levels == 3
+    assert plan(scan) == [
+        ('scan', True, (586, 1, 1), dict(count=300000, valuesOffset=0, totalsOffset=0)),
+        ('scan', False, (2, 1, 1), dict(count=586, valuesOffset=0, totalsOffset=586)),
+        ('scan', False, (1, 1, 1), dict(count=2, valuesOffset=586, totalsOffset=588)),
+        ('add', False, (1, 1, 1), dict(count=586, valuesOffset=0, prefixOffset=586)),
+        ('add', True, (585, 1, 1), dict(count=300000, valuesOffset=0, prefixOffset=0)),
+    ]
+    # The block sums of both levels, and the grand total after them.
+    assert scan.total_index == 588
+    assert scan.sums.data_size_bytes == 2368  # (586 + 2 + 1) * 4, padded
+
+
+def test_resized():
+    my_buffer, scan = make_scan(600, unbounded=True)
+    assert scan.num_levels == 2
+    sums = scan.sums
+    my_buffer.resize(100)
+    scan._allocate()
+    assert scan.sums is sums
+    # The live elements fit into one tile, but the capacity has two
+    # levels, the second of which scans the single block sum.
+    assert plan(scan) == [
+        ('scan', True, (1, 1, 1), dict(count=100, valuesOffset=0, totalsOffset=0)),
+        ('scan', False, (1, 1, 1), dict(count=1, valuesOffset=0, totalsOffset=1)),
+        ('add', True, (1, 1, 1), dict(count=100, valuesOffset=0, prefixOffset=0)),
+    ]
+    assert scan.total_index == 1
+    my_buffer.resize(300000)
+    scan._allocate()
+    assert scan.num_levels == 3
+    assert scan.total_index == 588
+    assert len(plan(scan)) == 5
+
+
+def test_keys():
+    my_buffer = Buffer(
+        'MyBuffer',
+        particle('particles', 8),
+        GlFloat('other', 4),
+    )
+    with pytest.raises(AssertionError):
+        PrefixSum(my_buffer, ('particles', 'pos'), ('particles', 'start'))
+    with pytest.raises(AssertionError):
+        PrefixSum(my_buffer, ('particles', 'count'), ('other', 'start'))
@@ -0,0 +1,107 @@
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import GlMat3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.algos.reduce import Reduce
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlFloat('mass'),
+    GlMat3('inertia'),
+)
+
+
+def make_buffer(capacity, **kwargs):
+    return Buffer('MyBuffer', particle('particles', capacity, **kwargs))
+
+
+def plan(reduction):
+    "First and last level, workgroups and the uniforms of each step."
+    levels = {shader: key for key, shader in reduction.shaders.items()}
+    return [
+        (
+            *levels[shader],
+            workgroups,
+            {name: value for name, value in inputs.items() if isinstance(value, int)},
+        )
+        for shader, workgroups, inputs in reduction._steps()
+    ]
+
+
+def test_single_level():
+    reduction = Reduce(make_buffer(512), ('particles', 'mass'))
+    assert plan(reduction) == [
+        (True, True, (1, 1, 1), dict(count=512, readOffset=0, writeOffset=0)),
+    ]
+    assert reduction.num_slots == 1
+
+
+def test_levels():
+    reduction = Reduce(make_buffer(300000), ('particles', 'mass'), 'max')
+    assert reduction._level_sizes(300000) == [300000, 586, 2]
+    assert plan(reduction) == [
+        (True, False, (586, 1, 1), dict(count=300000, readOffset=0, writeOffset=0)),
+        (False, False, (2, 1, 1), dict(count=586, readOffset=0, writeOffset=586)),
+        (False, True, (1, 1, 1), dict(count=2, readOffset=586, writeOffset=588)),
+    ]
+    # One float for each tile of both levels of partials.
+    assert reduction.partials.data_size_bytes == (586 + 2) * 4
+
+
+def test_aabb_slots():
+    reduction = Reduce(make_buffer(1000), ('particles', 'pos'), 'aabb')
+    assert reduction.num_slots == 2
+    # Each tile's minimum and maximum are next to each other.
+    assert plan(reduction) == [
+        (True, False, (2, 1, 1), dict(count=1000, readOffset=0, writeOffset=0)),
+        (False, True, (1, 1, 1), dict(count=2, readOffset=0, writeOffset=4)),
+    ]
+    # vec3s are as far apart as vec4s.
+    assert reduction.partials.data_size_bytes == 2 * 2 * 16
+    assert reduction.result.get_field('reducedValues').dims == (2, )
+
+
+def test_resized():
+    my_buffer = make_buffer(600, unbounded=True)
+    reduction = Reduce(my_buffer, ('particles', 'mass'))
+    partials = reduction.partials
+    my_buffer.resize(10)
+    reduction._allocate()
+    assert reduction.partials is partials
+    # The capacity has two levels, so the second reduces a single value.
+    assert plan(reduction) == [
+        (True, False, (1, 1, 1), dict(count=10, readOffset=0, writeOffset=0)),
+        (False, True, (1, 1, 1), dict(count=1, readOffset=0, writeOffset=1)),
+    ]
+    my_buffer.resize(0)
+    assert plan(reduction)[0] == (True, False, (1, 1, 1), dict(count=0, readOffset=0, writeOffset=0))
+    my_buffer.resize(300000)
+    reduction._allocate()
+    assert reduction.num_levels == 3
+    assert len(plan(reduction)) == 3
+
+
+def test_values():
+    my_buffer = make_buffer(8)
+    reduction = Reduce(my_buffer, ('particles', 'pos'), 'sum', value=(GlFloat, 'length(value)'))
+    assert reduction.result.get_field('reducedValues').glsl_type_name == 'float'
+    with pytest.raises(AssertionError):
+        Reduce(my_buffer, ('particles', 'mass'), 'aabb')
+    with pytest.raises(AssertionError):
+        Reduce(my_buffer, ('particles', 'mass'), 'product')
+    with pytest.raises(AssertionError):
+        Reduce(my_buffer, ('particles', 'inertia'))
+
+
+def test_small_buffers():
+    # GL rejects buffers of less than 16 bytes, so the result and the
+    # partials of a single level are padded by `Buffer` itself.
+    reduction = Reduce(make_buffer(512), ('particles', 'mass'))
+    assert reduction.result.size() == 4
+    assert reduction.result.ssbo.data_size_bytes == 16
+    assert reduction.partials.data_size_bytes == 16
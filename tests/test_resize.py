@@ -0,0 +1,115 @@
+import pytest
+
+from panda3d.core import NodePath
+from panda3d.core import ShaderInput
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlFloat('mass'),
+)
+
+
+def make_buffer(capacity=32, **kwargs):
+    return Buffer(
+        'MyBuffer',
+        GlUInt('header', 4),
+        particle('particles', capacity, unbounded=True),
+        **kwargs,
+    )
+
+
+def test_glsl_unbounded():
+    my_buffer = make_buffer(num_elements=20)
+    glsl = my_buffer.full_glsl()
+    assert '  Particle particles[];\n' in glsl
+    assert 'uniform uint particles_count;' in glsl
+    assert 'uint particles_length() { return particles_count; }' in glsl
+    assert my_buffer.shader_inputs() == {
+        'MyBuffer': my_buffer.ssbo,
+        'particles_count': 20,
+    }
+
+
+def test_only_last_field_unbounded():
+    with pytest.raises(AssertionError):
+        Buffer(
+            'MyBuffer',
+            particle('particles', 32, unbounded=True),
+            GlUInt('header', 4),
+        )
+
+
+def test_resize_within_capacity():
+    my_buffer = make_buffer()
+    assert my_buffer.num_elements == 32
+    ssbo = my_buffer.ssbo
+    assert not my_buffer.resize(10)
+    assert my_buffer.ssbo is ssbo
+    assert my_buffer.get_length('particles') == 10
+    assert my_buffer.get_length('header') == 4
+    assert my_buffer.pop_pending_copies() == []
+
+
+def test_resize_grows():
+    my_buffer = make_buffer()
+    old_ssbo = my_buffer.ssbo
+    old_size = my_buffer.size()
+    assert my_buffer.resize(33)
+    assert my_buffer.capacity == 64
+    assert my_buffer.size() == 16 + 64 * 16
+    assert my_buffer.ssbo.data_size_bytes == my_buffer.size()
+    middle_ssbo = my_buffer.ssbo
+    middle_size = my_buffer.size()
+    assert my_buffer.resize(1000)
+    assert my_buffer.capacity == 1000
+    # The copies are chained, from the oldest buffer to the newest.
+    assert my_buffer.pop_pending_copies() == [
+        (old_ssbo, middle_ssbo, [(0, 0, old_size // 4)]),
+        (middle_ssbo, my_buffer.ssbo, [(0, 0, middle_size // 4)]),
+    ]
+    assert my_buffer.pop_pending_copies() == []
+
+
+def test_resize_leaves_fields_alone():
+    particles = particle('particles', 32, unbounded=True)
+    assert particles.get_offset('[31].mass') == 31 * 16 + 12
+    buffer_a = Buffer('BufferA', particles)
+    buffer_b = Buffer('BufferB', particles)
+    buffer_a.resize(100)
+    assert particles.dims == (32, )
+    assert particles.get_offset('[31].mass') == 31 * 16 + 12
+    assert buffer_a.get_offset('particles[99].mass') == 99 * 16 + 12
+    assert buffer_b.capacity == 32
+    assert buffer_b.size() == 32 * 16
+
+
+def test_reserve_and_shrink():
+    my_buffer = make_buffer(num_elements=20)
+    my_buffer.reserve(100)
+    assert my_buffer.capacity == 100
+    assert my_buffer.num_elements == 20
+    my_buffer.pop_pending_copies()
+    my_buffer.shrink_to_fit()
+    assert my_buffer.capacity == 20
+    [(_, _, segments)] = my_buffer.pop_pending_copies()
+    assert segments == [(0, 0, (16 + 20 * 16) // 4)]
+
+
+def test_bind_and_callbacks():
+    my_buffer = make_buffer()
+    np = NodePath('node')
+    my_buffer.bind(np)
+    resized = []
+    my_buffer.add_resize_callback(resized.append)
+    my_buffer.resize(40)
+    assert resized == [my_buffer]
+    assert np.get_shader_input('MyBuffer') == ShaderInput('MyBuffer', my_buffer.ssbo)
+    assert my_buffer.shader_inputs()['particles_count'] == 40
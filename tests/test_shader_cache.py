@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from p3d_ssbo import shader_cache
+
+
+template = "#version 430\n{{ssbo}}\nvoid main() { {{body}} }\n"
+compute_source = "#version 430\nlayout (local_size_x = 1) in;\nvoid main() {}\n"
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    shader_cache.clear()
+    yield
+    shader_cache.set_disk_cache(None)
+    shader_cache.clear()
+
+
+def test_render_template():
+    source = shader_cache.render_template(template, ssbo='// ssbo', body='return;')
+    assert source == "#version 430\n// ssbo\nvoid main() { return; }"
+
+
+def test_render_template_cached():
+    first = shader_cache.render_template(template, ssbo='a', body='b')
+    second = shader_cache.render_template(template, body='b', ssbo='a')
+    other = shader_cache.render_template(template, ssbo='a', body='c')
+    assert first is second
+    assert other != first
+
+
+def test_template_parsed_once():
+    assert shader_cache.get_template(template) is shader_cache.get_template(template)
+
+
+def test_compute_shader_cached():
+    shader = shader_cache.compute_shader(compute_source, 'Test')
+    assert shader_cache.compute_shader(compute_source, 'Other') is shader
+    shader_cache.clear()
+    assert shader_cache.compute_shader(compute_source, 'Test') is not shader
+
+
+def test_disk_cache(tmp_path):
+    shader_cache.set_disk_cache(str(tmp_path))
+    source = shader_cache.render_template(template, ssbo='a', body='b')
+    glsl_files = [f for f in os.listdir(tmp_path) if f.endswith('.glsl')]
+    assert len(glsl_files) == 1
+    assert len(os.listdir(tmp_path)) == 2  # rendered source and bytecode
+    with open(tmp_path / glsl_files[0], 'w') as f:
+        f.write('from disk')
+    assert shader_cache.render_template(template, ssbo='a', body='b') is source
+    shader_cache.clear()
+    assert shader_cache.render_template(template, ssbo='a', body='b') == 'from disk'
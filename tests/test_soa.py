@@ -0,0 +1,133 @@
+from array import array
+
+import numpy as np
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import GlUnorm4x8
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlFloat('mass', 2),
+    GlUInt('hashIdx'),
+)
+
+
+def make_buffer(layout):
+    return Buffer(
+        'MyBuffer',
+        particle('particles', 3),
+        GlFloat('values', 2),
+        layout=layout,
+    )
+
+
+py_data = (
+    (
+        ((1, 2, 3), (4, 5), 6),
+        ((7, 8, 9), (10, 11), 12),
+        ((13, 14, 15), (16, 17), 18),
+    ),
+    (19, 20),
+)
+
+
+def test_glsl_soa():
+    glsl = make_buffer('soa').glsl()
+    assert glsl == (
+        'layout(std430) buffer MyBuffer {\n'
+        '  float particles_pos[9];\n'
+        '  float particles_mass[3][2];\n'
+        '  uint particles_hashIdx[3];\n'
+        '  float values[2];\n'
+        '};'
+    )
+
+
+def test_glsl_accessors():
+    for layout in ('aos', 'soa'):
+        glsl = make_buffer(layout).full_glsl()
+        assert 'uint particles_length() { return 3u; }' in glsl
+        assert 'Particle particles_get(uint idx)' in glsl
+        assert 'void particles_set(uint idx, Particle newValue)' in glsl
+        assert 'vec3 particles_get_pos(uint idx)' in glsl
+        assert 'void particles_set_mass(uint idx, float[2] newValue)' in glsl
+        assert 'float values_get(uint idx)' in glsl
+
+
+def test_glsl_accessors_packed():
+    colored = Struct(
+        'Colored',
+        GlUnorm4x8('color'),
+    )
+    my_buffer = Buffer('MyBuffer', colored('things', 32))
+    glsl = my_buffer.full_glsl()
+    assert 'vec4 things_get_color(uint idx) { return unpackUnorm4x8(things[idx].color); }' in glsl
+
+
+def test_pack_soa():
+    my_buffer = make_buffer('soa')
+    data_buffer = my_buffer.pack(py_data)
+    expected_data = (
+        array('f', [1, 2, 3, 7, 8, 9, 13, 14, 15, 4, 5, 10, 11, 16, 17]).tobytes()
+        + array('I', [6, 12, 18]).tobytes()
+        + array('f', [19, 20]).tobytes()
+    )
+    assert data_buffer == expected_data
+    assert my_buffer.unpack(data_buffer) == py_data
+
+
+def test_pack_soa_checks_shape():
+    my_buffer = make_buffer('soa')
+    with pytest.raises(AssertionError):
+        my_buffer.pack((py_data[0][:2], py_data[1]))
+    with pytest.raises(AssertionError):
+        my_buffer.pack(((py_data[0][0][:2], ) + py_data[0][1:], py_data[1]))
+
+
+def test_pack_columns_soa():
+    aos_buffer = make_buffer('aos')
+    soa_buffer = make_buffer('soa')
+    columns = {
+        'particles.pos': np.arange(9).reshape(3, 3),
+        'particles.hashIdx': np.array([3, 2, 1]),
+    }
+    assert aos_buffer.unpack(aos_buffer.pack_columns(columns)) == \
+        soa_buffer.unpack(soa_buffer.pack_columns(columns))
+
+
+def test_write_soa():
+    results = []
+    for layout in ('aos', 'soa'):
+        my_buffer = make_buffer(layout)
+        words = np.frombuffer(my_buffer.pack(py_data), dtype=np.uint32).copy()
+        my_buffer.write('particles', slice(0, 2), field='pos', data=[(0, 0, 0), (1, 1, 1)])
+        my_buffer.write('particles', 2, data=((5, 5, 5), (5, 5), 5))
+        indices, new_words = my_buffer.pop_pending_writes()
+        words[indices] = new_words
+        results.append(my_buffer.unpack(words.tobytes()))
+    assert results[0] == results[1]
+    assert results[1][0][2] == ((5, 5, 5), (5, 5), 5)
+
+
+def test_glsl_accessors_atomic():
+    counted = Struct(
+        'Counted',
+        GlUInt('count'),
+        GlFloat('weight'),
+        GlUInt('pair', 2),
+    )
+    for layout in ('aos', 'soa'):
+        my_buffer = Buffer('MyBuffer', counted('cells', 8), GlUInt('totals', 4), layout=layout)
+        glsl = my_buffer.full_glsl()
+        count = 'cells[idx].count' if layout == 'aos' else 'cells_count[idx]'
+        assert f'uint cells_atomicAdd_count(uint idx, uint value) {{ return atomicAdd({count}, value); }}' in glsl
+        assert 'uint totals_atomicAdd(uint idx, uint value) { return atomicAdd(totals[idx], value); }' in glsl
+        assert 'cells_atomicAdd_weight' not in glsl
+        assert 'cells_atomicAdd_pair' not in glsl
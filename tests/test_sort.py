@@ -0,0 +1,168 @@
+import pytest
+
+from p3d_ssbo.gltypes import GlInt
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.algos.bitonic_sort import BitonicSort
+from p3d_ssbo.algos.radix_sort import RadixSort
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlUInt('key'),
+    GlInt('signedKey'),
+)
+
+
+def make_buffer(capacity, **kwargs):
+    return Buffer('MyBuffer', particle('particles', capacity, **kwargs))
+
+
+def plan(steps):
+    "The workgroups and inputs of each step, without the shaders."
+    return [(workgroups, inputs) for _, workgroups, inputs in steps]
+
+
+def test_bitonic_global_steps():
+    sorter = BitonicSort(make_buffer(5), ('particles', 'key'), tile_size=None)
+    # 5 elements are sorted as 8, in 1 + 2 + 3 steps.
+    assert plan(sorter.steps) == [
+        ((1, 1, 1), dict(span=1, flip=1)),
+        ((1, 1, 1), dict(span=2, flip=1)),
+        ((1, 1, 1), dict(span=1, flip=0)),
+        ((1, 1, 1), dict(span=4, flip=1)),
+        ((1, 1, 1), dict(span=2, flip=0)),
+        ((1, 1, 1), dict(span=1, flip=0)),
+    ]
+
+
+def test_bitonic_local_steps():
+    sorter = BitonicSort(make_buffer(1000), ('particles', 'key'), tile_size=512)
+    # The network is 1024 wide; Only the span of 512 does not fit into a
+    # tile.
+    assert plan(sorter.steps) == [
+        ((2, 1, 1), dict(firstStage=0, lastStage=8)),
+        ((16, 1, 1), dict(span=512, flip=1)),
+        ((2, 1, 1), dict(firstStage=9, lastStage=9)),
+    ]
+    local_shader = sorter.steps[0][0]
+    assert sorter.steps[2][0] is local_shader
+    assert sorter.steps[1][0] is not local_shader
+
+
+def test_bitonic_small_array():
+    sorter = BitonicSort(make_buffer(3), ('particles', 'key'), tile_size=512)
+    # The tile shrinks to the network's width of 4.
+    assert plan(sorter.steps) == [((1, 1, 1), dict(firstStage=0, lastStage=1))]
+    assert BitonicSort(make_buffer(1), ('particles', 'key')).steps == []
+
+
+def test_bitonic_gather():
+    sorter = BitonicSort(make_buffer(100), ('particles', 'key'), tile_size=64, mode='gather')
+    steps = plan(sorter.steps)
+    assert steps[0] == ((4, 1, 1), {})  # initializing the pairs
+    assert steps[1] == ((2, 1, 1), dict(firstStage=0, lastStage=5))
+    assert steps[2] == ((2, 1, 1), dict(span=64, flip=1))
+    assert steps[3] == ((2, 1, 1), dict(firstStage=6, lastStage=6))
+    scratch_name = 'MyBufferSortScratch'
+    assert steps[4:] == [
+        ((4, 1, 1), {'toScratch': 1, scratch_name: sorter.scratch}),
+        ((4, 1, 1), {'toScratch': 0, scratch_name: sorter.scratch}),
+    ]
+    assert sorter.scratch.data_size_bytes == 100 * 32
+    assert sorter.pairs.get_field('particlesSorted').dims == (100, )
+
+
+def test_bitonic_modes():
+    with pytest.raises(AssertionError):
+        BitonicSort(make_buffer(8), ('particles', 'key'), mode='unknown')
+    with pytest.raises(AssertionError):
+        BitonicSort(make_buffer(8), ('particles', 'pos'), mode='indices')
+    with pytest.raises(AssertionError):
+        BitonicSort(make_buffer(8), ('particles', 'key'), tile_size=48)
+
+
+def test_bitonic_pairs_padded():
+    # Panda3D only binds the pairs if their size is padded to a multiple
+    # of 16 bytes.
+    for num_elements, size in [(5, 48), (255, 2048), (257, 2064)]:
+        sorter = BitonicSort(make_buffer(num_elements), ('particles', 'key'), mode='indices')
+        assert sorter.pairs.size() == num_elements * 8
+        assert sorter.pairs.ssbo.data_size_bytes == size
+
+
+def test_bitonic_resize():
+    my_buffer = make_buffer(1000, unbounded=True)
+    sorter = BitonicSort(my_buffer, ('particles', 'key'), tile_size=512, mode='indices')
+    steps = sorter.steps
+    my_buffer.resize(600)
+    sorter.resize(my_buffer)
+    assert sorter.steps is steps
+    assert sorter.pairs.num_elements == 600
+    my_buffer.resize(1500)
+    sorter.resize(my_buffer)
+    assert sorter.capacity == 2000
+    assert sorter.pairs.capacity == 2000
+    assert sorter.pairs.num_elements == 1500
+    assert plan(sorter.steps) == [
+        ((63, 1, 1), {}),
+        ((4, 1, 1), dict(firstStage=0, lastStage=8)),
+        ((32, 1, 1), dict(span=512, flip=1)),
+        ((4, 1, 1), dict(firstStage=9, lastStage=9)),
+        ((32, 1, 1), dict(span=1024, flip=1)),
+        ((32, 1, 1), dict(span=512, flip=0)),
+        ((4, 1, 1), dict(firstStage=10, lastStage=10)),
+    ]
+    # The pairs are made anew by each sort, so they need no copying.
+    assert sorter.pairs.pop_pending_copies() == []
+
+
+def test_radix_shifts():
+    my_buffer = make_buffer(1000)
+    assert RadixSort(my_buffer, ('particles', 'key')).shifts == [0, 8, 16, 24]
+    # Passes are rounded up to an even number, so the data ends up in
+    # the array, not in the scratch buffer.
+    assert RadixSort(my_buffer, ('particles', 'key'), key_bits=8).shifts == [0, 8]
+    assert RadixSort(my_buffer, ('particles', 'key'), key_bits=12).shifts == [0, 8]
+    assert RadixSort(my_buffer, ('particles', 'key'), key_bits=20).shifts == [0, 8, 16, 24]
+    assert RadixSort(my_buffer, ('particles', 'signedKey')).shifts == [0, 8, 16, 24]
+    with pytest.raises(AssertionError):
+        RadixSort(my_buffer, ('particles', 'signedKey'), key_bits=16)
+    with pytest.raises(NotImplementedError):
+        RadixSort(my_buffer, ('particles', 'pos'))
+
+
+def test_radix_steps():
+    sorter = RadixSort(make_buffer(1000), ('particles', 'key'), key_bits=16)
+    steps = sorter._steps()
+    assert len(steps) == 2 * 3
+    shaders = [shader for shader, _, _ in steps]
+    assert shaders == [sorter.shader_histogram, sorter.shader_scan, sorter.shader_scatter] * 2
+    assert [workgroups for _, workgroups, _ in steps] == [(4, 1, 1), (1, 1, 1), (4, 1, 1)] * 2
+    for pass_idx, shift in enumerate([0, 8]):
+        for _, _, inputs in (steps[3 * pass_idx], steps[3 * pass_idx + 2]):
+            assert inputs['shift'] == shift
+            assert inputs['fromScratch'] == pass_idx
+            assert inputs['numGroups'] == 4
+    assert sorter.scratch.data_size_bytes == 1000 * 32
+    assert sorter.histograms.data_size_bytes == 256 * 4 * 4
+
+
+def test_radix_resize():
+    my_buffer = make_buffer(1000, unbounded=True)
+    sorter = RadixSort(my_buffer, ('particles', 'key'), key_bits=8)
+    histograms = sorter.histograms
+    my_buffer.resize(10)
+    sorter.resize(my_buffer)
+    assert sorter.histograms is histograms
+    assert sorter.num_groups == 1
+    assert [workgroups for _, workgroups, _ in sorter._steps()] == [(1, 1, 1)] * 6
+    my_buffer.resize(2100)
+    sorter.resize(my_buffer)
+    assert sorter.capacity == 2100
+    assert sorter.num_groups == 9
+    assert sorter.histograms.data_size_bytes == 256 * 4 * 9
+    assert sorter.scratch.data_size_bytes == 2100 * 32
@@ -0,0 +1,98 @@
+import pytest
+from panda3d.core import Shader
+
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.algos.spatial_hash import hashed_index
+from p3d_ssbo.algos.spatial_hash import morton_index
+from p3d_ssbo.algos.spatial_hash import num_cells
+from p3d_ssbo.algos.spatial_hash import SpatialHash
+from p3d_ssbo.algos.spatial_hash import PairwiseAction
+
+
+def test_morton_index():
+    assert morton_index((0, 0, 0)) == 0
+    assert morton_index((1, 0, 0)) == 1
+    assert morton_index((0, 1, 0)) == 2
+    assert morton_index((0, 0, 1)) == 4
+    assert morton_index((3, 3, 3)) == 63
+    assert morton_index((2, 0, 0)) == 8
+    assert morton_index((1023, 1023, 1023)) == (1 << 30) - 1
+
+
+def test_morton_index_unique():
+    indices = {
+        morton_index((x, y, z))
+        for x in range(8) for y in range(8) for z in range(8)
+    }
+    assert indices == set(range(512))
+
+
+def test_num_cells():
+    assert num_cells((16, 8, 4)) == 512
+    assert num_cells((16, 16, 16), 'morton') == 4096
+    # Non-cubic grids leave gaps in the Morton indices.
+    assert num_cells((2, 4, 4), 'morton') == morton_index((1, 3, 3)) + 1
+    assert num_cells((2, 4, 4), 'morton') > 32
+
+
+def test_hashed_index():
+    assert hashed_index((0, 0, 0), 97) == 0
+    assert hashed_index((1, 0, 0), 1 << 20) == 73856093 % (1 << 20)
+    # Negative coordinates wrap around like GLSL's uvec3(ivec3).
+    assert hashed_index((-1, 0, 0), 1000) == ((0xFFFFFFFF * 73856093) & 0xFFFFFFFF) % 1000
+    for cell in [(3, -7, 12), (-100, 5, -3), (1 << 20, 0, 1)]:
+        assert 0 <= hashed_index(cell, 4096) < 4096
+
+
+def test_hashed_table_size():
+    boid = Struct('Boid', GlVec3('pos'), GlUInt('hashIdx'))
+    pivot = Struct('Pivot', GlUInt('start'), GlUInt('len'))
+    data_buffer = Buffer('dataBuffer', boid('boids', 64), pivot('pivot', 100))
+    args = (data_buffer, ('boids', 'pos', 'hashIdx'), (10, 10, 10), (4, 4, 4))
+    SpatialHash(*args, indexing='hashed', table_size=100, pivot_table='pivot')
+    with pytest.raises(AssertionError):
+        SpatialHash(*args, indexing='hashed', table_size=101, pivot_table='pivot')
+    with pytest.raises(AssertionError):
+        PairwiseAction(
+            data_buffer, 'boids', 'pivot', '', '', '',
+            indexing='hashed', table_size=101,
+            src_args=dict(gridRes=(4, 4, 4), gridVol=(10, 10, 10)),
+        )
+
+
+def pairwise_lines(**kwargs):
+    boid = Struct('Boid', GlVec3('pos'), GlUInt('hashIdx'))
+    pivot = Struct('Pivot', GlUInt('start'), GlUInt('len'))
+    data_buffer = Buffer('dataBuffer', boid('boids', 64), pivot('pivot', 64))
+    action = PairwiseAction(
+        data_buffer, 'boids', 'pivot', '', '', '',
+        src_args=dict(gridRes=(4, 4, 4), gridVol=(1, 1, 1)),
+        **kwargs,
+    )
+    source = action.shader.get_text(Shader.ST_compute)
+    return [line.strip() for line in source.split('\n') if 'pairwiseInteraction' in line]
+
+
+def test_pairwise_neighbour():
+    assert pairwise_lines() == [
+        'void pairwiseInteraction(Boid a, Boid b) {',
+        'pairwiseInteraction(a, boids_get(idx));',
+    ]
+    assert pairwise_lines(neighbour_by_index=True) == [
+        'void pairwiseInteraction(Boid a, uint aIdx, uint bIdx) {',
+        'pairwiseInteraction(a, boidIdx, idx);',
+    ]
+
+
+def test_morton_overhead_warning():
+    boid = Struct('Boid', GlVec3('pos'), GlUInt('hashIdx'))
+    data_buffer = Buffer('dataBuffer', boid('boids', 64))
+    args = (data_buffer, ('boids', 'pos', 'hashIdx'), (10, 10, 10))
+    # Cubes use all of the curve, flat grids only a small part of it.
+    SpatialHash(*args, (16, 16, 16), indexing='morton')
+    assert num_cells((64, 64, 1), 'morton') > 8 * 64 * 64
+    with pytest.warns(UserWarning):
+        SpatialHash(*args, (64, 64, 1), indexing='morton')
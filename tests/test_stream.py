@@ -0,0 +1,84 @@
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+particle = Struct(
+    'Particle',
+    GlVec3('pos'),
+    GlFloat('mass', 2),
+    GlUInt('hashIdx'),
+)
+
+
+def spawn(num_particles):
+    for idx in range(num_particles):
+        yield ((idx, idx + 1, idx + 2), (idx * 0.5, idx * 0.25), idx)
+
+
+def test_pack_stream_field():
+    field = GlVec3('pos', 10)
+    py_data = [(idx, idx, idx) for idx in range(10)]
+    assert field.pack_stream(iter(py_data), chunk_size=3) == field.pack(py_data)
+
+
+def test_pack_stream_multidimensional():
+    field = GlFloat('values', 10, 2)
+    py_data = [(idx, -idx) for idx in range(10)]
+    assert field.pack_stream(iter(py_data), chunk_size=4) == field.pack(py_data)
+
+
+@pytest.mark.parametrize('layout', ['aos', 'soa'])
+def test_pack_stream_buffer(layout):
+    my_buffer = Buffer('MyBuffer', particle('particles', 50), GlUInt('count'), layout=layout)
+    expected = my_buffer.pack((list(spawn(50)), 0))
+    byte_data = my_buffer.pack_stream(
+        'particles',
+        spawn(50),
+        chunk_size=7,
+    )
+    assert byte_data == expected
+
+
+@pytest.mark.parametrize('layout', ['aos', 'soa'])
+def test_initial_data_iterator(layout):
+    my_buffer = Buffer(
+        'MyBuffer',
+        particle('particles', 50),
+        GlUInt('count'),
+        layout=layout,
+    )
+    byte_data = bytearray(my_buffer.size())
+    my_buffer.pack_into(byte_data, (spawn(50), 50))
+    assert my_buffer.unpack(byte_data) == (tuple(spawn(50)), 50)
+
+
+@pytest.mark.parametrize('num_particles', [49, 51])
+def test_pack_stream_wrong_length(num_particles):
+    my_buffer = Buffer('MyBuffer', particle('particles', 50))
+    with pytest.raises(AssertionError):
+        my_buffer.pack_stream('particles', spawn(num_particles), chunk_size=7)
+
+
+def test_initial_data_chunk_size():
+    my_buffer = Buffer('MyBuffer', particle('particles', 50), chunk_size=7)
+    byte_data = bytearray(my_buffer.size())
+
+    def is_packed(idx):
+        offset = my_buffer.get_offset(f'particles[{idx}].pos') + 4
+        return byte_data[offset:offset + 4] != bytes(4)
+
+    def checking_spawn():
+        # The y coordinates are never 0, so they show which elements
+        # have been packed when the next one is asked for.
+        for idx, element in enumerate(spawn(50)):
+            assert [is_packed(packed) for packed in range(idx)] == \
+                [packed < idx // 7 * 7 for packed in range(idx)]
+            yield element
+
+    my_buffer.pack_into(byte_data, (checking_spawn(), ))
+    assert my_buffer.unpack(byte_data) == (tuple(spawn(50)), )
@@ -4,6 +4,7 @@ import random
 from panda3d.core import ShaderBuffer
 
 from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
 from p3d_ssbo.gltypes import GlVec3
 
 from p3d_ssbo.gltypes import Struct
@@ -390,3 +391,140 @@ def test_buffer_ssbo_2():
     )
     shader_buffer = my_buffer.ssbo
     assert shader_buffer.data_size_bytes == 800
+
+
+def test_buffer_ssbo_padded():
+    # Buffers are allocated in multiples of 16 bytes.
+    my_buffer = Buffer('MyBuffer', GlFloat('fl', 5))
+    assert my_buffer.size() == 20
+    assert my_buffer.ssbo.data_size_bytes == 32
+    my_buffer = Buffer('MyBuffer', GlFloat('fl', 5), initial_data=[(1, 2, 3, 4, 5)])
+    assert my_buffer.ssbo.data_size_bytes == 32
+    # They can still be bound to a buffer of the same layout.
+    Buffer('MyBuffer', GlFloat('fl', 5), bind_buffer=my_buffer.ssbo)
+
+
+def test_pack_struct_after_array():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlVec3('foo', 2),
+        GlFloat('baz'),
+    )
+    my_struct = my_struct_type('fnord')
+    py_data = (((1, 2, 3), (4, 5, 6)), 7)
+    data_buffer = my_struct.pack(py_data)
+    # The float follows the array's trailing padding.
+    expected_data = array('f', [1, 2, 3, 0, 4, 5, 6, 0, 7]).tobytes()
+    assert data_buffer == expected_data
+    assert my_struct.unpack(data_buffer) == py_data
+
+
+def test_unpack_struct_array_2d():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlFloat('foo'),
+        GlVec3('bar'),
+    )
+    my_struct = my_struct_type('fnord', 2, 5)
+    py_data = tuple(
+        tuple(
+            (float(row * 5 + col), (float(row), float(col), 0.5))
+            for col in range(5)
+        )
+        for row in range(2)
+    )
+    data_buffer = my_struct.pack(py_data)
+    assert len(data_buffer) == my_struct.size() - 4
+    assert my_struct.unpack(data_buffer) == py_data
+
+
+def test_pack_buffer():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlVec3('foo'),
+        GlFloat('bar'),
+    )
+    my_buffer = Buffer(
+        'MyBuffer',
+        GlFloat('baz'),
+        my_struct_type('fnord', 2),
+    )
+    py_data = (
+        0.5,
+        (
+            ((1, 2, 3), 4),
+            ((5, 6, 7), 8),
+        ),
+    )
+    data_buffer = my_buffer.pack(py_data)
+    expected_data = array('f', [0.5, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8]).tobytes()
+    assert data_buffer == expected_data
+    assert len(data_buffer) == my_buffer.size()
+    assert my_buffer.unpack(data_buffer) == py_data
+
+
+def test_pack_into():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlFloat('foo'),
+        GlVec3('bar'),
+    )
+    my_struct = my_struct_type('fnord', 2)
+    py_data = (
+        (1.5, (0.2, 0.4, 0.6)),
+        (0.5, (0.1, 0.3, 0.5)),
+    )
+    byte_data = bytearray(8 + my_struct.size())
+    my_struct.pack_into(memoryview(byte_data), py_data, offset=8)
+    assert byte_data[:8] == b'\x00' * 8
+    assert byte_data[8:-4] == my_struct.pack(py_data)
+    assert my_struct.unpack(byte_data[8:]) == my_struct.unpack(my_struct.pack(py_data))
+
+
+def test_optimize_layout():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlFloat('foo'),
+        GlVec3('bar'),
+        GlUInt('baz'),
+        GlVec3('qux'),
+        optimize_layout=True,
+    )
+    assert my_struct_type.glsl() == (
+        'struct MyStruct {\n'
+        '  vec3 bar;\n'
+        '  float foo;\n'
+        '  vec3 qux;\n'
+        '  uint baz;\n'
+        '};'
+    )
+    assert my_struct_type.bytes_saved == 16
+    my_struct = my_struct_type('fnord', 2)
+    assert my_struct.size() == 64
+    py_data = (
+        (0.5, (1, 2, 3), 7, (4, 5, 6)),
+        (1.5, (8, 9, 10), 11, (12, 13, 14)),
+    )
+    data_buffer = my_struct.pack(py_data)
+    expected_data = (
+        array('f', [1, 2, 3, 0.5, 4, 5, 6]).tobytes()
+        + array('I', [7]).tobytes()
+    )
+    assert data_buffer[:32] == expected_data
+    assert my_struct.unpack(data_buffer) == py_data
+    view = my_struct.view(data_buffer)
+    assert view[1].baz == 11
+    assert view[1].keys() == ['foo', 'bar', 'baz', 'qux']
+    assert view[1].unpack() == py_data[1]
+
+
+def test_optimize_layout_keeps_order():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlVec3('foo'),
+        GlFloat('bar'),
+        GlVec3('baz'),
+        optimize_layout=True,
+    )
+    assert my_struct_type.fields == my_struct_type.declared_fields
+    assert my_struct_type.bytes_saved == 0
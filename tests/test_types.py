@@ -0,0 +1,119 @@
+from array import array
+import struct
+
+import numpy as np
+
+from panda3d.core import Mat4
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlInt
+from p3d_ssbo.gltypes import GlDouble
+from p3d_ssbo.gltypes import GlVec2
+from p3d_ssbo.gltypes import GlVec4
+from p3d_ssbo.gltypes import GlIVec3
+from p3d_ssbo.gltypes import GlUVec2
+from p3d_ssbo.gltypes import GlDVec3
+from p3d_ssbo.gltypes import GlMat3
+from p3d_ssbo.gltypes import GlMat4
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+def test_glsl_types():
+    assert GlInt('foo').glsl() == 'int foo;'
+    assert GlIVec3('foo', 2).glsl() == 'ivec3 foo[2];'
+    assert GlMat3('foo').glsl() == 'mat3 foo;'
+    assert GlDVec3('foo').glsl() == 'dvec3 foo;'
+
+
+def test_size_types():
+    assert GlVec4('foo', 3).size() == 48
+    assert GlMat3('foo').size() == 48
+    assert GlMat4('foo', 2).size() == 128
+    assert GlDouble('foo', 3).size() == 24
+    assert GlDVec3('foo', 2).size() == 64
+
+
+def test_pack_vec2_alignment():
+    # vec2 aligns to two floats, not four.
+    my_struct_type = Struct(
+        'MyStruct',
+        GlFloat('foo'),
+        GlVec2('bar'),
+        GlVec2('baz'),
+    )
+    my_struct = my_struct_type('fnord')
+    data_buffer = my_struct.pack((1, (2, 3), (4, 5)))
+    assert data_buffer == array('f', [1, 0, 2, 3, 4, 5]).tobytes()
+
+
+def test_vec2_offsets():
+    my_buffer = Buffer(
+        'MyBuffer',
+        GlFloat('a'),
+        GlVec2('p'),
+        GlVec2('q', 3),
+        GlFloat('b'),
+    )
+    assert my_buffer.get_offset('p') == 8
+    assert my_buffer.get_offset('q') == 16
+    assert my_buffer.get_stride('q') == 8
+    assert my_buffer.get_offset('b') == 40
+    assert my_buffer.size() == 48
+
+
+def test_pack_int_types():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlIVec3('foo'),
+        GlInt('bar'),
+        GlUVec2('baz'),
+    )
+    my_struct = my_struct_type('fnord')
+    py_data = ((-1, 2, -3), -4, (5, 6))
+    data_buffer = my_struct.pack(py_data)
+    assert data_buffer == struct.pack('<3ii2I', -1, 2, -3, -4, 5, 6)
+    assert my_struct.unpack(data_buffer) == py_data
+
+
+def test_pack_mat3():
+    field = GlMat3('foo', 2)
+    py_data = (
+        ((1, 2, 3), (4, 5, 6), (7, 8, 9)),
+        ((10, 11, 12), (13, 14, 15), (16, 17, 18)),
+    )
+    data_buffer = field.pack(py_data)
+    # Columns are padded like vec3 array elements.
+    assert data_buffer[:48] == array(
+        'f', [1, 2, 3, 0, 4, 5, 6, 0, 7, 8, 9, 0],
+    ).tobytes()
+    assert field.unpack(data_buffer) == py_data
+
+
+def test_pack_mat4_panda3d():
+    matrix = Mat4.translate_mat(1, 2, 3)
+    data_buffer = GlMat4('foo').pack(matrix)
+    py_data = GlMat4('foo').unpack(data_buffer)
+    assert py_data[3] == (1, 2, 3, 1)
+
+
+def test_pack_double():
+    my_struct_type = Struct(
+        'MyStruct',
+        GlDVec3('foo'),
+        GlDouble('bar'),
+        GlFloat('baz'),
+    )
+    my_struct = my_struct_type('fnord', 2)
+    # The double goes into the dvec3's tail, the struct aligns to 32
+    # bytes.
+    assert my_struct.get_stride() == 64
+    py_data = (((1, 2, 3), 4, 5), ((6, 7, 8), 9, 10))
+    data_buffer = my_struct.pack(py_data)
+    assert data_buffer[:36] == struct.pack('<4df', 1, 2, 3, 4, 5)
+    assert my_struct.unpack(data_buffer) == py_data
+
+
+def test_dtype_padded_double_array():
+    dtype = GlDVec3('foo', 2).numpy_dtype()
+    assert dtype == np.dtype(('<f8', (4,)))
@@ -0,0 +1,64 @@
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+from p3d_ssbo.gltypes import ArrayView
+from p3d_ssbo.gltypes import StructView
+
+
+boid = Struct(
+    'Boid',
+    GlVec3('pos'),
+    GlVec3('dir'),
+    GlUInt('hashIdx'),
+)
+my_buffer = Buffer(
+    'MyBuffer',
+    GlFloat('scale'),
+    boid('boids', 50),
+    GlFloat('grid', 2, 3),
+)
+py_data = (
+    2.0,
+    tuple(
+        ((i, i + 0.5, i + 0.25), (-i, 0, 1), i * 7)
+        for i in range(50)
+    ),
+    ((1, 2, 3), (4, 5, 6)),
+)
+byte_data = my_buffer.pack(py_data)
+
+
+def test_view_buffer():
+    view = my_buffer.view(byte_data)
+    assert isinstance(view, StructView)
+    assert view['scale'] == 2.0
+    assert view.scale == 2.0
+    assert view.keys() == ['scale', 'boids', 'grid']
+
+
+def test_view_struct_array():
+    boids = my_buffer.view(byte_data)['boids']
+    assert isinstance(boids, ArrayView)
+    assert len(boids) == 50
+    assert boids[42]['pos'] == (42, 42.5, 42.25)
+    assert boids[42].hashIdx == 294
+    assert boids[-1].dir == (-49, 0, 1)
+    assert boids[1:3][1].unpack() == py_data[1][2]
+
+
+def test_view_2d_array():
+    grid = my_buffer.view(byte_data).grid
+    assert grid[1][2] == 6
+    assert grid.unpack() == py_data[2]
+
+
+def test_view_unpack():
+    assert my_buffer.view(byte_data).unpack() == my_buffer.unpack(byte_data)
+
+
+def test_view_field():
+    boids = boid('boids', 50)
+    view = boids.view(my_buffer.pack(py_data)[16:])
+    assert view[3].pos == (3, 3.5, 3.25)
@@ -0,0 +1,72 @@
+from array import array
+
+import numpy as np
+import pytest
+
+from p3d_ssbo.gltypes import GlFloat
+from p3d_ssbo.gltypes import GlUInt
+from p3d_ssbo.gltypes import GlVec3
+from p3d_ssbo.gltypes import Struct
+from p3d_ssbo.gltypes import Buffer
+
+
+def make_buffer():
+    boid = Struct(
+        'Boid',
+        GlVec3('pos'),
+        GlVec3('dir'),
+        GlUInt('hashIdx'),
+    )
+    return Buffer(
+        'MyBuffer',
+        GlFloat('scale', 4),
+        boid('boids', 10),
+    )
+
+
+def test_write_field_range():
+    my_buffer = make_buffer()
+    my_buffer.write('boids', slice(2, 4), field='pos', data=[(1, 2, 3), (4, 5, 6)])
+    indices, words = my_buffer.pop_pending_writes()
+    # boids start at word 4, and are 8 words long.
+    assert indices.tolist() == [20, 21, 22, 28, 29, 30]
+    assert words.tobytes() == array('f', [1, 2, 3, 4, 5, 6]).tobytes()
+    assert not my_buffer.has_pending_writes()
+
+
+def test_write_element():
+    my_buffer = make_buffer()
+    my_buffer.write('boids', 1, data=((1, 2, 3), (4, 5, 6), 7))
+    indices, words = my_buffer.pop_pending_writes()
+    assert indices.tolist() == list(range(12, 20))
+    expected_words = array('f', [1, 2, 3, 0, 4, 5, 6]).tobytes()
+    expected_words += array('I', [7]).tobytes()
+    assert words.tobytes() == expected_words
+
+
+def test_write_negative_index():
+    my_buffer = make_buffer()
+    my_buffer.write('boids', -1, field='hashIdx', data=7)
+    indices, words = my_buffer.pop_pending_writes()
+    assert indices.tolist() == [4 + 9 * 8 + 7]
+    assert words.tolist() == [7]
+    with pytest.raises(IndexError):
+        my_buffer.write('boids', 10, field='hashIdx', data=7)
+    with pytest.raises(IndexError):
+        my_buffer.write('boids', -11, field='hashIdx', data=7)
+
+
+def test_write_field_of_scalar_array():
+    my_buffer = make_buffer()
+    with pytest.raises(ValueError):
+        my_buffer.write('scale', slice(0, 2), field='x', data=[1, 2])
+    assert not my_buffer.has_pending_writes()
+
+
+def test_write_overlapping():
+    my_buffer = make_buffer()
+    my_buffer.write('scale', slice(0, 4), data=np.ones(4))
+    my_buffer.write('scale', 2, data=0.5)
+    indices, words = my_buffer.pop_pending_writes()
+    assert indices.tolist() == [0, 1, 2, 3]
+    assert words.tobytes() == array('f', [1, 1, 0.5, 1]).tobytes()